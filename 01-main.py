@@ -1,54 +1,105 @@
 import os
+import sys
+import time
+import argparse
 from shutil import copyfile
 import yaml
 
+# make the step modules in python/ importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'python'))
+from scheduler import run_steps, print_timings
+from source_data import plan_sources, prepare_sources, evict_sources
+
 # Set the environment variable in your code
 # os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = "C:/Users/Owner/OneDrive/Documents/Career/World Bank/CRP/other/google-cloud-city-scan-service-account-key.json"
 
-# load city inputs files, to be updated for each city scan
-with open("mnt/01-user-input/city_inputs.yml", 'r') as f:
-    city_inputs = yaml.safe_load(f)
-city_name_l = city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
-
-# make city directory
-os.makedirs(f'mnt/city-directories/{city_name_l}/01-user-input/AOI', exist_ok=True)
-os.makedirs(f'mnt/city-directories/{city_name_l}/02-process-output', exist_ok=True)
-os.makedirs(f'mnt/city-directories/{city_name_l}/03-render-output', exist_ok=True)
-
-# copy AOI into city directory
-shp_suf0 = ['shp', 'shx', 'dbf']
-shp_suf1 = ['prj', 'sbn', 'sbx', 'fbn', 'fbx', 'ain', 'aih', 'ixs', 'mxs', 'atx', 'shp.xml', 'cpg', 'qix', 'idx', 'qmd']
-for suf in shp_suf0:
-    copyfile(f'mnt/01-user-input/AOI/{city_inputs["AOI_shp_name"]}.{suf}', f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{city_name_l}.{suf}')
-for suf in shp_suf1:
-    orig_file = f'mnt/01-user-input/AOI/{city_inputs["AOI_shp_name"]}.{suf}'
-    if os.path.exists(orig_file):
-        copyfile(orig_file, f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{city_name_l}.{suf}')
-
-# copy city inputs into city directory
-copyfile("mnt/01-user-input/city_inputs.yml", f'mnt/city-directories/{city_name_l}/01-user-input/city_inputs.yml')
-
-script_list = ["burned_area.py",
-               'cyclone.py',
-               'fwi.py',
-               "gee_forest.py",
-               "gee_landcover.py",
-               "gee_lst_winter.py",
-               "gee_lst.py",
-               "gee_ndmi.py",
-               "gee_ndvi.py",
-               "gee_nightlight.py",
-               "landcover_burnability.py",
-               "osm_poi.py",
-               "raster_processing.py",
-               "road_network.py",
-               "rwi.py",
-               "soil_salinity.py",
-               "contour_elev_stats.py",
-               'slope.py',
-               'flood_stats.py'
-               ]
-
-for s in script_list:
-    with open(f'python/{s}') as f:
-        exec(f.read())
+def setup_city(city_inputs_file):
+    # load city inputs files, to be updated for each city scan
+    with open(city_inputs_file, 'r') as f:
+        city_inputs = yaml.safe_load(f)
+    city_name_l = city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
+
+    # make city directory
+    os.makedirs(f'mnt/city-directories/{city_name_l}/01-user-input/AOI', exist_ok=True)
+    os.makedirs(f'mnt/city-directories/{city_name_l}/02-process-output', exist_ok=True)
+    os.makedirs(f'mnt/city-directories/{city_name_l}/03-render-output', exist_ok=True)
+
+    # copy AOI into city directory
+    shp_suf0 = ['shp', 'shx', 'dbf']
+    shp_suf1 = ['prj', 'sbn', 'sbx', 'fbn', 'fbx', 'ain', 'aih', 'ixs', 'mxs', 'atx', 'shp.xml', 'cpg', 'qix', 'idx', 'qmd']
+    for suf in shp_suf0:
+        copyfile(f'mnt/01-user-input/AOI/{city_inputs["AOI_shp_name"]}.{suf}', f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{city_name_l}.{suf}')
+    for suf in shp_suf1:
+        orig_file = f'mnt/01-user-input/AOI/{city_inputs["AOI_shp_name"]}.{suf}'
+        if os.path.exists(orig_file):
+            copyfile(orig_file, f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{city_name_l}.{suf}')
+
+    # copy city inputs into city directory
+    copyfile(city_inputs_file, f'mnt/city-directories/{city_name_l}/01-user-input/city_inputs.yml')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type = int, default = None,
+                        help = 'number of steps to run at the same time (default: number of CPUs)')
+    parser.add_argument('--batch', nargs = '+', metavar = 'CITY_INPUTS',
+                        help = 'city_inputs.yml files to scan in one run; AOIs are read from mnt/01-user-input/AOI/')
+    parser.add_argument('--force', action = 'store_true',
+                        help = 'rerun every step, even those whose inputs have not changed since the last run')
+    parser.add_argument('--max-cities', type = int, default = 2,
+                        help = 'in batch mode, number of cities processed at the same time')
+    args = parser.parse_args()
+
+    if args.batch:
+        city_inputs_list = args.batch
+    else:
+        city_inputs_list = ["mnt/01-user-input/city_inputs.yml"]
+
+    for city_inputs_file in city_inputs_list:
+        setup_city(city_inputs_file)
+
+    script_list = ["burned_area.py",
+                   'cyclone.py',
+                   'fwi.py',
+                   "gee_forest.py",
+                   "gee_landcover.py",
+                   "gee_lst_winter.py",
+                   "gee_lst.py",
+                   "gee_ndmi.py",
+                   "gee_ndvi.py",
+                   "gee_nightlight.py",
+                   "landcover_burnability.py",
+                   "osm_poi.py",
+                   "raster_processing.py",
+                   "road_network.py",
+                   "rwi.py",
+                   "soil_salinity.py",
+                   "contour_elev_stats.py",
+                   'slope.py',
+                   'flood_stats.py'
+                   ]
+
+    start = time.time()
+
+    with open("mnt/01-user-input/menu.yml", 'r') as f:
+        menu = yaml.safe_load(f)
+
+    # in batch mode, download and mosaic the source data shared between cities once, before any city runs
+    if args.batch:
+        if menu['raster_processing']:
+            failed = prepare_sources(plan_sources(city_inputs_list, menu))
+            if failed:
+                print('failed source data preparation:')
+                print(failed)
+
+        timings, failed = run_steps(script_list, max_workers = args.workers, city_inputs_list = city_inputs_list, max_cities = args.max_cities, force = args.force)
+    else:
+        # make room in the source data cache for this city; raster_processing.py downloads what is missing
+        if menu['raster_processing']:
+            evict_sources(plan_sources(city_inputs_list, menu))
+
+        # run independent steps in parallel; see STEP_DEPENDENCIES in python/scheduler.py
+        timings, failed = run_steps(script_list, max_workers = args.workers, force = args.force)
+
+    print_timings(timings, failed)
+    print(f'total wall time: {time.time() - start:.1f} s')
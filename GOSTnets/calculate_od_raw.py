@@ -10,7 +10,7 @@ from shapely.geometry import Point
 from .core import pandana_snap
 from .core import calculate_OD as calc_od
 
-def calculateOD_gdf(G, origins, destinations, fail_value=-1, weight="time", calculate_snap=False, wgs84 = {'init':'epsg:4326'}):
+def calculateOD_gdf(G, origins, destinations, fail_value=-1, weight="time", calculate_snap=False, wgs84 = {'init':'epsg:4326'}, engine='networkx', workers=1):
     ''' Calculate Origin destination matrix from GeoDataframes
     
     Args:
@@ -19,6 +19,8 @@ def calculateOD_gdf(G, origins, destinations, fail_value=-1, weight="time", calc
         destinations (geopandas dataframe): destination locations for calculating access
         calculate_snap (boolean, optioinal): variable to add snapping distance to travel time, default is false
         wgs84 (CRS dictionary, optional): CRS fo road network to which the GDFs are projected
+        engine (string, optional): shortest path engine of calculate_OD, 'networkx' (default) or 'csr'
+        workers (int, optional): worker processes of the 'csr' engine, default is 1
     Returns:
         numpy array: 2d OD matrix with columns as index of origins and rows as index of destinations
     '''
@@ -31,7 +33,7 @@ def calculateOD_gdf(G, origins, destinations, fail_value=-1, weight="time", calc
     destinations = pandana_snap(G, destinations)
     oNodes = origins['NN'].unique()
     dNodes = destinations['NN'].unique()
-    od = calc_od(G, oNodes, dNodes, fail_value)
+    od = calc_od(G, oNodes, dNodes, fail_value, engine = engine, workers = workers)
     origins['OD_O'] = origins['NN'].apply(lambda x: np.where(oNodes==x)[0][0])
     destinations['OD_D'] = destinations['NN'].apply(lambda x: np.where(dNodes==x)[0][0])
     outputMatrix = od[origins['OD_O'].values,:][:,destinations['OD_D'].values]
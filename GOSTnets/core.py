@@ -16,6 +16,9 @@ from collections import Counter
 
 import math
 
+from .od_engine import shortest_path_lengths
+from .routing_index import routing_index, routing_index_path
+
 def combo_csv_to_graph(fpath, u_tag = 'u', v_tag = 'v', geometry_tag = 'Wkt', largest_G = False):
     """
     Function for generating a G object from a saved combo .csv
@@ -1192,7 +1195,7 @@ def assign_traffic_times(G, mb_token, accepted_road_types = ['trunk','trunk_link
 
     return G
 
-def calculate_OD(G, origins, destinations, fail_value, weight = 'time', weighted_origins = False, one_way_roads_exist = False, verbose = False):
+def calculate_OD(G, origins, destinations, fail_value, weight = 'time', weighted_origins = False, one_way_roads_exist = False, verbose = False, engine = 'networkx', workers = 1):
     """
     Function for generating an origin: destination matrix
 
@@ -1201,10 +1204,16 @@ def calculate_OD(G, origins, destinations, fail_value, weight = 'time', weighted
     :param origins: a list of the node IDs to treat as origins points
     :param destinations: a list of the node IDs to treat as destinations
     :param weight: use edge weight of 'time' unless otherwise specified
-    :param weighted_origins: equals 'true' if the origins have weights. If so, the input to 'origins' must be dictionary instead of a list, where the keys are the origin IDs and the values are the weighted demands.
+    :param weighted_origins: equals 'true' if the origins have weights. If so, the input to 'origins' must be dictionary instead of a list, where the keys are the origin IDs and the values are the weighted demands. Each origin's row of shortest times is multiplied by its weight; trips that cannot be completed get fail_value, unweighted.
     :one_way_roads_exist: If the value is 'True', then even if there are more origins than destinations, it will not do a flip during processing.
+    :param engine: 'networkx' runs networkx's Dijkstra from each origin in Python; 'csr' converts the graph once to a CSR adjacency matrix and runs scipy's compiled Dijkstra for blocks of origins (see od_engine.py), which is much faster on large networks with many origins
+    :param workers: with the 'csr' engine, the number of worker processes that search blocks of origins, sharing the graph's CSR arrays in shared memory; the matrix is the same for any number of workers
     :returns: a numpy matrix of format OD[o][d] = shortest time possible
     """
+    if engine not in ['networkx', 'csr']:
+        raise ValueError(f"engine must be 'networkx' or 'csr', not {engine!r}")
+    if workers > 1 and engine != 'csr':
+        raise ValueError("workers > 1 requires engine = 'csr'")
 
     # Error checking
     G_edges = edge_gdf_from_graph(G)
@@ -1217,25 +1226,14 @@ def calculate_OD(G, origins, destinations, fail_value, weight = 'time', weighted
     if len(G_edges.loc[G_edges['endnode'].isnull()]) > 0:
         raise ValueError('One or more of your edges has a null endnode')
 
-    count = 0
-    start = time.time()
-
     if weighted_origins == True:
         print('weighted_origins equals true')
-        OD = np.zeros((len(origins), len(destinations)))
-        #dictionary key length
-        o = 0
-        #loop through dictionary
-        for key,value in origins.items():
-            origin = key
-            for d in range(0,len(destinations)):
-                destination = destinations[d]
-                #find the shortest distance between the origin and destination
-                distance = nx.dijkstra_path_length(G, origin, destination, weight = weight)
-                # calculate weighted distance
-                weighted_distance = distance * float(value)
-                OD[o][d] = weighted_distance
-            o += 1
+        origin_weights = np.array([float(value) for value in origins.values()])
+        origins = list(origins.keys())
+        # one search per origin, as for unweighted origins, then each origin's row is scaled by its weight;
+        # unreachable pairs stay inf until then, so that they get the unweighted fail_value
+        OD = shortest_path_lengths(G, origins, destinations, np.inf, weight, engine, verbose, workers)
+        OD = np.where(np.isfinite(OD), OD * origin_weights[:, np.newaxis], fail_value)
 
     else:
         flip = 0
@@ -1247,28 +1245,7 @@ def calculate_OD(G, origins, destinations, fail_value, weight = 'time', weighted
                 origins = o_2
 
         #origins will be number or rows, destinations will be number of columns
-        OD = np.zeros((len(origins), len(destinations)))
-
-        for o in range(0, len(origins)):
-            origin = origins[o]
-
-            if count % 1000 == 0 and verbose == True:
-                print("Processing %s of %s" % (count, len(origins)))
-                print('seconds elapsed: ' + str(time.time() - start))
-            count += 1
-
-            try:
-                results_dict = nx.single_source_dijkstra_path_length(G, origin, cutoff = None, weight = weight)
-            except Exception as e:
-                print(f"error: printing origin: {origin}")
-                print(e)
-
-            for d in range(0, len(destinations)):
-                destination = destinations[d]
-                if destination in results_dict.keys():
-                    OD[o][d] = results_dict[destination]
-                else:
-                    OD[o][d] = fail_value
+        OD = shortest_path_lengths(G, origins, destinations, fail_value, weight, engine, verbose, workers)
 
         if flip == 1:
             OD = np.transpose(OD)
@@ -1402,7 +1379,7 @@ def unbundle_geometry(c):
     else:
         return c
 
-def save(G, savename, wpath, pickle = True, edges = True, nodes = True):
+def save(G, savename, wpath, pickle = True, edges = True, nodes = True, routing_weight = None):
     """
     function used to save a graph object in a variety of handy formats
 
@@ -1412,6 +1389,7 @@ def save(G, savename, wpath, pickle = True, edges = True, nodes = True):
     :param pickle: if set to false, will not save a pickle of the graph
     :param edges: if set to false, will not save an edge gdf
     :param nodes: if set to false, will not save a node gdf
+    :param routing_weight: if set to an edge attribute, e.g. 'time', also saves a routing index for it next to the graph (see routing_index.py)
     """
 
     if nodes == True:
@@ -1422,6 +1400,8 @@ def save(G, savename, wpath, pickle = True, edges = True, nodes = True):
         new_edge_gdf.to_csv(os.path.join(wpath, '%s_edges.csv' % savename))
     if pickle == True:
         nx.write_gpickle(G, os.path.join(wpath, '%s.pickle' % savename))
+    if routing_weight is not None:
+        routing_index(routing_index_path(savename, wpath, routing_weight), G, routing_weight)
 
 def add_missing_reflected_edges(G, one_way_tag = None, verbose = False):
     """
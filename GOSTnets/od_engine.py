@@ -0,0 +1,204 @@
+#shortest path engines for origin-destination matrices: networkx, and compiled Dijkstra on a CSR adjacency
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+
+def graph_to_csr(G, weight = 'time'):
+    """
+    Converts a graph into a CSR adjacency matrix of its edge weights, with nodes numbered 0..n-1 in G.nodes order. As in networkx's shortest path functions, an edge without the weight attribute has weight 1 and parallel edges keep their smallest weight; undirected graphs get both directions of every edge
+
+    :param G: a graph containing one or more nodes
+    :param weight: the edge attribute to use as weight
+    :returns: the adjacency matrix, and a pandas Index of the node IDs whose positions are the node numbers
+    """
+    node_index = pd.Index(list(G.nodes))
+    edges = list(G.edges(data = weight, default = 1))
+    u = node_index.get_indexer([e[0] for e in edges])
+    v = node_index.get_indexer([e[1] for e in edges])
+    w = np.array([e[2] for e in edges], dtype = np.float64)
+
+    if not G.is_directed():
+        u, v, w = np.concatenate([u, v]), np.concatenate([v, u]), np.concatenate([w, w])
+
+    # keep the lightest of parallel edges: sort by (u, v, weight) and take the first of each (u, v)
+    order = np.lexsort((w, v, u))
+    u, v, w = u[order], v[order], w[order]
+    keep = np.ones(len(u), dtype = bool)
+    keep[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+
+    adjacency = csr_matrix((w[keep], (u[keep], v[keep])), shape = (len(node_index), len(node_index)))
+    return adjacency, node_index
+
+def block_distances(adjacency, sources, d_cols, fail_value):
+    """
+    Shortest path lengths from the source node numbers to the destination node numbers d_cols, with fail_value where there is no path
+    """
+    dist = dijkstra(adjacency, directed = True, indices = sources)[:, d_cols]
+    dist[np.isinf(dist)] = fail_value
+    return dist
+
+def share_csr(adjacency):
+    """
+    Copies the arrays of a CSR adjacency into shared memory, once, for worker processes to attach to (see attach_csr)
+
+    :returns: the SharedMemory segments, to close and unlink when the workers are done, and the spec to pass to attach_csr
+    """
+    segments = []
+    spec = {'shape': adjacency.shape}
+    for name in ['data', 'indices', 'indptr']:
+        array = getattr(adjacency, name)
+        segment = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype = array.dtype, buffer = segment.buf)[:] = array
+        segments.append(segment)
+        spec[name] = (segment.name, array.shape, array.dtype.str)
+    return segments, spec
+
+def attach_csr(spec):
+    """
+    CSR adjacency on the shared memory arrays of share_csr, without copying them
+
+    :returns: the adjacency, and the SharedMemory segments it uses, which must stay open while it is used
+    """
+    segments, arrays = [], {}
+    for name in ['data', 'indices', 'indptr']:
+        segment_name, shape, dtype = spec[name]
+        segment = shared_memory.SharedMemory(name = segment_name)
+        segments.append(segment)
+        arrays[name] = np.ndarray(shape, dtype = dtype, buffer = segment.buf)
+    adjacency = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape = spec['shape'], copy = False)
+    return adjacency, segments
+
+# state of an OD worker process: the shared adjacency, destination node numbers and fail value
+_worker = {}
+
+def _init_worker(spec, d_cols, fail_value):
+    _worker['adjacency'], _worker['segments'] = attach_csr(spec)
+    _worker['d_cols'] = d_cols
+    _worker['fail_value'] = fail_value
+
+def _worker_block(sources):
+    return block_distances(_worker['adjacency'], sources, _worker['d_cols'], _worker['fail_value'])
+
+def csr_OD(adjacency, node_index, origins, destinations, fail_value, block_size = None, verbose = False, workers = 1):
+    """
+    Origin: destination matrix from a CSR adjacency (see graph_to_csr), running scipy's compiled Dijkstra for a block of origins at a time.
+    With several workers, the adjacency's arrays are put in shared memory once and the blocks are searched in worker processes, whose results are written into the matrix as they arrive; every block is searched the same way whatever the number of workers, so the matrix is identical.
+
+    :param adjacency: CSR adjacency matrix of edge weights
+    :param node_index: pandas Index of the node IDs of the adjacency's rows
+    :param origins: a list of the node IDs to treat as origins points
+    :param destinations: a list of the node IDs to treat as destinations
+    :param fail_value: the value to return if the trip cannot be completed, or an origin or destination is not in the graph
+    :param block_size: number of origins searched at once; by default, as many as fit in about 128 MB of distances (for all workers together), and at most a quarter of each worker's share of the origins
+    :param verbose: print progress after each block
+    :param workers: number of worker processes; 1 searches in this process
+    :returns: a numpy matrix of format OD[o][d] = shortest time possible
+    """
+    o_idx = node_index.get_indexer(origins)
+    d_idx = node_index.get_indexer(destinations)
+
+    OD = np.full((len(origins), len(destinations)), fail_value, dtype = np.float64)
+
+    for o in np.flatnonzero(o_idx < 0):
+        print(f"error: printing origin: {origins[o]}")
+        print(f"Node {origins[o]} not found in graph")
+
+    rows = np.flatnonzero(o_idx >= 0)
+    cols = np.flatnonzero(d_idx >= 0)
+    if block_size is None:
+        block_size = max(1, 2**24 // max(adjacency.shape[0], 1) // workers)
+        if workers > 1:
+            block_size = max(1, min(block_size, -(-len(rows) // (4 * workers))))
+
+    # each distinct origin of a block is searched once, even if it is listed several times
+    blocks = []
+    for b in range(0, len(rows), block_size):
+        block = rows[b:b + block_size]
+        sources, inverse = np.unique(o_idx[block], return_inverse = True)
+        blocks.append((block, sources, inverse))
+
+    start = time.time()
+    done = 0
+    if workers > 1 and len(blocks) > 1:
+        segments, spec = share_csr(adjacency)
+        try:
+            with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker, initargs = (spec, d_idx[cols], fail_value)) as executor:
+                futures = {executor.submit(_worker_block, sources): (block, inverse) for block, sources, inverse in blocks}
+                for future in as_completed(futures):
+                    block, inverse = futures[future]
+                    OD[np.ix_(block, cols)] = future.result()[inverse]
+                    done += len(block)
+                    if verbose == True:
+                        print("Processed %s of %s" % (done, len(rows)))
+                        print('seconds elapsed: ' + str(time.time() - start))
+        finally:
+            for segment in segments:
+                segment.close()
+                segment.unlink()
+    else:
+        for block, sources, inverse in blocks:
+            OD[np.ix_(block, cols)] = block_distances(adjacency, sources, d_idx[cols], fail_value)[inverse]
+            done += len(block)
+            if verbose == True:
+                print("Processed %s of %s" % (done, len(rows)))
+                print('seconds elapsed: ' + str(time.time() - start))
+
+    return OD
+
+def networkx_OD(G, origins, destinations, fail_value, weight = 'time', verbose = False):
+    """
+    Origin: destination matrix from one networkx Dijkstra search per origin
+
+    :param G: a graph containing one or more nodes
+    :param origins: a list of the node IDs to treat as origins points
+    :param destinations: a list of the node IDs to treat as destinations
+    :param fail_value: the value to return if the trip cannot be completed, or an origin is not in the graph
+    :param weight: the edge attribute to use as weight
+    :param verbose: print progress every 1000 origins
+    :returns: a numpy matrix of format OD[o][d] = shortest time possible
+    """
+    OD = np.zeros((len(origins), len(destinations)))
+    start = time.time()
+
+    for o in range(0, len(origins)):
+        origin = origins[o]
+
+        if o % 1000 == 0 and verbose == True:
+            print("Processing %s of %s" % (o, len(origins)))
+            print('seconds elapsed: ' + str(time.time() - start))
+
+        try:
+            results_dict = nx.single_source_dijkstra_path_length(G, origin, cutoff = None, weight = weight)
+        except Exception as e:
+            print(f"error: printing origin: {origin}")
+            print(e)
+            results_dict = {}
+
+        for d in range(0, len(destinations)):
+            destination = destinations[d]
+            if destination in results_dict.keys():
+                OD[o][d] = results_dict[destination]
+            else:
+                OD[o][d] = fail_value
+
+    return OD
+
+def shortest_path_lengths(G, origins, destinations, fail_value, weight = 'time', engine = 'networkx', verbose = False, workers = 1):
+    """
+    Origin: destination matrix of shortest path lengths with the networkx or the CSR engine (see calculate_OD)
+
+    :returns: a numpy matrix of format OD[o][d] = shortest time possible
+    """
+    if engine == 'csr':
+        adjacency, node_index = graph_to_csr(G, weight)
+        return csr_OD(adjacency, node_index, origins, destinations, fail_value, verbose = verbose, workers = workers)
+    return networkx_OD(G, origins, destinations, fail_value, weight, verbose)
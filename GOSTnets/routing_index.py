@@ -0,0 +1,177 @@
+#persisted routing index for repeated origin-destination and accessibility queries on the same network
+import os, json, shutil, hashlib
+
+import numpy as np
+import pandas as pd
+
+from scipy.sparse import csr_matrix
+
+from .od_engine import graph_to_csr
+
+# pandana stores impedances as integer thousandths of the weight unit, and returns this for unreachable nodes
+UNREACHABLE = 4294967.295
+
+# indexes loaded in this process, by folder, so the contraction hierarchy is built once per process
+_loaded = {}
+
+class RoutingIndex:
+    """
+    Contraction-hierarchy routing index of a graph, built with pandana.
+
+    The graph's CSR adjacency (see od_engine.graph_to_csr), node IDs and coordinates are saved as .npy files in a folder next to the graph, and memory-mapped when the index is loaded, so the graph itself does not need to be loaded or converted again. pandana cannot save a contraction hierarchy: it is built from these arrays the first time a query needs it, and then reused by every query in the process.
+    Distances are exact to 1/1000 of the weight unit per edge.
+    """
+    arrays = ['node_ids', 'x', 'y', 'indptr', 'indices', 'data']
+
+    def __init__(self, node_ids, x, y, adjacency, weight = 'time'):
+        self.node_index = pd.Index(node_ids)
+        self.x = x
+        self.y = y
+        self.adjacency = adjacency
+        self.weight = weight
+        self._network = None
+        self._precomputed = 0
+
+    @classmethod
+    def from_graph(cls, G, weight = 'time', xCol = 'x', yCol = 'y'):
+        """
+        Builds the index arrays of a graph whose nodes have x and y coordinates
+
+        :param G: a graph containing one or more nodes
+        :param weight: the edge attribute to route on
+        """
+        adjacency, node_index = graph_to_csr(G, weight)
+        x = np.array([G.nodes[n][xCol] for n in node_index], dtype = np.float64)
+        y = np.array([G.nodes[n][yCol] for n in node_index], dtype = np.float64)
+        return cls(node_index.values, x, y, adjacency, weight)
+
+    def fingerprint(self):
+        """sha1 of the weight name and the index arrays, to tell whether a saved index was built from the same graph"""
+        h = hashlib.sha1(self.weight.encode())
+        for a in [np.asarray(self.node_index.astype(str)).astype('U'), self.x, self.y, self.adjacency.indptr, self.adjacency.indices, self.adjacency.data]:
+            h.update(np.ascontiguousarray(a).tobytes())
+        return h.hexdigest()
+
+    def save(self, path):
+        """
+        Saves the index arrays to the folder path, replacing any index there.
+        The arrays are written to a new folder which then takes the place of the old one, so an interrupted save never leaves arrays of two graphs, and files that are memory-mapped (by this or another process) are never overwritten
+        """
+        path = os.path.normpath(path)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        arrays = {'node_ids': np.asarray(self.node_index.values), 'x': self.x, 'y': self.y,
+                  'indptr': self.adjacency.indptr, 'indices': self.adjacency.indices, 'data': self.adjacency.data}
+        for name, array in arrays.items():
+            # node IDs that are not all numbers (e.g. strings) are pickled
+            np.save(os.path.join(tmp_path, '%s.npy' % name), array, allow_pickle = array.dtype == object)
+        meta = {'weight': self.weight, 'shape': list(self.adjacency.shape), 'fingerprint': self.fingerprint(),
+                'pickled_node_ids': bool(arrays['node_ids'].dtype == object)}
+        with open(os.path.join(tmp_path, 'index.json'), 'w') as f:
+            json.dump(meta, f)
+
+        # a folder cannot be renamed over a non-empty one: move the old index aside first, then delete it
+        old_path = '%s.%d.old' % (path, os.getpid())
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index saved by save, memory-mapping its arrays
+        """
+        with open(os.path.join(path, 'index.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, '%s.npy' % name), mmap_mode = 'r') for name in cls.arrays if name != 'node_ids' or not meta['pickled_node_ids']}
+        if meta['pickled_node_ids']:
+            arrays['node_ids'] = np.load(os.path.join(path, 'node_ids.npy'), allow_pickle = True)
+        adjacency = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape = tuple(meta['shape']), copy = False)
+        return cls(arrays['node_ids'], arrays['x'], arrays['y'], adjacency, meta['weight'])
+
+    @property
+    def network(self):
+        """pandana Network of the index, whose contraction hierarchy is built on first use"""
+        if self._network is None:
+            import pandana
+
+            coo = self.adjacency.tocoo()
+            nodes = np.arange(len(self.node_index))
+            self._network = pandana.Network(pd.Series(self.x, index = nodes), pd.Series(self.y, index = nodes),
+                                            pd.Series(coo.row), pd.Series(coo.col), pd.DataFrame({self.weight: coo.data}), twoway = False)
+        return self._network
+
+    def node_numbers(self, node_ids):
+        """Positions of node IDs in the index; raises a ValueError for IDs that are not in the graph"""
+        numbers = self.node_index.get_indexer(node_ids)
+        if (numbers < 0).any():
+            raise ValueError('One or more of your nodes is not in the graph: %s' % list(np.asarray(node_ids)[numbers < 0][:5]))
+        return numbers
+
+    def OD(self, origins, destinations, fail_value):
+        """
+        Origin: destination matrix of shortest path lengths, queried in the contraction hierarchy
+
+        :param origins: a list of the node IDs to treat as origins points
+        :param destinations: a list of the node IDs to treat as destinations
+        :param fail_value: the value to return if the trip cannot be completed
+        :returns: a numpy matrix of format OD[o][d] = shortest time possible
+        """
+        o = self.node_numbers(origins)
+        d = self.node_numbers(destinations)
+        lengths = np.asarray(self.network.shortest_path_lengths(np.repeat(o, len(d)), np.tile(d, len(o)), self.weight), dtype = np.float64)
+        OD = lengths.reshape(len(o), len(d))
+        OD[OD >= UNREACHABLE] = fail_value
+        return OD
+
+    def accessibility(self, pois, distance, values = None, agg = 'sum', decay = 'flat'):
+        """
+        Aggregates values at the pois within distance of every node, e.g. the number of schools within 15 minutes
+
+        :param pois: a list of the node IDs of the points of interest (repeat a node for several pois)
+        :param distance: the search radius, in units of the index's weight
+        :param values: a value per poi; counts the pois if None
+        :param agg: pandana aggregation type, e.g. 'sum', 'count', 'mean', 'min', 'max'
+        :param decay: pandana decay, 'flat', 'linear' or 'exp'
+        :returns: a pandas Series of the aggregate, indexed by node ID
+        """
+        if distance > self._precomputed:
+            self.network.precompute(distance)
+            self._precomputed = distance
+        self.network.set(pd.Series(self.node_numbers(pois)), variable = None if values is None else pd.Series(np.asarray(values, dtype = np.float64)), name = 'pois')
+        result = self.network.aggregate(distance, type = agg, decay = decay, name = 'pois')
+        return pd.Series(result.values, index = self.node_index[result.index.values])
+
+def routing_index_path(savename, wpath, weight = 'time'):
+    """Folder of the routing index of a graph saved with save(G, savename, wpath)"""
+    return os.path.join(wpath, '%s_routing_%s' % (savename, weight))
+
+def routing_index(path, G = None, weight = 'time'):
+    """
+    Routing index saved at path, memory-mapped; built from G and saved first if there is none, or if G is given and has changed. Loaded once per process
+
+    :param path: folder of the index, e.g. routing_index_path(savename, wpath, weight)
+    :param G: the graph of the index; if None, the saved index is used as it is
+    :param weight: the edge attribute to route on
+    :returns: a RoutingIndex
+    """
+    meta_file = os.path.join(path, 'index.json')
+    if G is not None:
+        index = RoutingIndex.from_graph(G, weight)
+        saved = None
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                saved = json.load(f).get('fingerprint')
+        if saved != index.fingerprint():
+            index.save(path)
+            _loaded.pop(path, None)
+    elif not os.path.exists(meta_file):
+        raise ValueError('No routing index at %s; pass the graph to build it' % path)
+
+    if path not in _loaded:
+        _loaded[path] = RoutingIndex.load(path)
+    return _loaded[path]
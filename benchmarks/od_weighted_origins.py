@@ -0,0 +1,79 @@
+# Regression benchmark for calculate_OD with weighted origins.
+# Builds a synthetic grid road network and compares the previous implementation (one networkx
+# Dijkstra per origin-destination pair) with calculate_OD, which runs one search per origin and
+# scales each origin's row by its weight, with the networkx and the CSR engines. It then checks that both
+# engines count an edge without a time as weight 1, as networkx does (calculate_OD rejects such graphs,
+# but the engines are also used directly, e.g. by the routing index).
+#
+#   python benchmarks/od_weighted_origins.py [grid size] [origins] [destinations]
+
+import os
+import sys
+import time
+
+import networkx as nx
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from GOSTnets.core import calculate_OD
+from GOSTnets.od_engine import shortest_path_lengths
+
+
+def grid_network(n, seed = 0):
+    """n x n grid of nodes, 100 m apart, with two-way streets of random speeds; times in seconds"""
+    rng = np.random.default_rng(seed)
+    G = nx.MultiDiGraph()
+    for i in range(n):
+        for j in range(n):
+            G.add_node(i * n + j, x = j * 100.0, y = i * 100.0)
+    for i in range(n):
+        for j in range(n):
+            for di, dj in [(0, 1), (1, 0)]:
+                if i + di < n and j + dj < n:
+                    u, v = i * n + j, (i + di) * n + j + dj
+                    t = 100 / rng.uniform(3, 20)
+                    G.add_edge(u, v, length = 100.0, time = t)
+                    G.add_edge(v, u, length = 100.0, time = t)
+    return G
+
+
+def pairwise_weighted_OD(G, origins, destinations, weight = 'time'):
+    """The previous weighted-origin OD: a full Dijkstra for every cell of the matrix"""
+    OD = np.zeros((len(origins), len(destinations)))
+    for o, (origin, value) in enumerate(origins.items()):
+        for d, destination in enumerate(destinations):
+            OD[o][d] = nx.dijkstra_path_length(G, origin, destination, weight = weight) * float(value)
+    return OD
+
+
+if __name__ == '__main__':
+    n, n_origins, n_destinations = [int(a) for a in sys.argv[1:4]] if len(sys.argv) > 3 else [60, 50, 40]
+
+    G = grid_network(n)
+    rng = np.random.default_rng(1)
+    nodes = np.array(G.nodes)
+    origins = {int(o): float(w) for o, w in zip(rng.choice(nodes, n_origins, replace = False), rng.integers(1, 1000, n_origins))}
+    destinations = [int(d) for d in rng.choice(nodes, n_destinations, replace = False)]
+    print(f'{G.number_of_nodes()} nodes, {G.number_of_edges()} edges, {n_origins} weighted origins x {n_destinations} destinations')
+
+    start = time.time()
+    reference = pairwise_weighted_OD(G, origins, destinations)
+    reference_time = time.time() - start
+    print(f'pairwise dijkstra_path_length: {reference_time:.2f} s')
+
+    for engine in ['networkx', 'csr']:
+        start = time.time()
+        OD = calculate_OD(G, origins, destinations, fail_value = -1, weighted_origins = True, engine = engine)
+        elapsed = time.time() - start
+        assert np.allclose(OD, reference), f'{engine} engine differs from the pairwise result'
+        print(f'calculate_OD, {engine} engine: {elapsed:.2f} s ({reference_time / elapsed:.0f}x faster), same matrix')
+
+    # a spur node that is only reachable through edges without a time attribute
+    spur = G.number_of_nodes()
+    G.add_node(spur, x = -100.0, y = 0.0)
+    G.add_edge(0, spur, length = 100.0)
+    G.add_edge(spur, 0, length = 100.0)
+    nx_OD = shortest_path_lengths(G, list(origins), destinations + [spur], -1, engine = 'networkx')
+    csr_OD = shortest_path_lengths(G, list(origins), destinations + [spur], -1, engine = 'csr')
+    assert np.allclose(nx_OD, csr_OD) and (csr_OD[:, -1] != -1).all(), 'engines differ on edges without a weight'
+    print('edges without a weight: same matrix with both engines')
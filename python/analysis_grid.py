@@ -0,0 +1,105 @@
+# The city's analysis grid: one UTM grid that every projected output is aligned to.
+# The grid covers the AOI buffered by its own largest dimension (the extent of the flood outputs) at
+# a fixed resolution, with its origin snapped to whole multiples of it. It is computed once per AOI
+# and kept in 02-process-output/analysis_grid.json. Outputs use the whole grid or a window of it,
+# so any two of them line up pixel for pixel; sources are brought onto it on the fly through a
+# WarpedVRT, which warps each one once, straight from its original file.
+
+import os
+import json
+import math
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.vrt import WarpedVRT
+from rasterio.enums import Resampling
+from rasterio.warp import transform_bounds
+from rasterio.windows import from_bounds
+
+
+class AnalysisGrid:
+    def __init__(self, crs, transform, width, height):
+        self.crs = CRS.from_user_input(crs)
+        self.transform = transform
+        self.width = width
+        self.height = height
+
+    @property
+    def res(self):
+        return self.transform.a, -self.transform.e
+
+    def meta(self, dtype, nodata = None, count = 1):
+        """Metadata for writing a raster on this grid."""
+        return {'driver': 'GTiff', 'dtype': dtype, 'nodata': nodata, 'count': count,
+                'crs': self.crs, 'transform': self.transform, 'width': self.width, 'height': self.height}
+
+    def window_around(self, features):
+        """The grid's window covering features (a GeoSeries), as a grid of its own."""
+        bounds = transform_bounds(features.crs, self.crs, *features.total_bounds, densify_pts = 21)
+        window = from_bounds(*bounds, transform = self.transform).round_offsets(op = 'floor').round_lengths(op = 'ceil')
+        col_off, row_off = max(int(window.col_off), 0), max(int(window.row_off), 0)
+        width = min(int(window.col_off + window.width), self.width) - col_off
+        height = min(int(window.row_off + window.height), self.height) - row_off
+        return AnalysisGrid(self.crs, self.transform * Affine.translation(col_off, row_off), width, height)
+
+    def warp(self, path, resampling = Resampling.nearest):
+        """All bands of a raster warped onto the grid, and its nodata value."""
+        with rasterio.open(path) as src:
+            with WarpedVRT(src, crs = self.crs, transform = self.transform, width = self.width, height = self.height,
+                           resampling = resampling) as vrt:
+                return vrt.read(), vrt.nodata
+
+    def warp_counts(self, path):
+        """Band 1 of a raster of counts (e.g. population) summed into the grid cells, with nodata as 0.
+        Sum resampling does not keep the total on every GDAL version, so the result is rescaled to the
+        total of the source pixels inside the grid."""
+        with rasterio.open(path) as src:
+            with WarpedVRT(src, crs = self.crs, transform = self.transform, width = self.width, height = self.height,
+                           resampling = Resampling.sum) as vrt:
+                counts = vrt.read(1, masked = True).astype(np.float64).filled(0)
+            bounds = transform_bounds(self.crs, src.crs, *rasterio.transform.array_bounds(self.height, self.width, self.transform), densify_pts = 21)
+            window = from_bounds(*bounds, transform = src.transform).round_offsets(op = 'floor').round_lengths(op = 'ceil')
+            source = src.read(1, window = window, masked = True, boundless = True).astype(np.float64)
+        counts[np.isnan(counts)] = 0
+        source_total, warped_total = np.nansum(source.filled(0)), counts.sum()
+        if warped_total > 0:
+            counts *= source_total / warped_total
+        return counts
+
+    def to_dict(self):
+        return {'crs': self.crs.to_wkt(), 'transform': list(self.transform)[:6], 'width': self.width, 'height': self.height}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['crs'], Affine(*d['transform']), d['width'], d['height'])
+
+
+def build_grid(aoi, utm_crs, resolution):
+    """Grid in utm_crs covering the AOI buffered by its largest dimension, snapped to resolution."""
+    xmin, ymin, xmax, ymax = aoi.total_bounds
+    buffered = aoi.buffer(max(xmax - xmin, ymax - ymin))
+    left, bottom, right, top = transform_bounds(aoi.crs, utm_crs, *buffered.total_bounds, densify_pts = 21)
+    left, bottom = math.floor(left / resolution) * resolution, math.floor(bottom / resolution) * resolution
+    right, top = math.ceil(right / resolution) * resolution, math.ceil(top / resolution) * resolution
+    return AnalysisGrid(utm_crs, Affine(resolution, 0, left, 0, -resolution, top),
+                        int(round((right - left) / resolution)), int(round((top - bottom) / resolution)))
+
+
+def load_grid(grid_file, aoi, utm_crs, resolution):
+    """The registered grid of a city, rebuilt when the AOI, UTM zone or resolution changed."""
+    key = {'aoi_bounds': [float(b) for b in np.asarray(aoi.total_bounds)], 'utm_crs': utm_crs, 'resolution': resolution}
+    try:
+        with open(grid_file, 'r') as f:
+            registered = json.load(f)
+        if registered['key'] == key:
+            return AnalysisGrid.from_dict(registered['grid'])
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    grid = build_grid(aoi, utm_crs, resolution)
+    tmp_file = f'{grid_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({'key': key, 'grid': grid.to_dict()}, f, indent = 1)
+    os.replace(tmp_file, grid_file)
+    return grid
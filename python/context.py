@@ -0,0 +1,100 @@
+# Shared run context for the processing steps.
+# Every step in python/ exposes run(context). The context is built once per city and process,
+# and holds the parsed inputs, the AOI in EPSG:4326, the UTM CRS, the output folders and
+# any rasters already read or written during the run, so later steps reuse them from memory.
+# Steps can still be run on their own, e.g. `python python/fwi.py` from the repository root.
+
+import os
+import math
+import yaml
+from pathlib import Path
+
+
+class MissingInputError(Exception):
+    """Raised by a step when an input it needs does not exist."""
+
+
+class RunContext:
+    def __init__(self, city_inputs_file = None):
+        # load menu
+        with open("mnt/01-user-input/menu.yml", 'r') as f:
+            self.menu = yaml.safe_load(f)
+
+        # load city inputs files, to be updated for each city scan
+        # batch runs point CITY_INPUTS at each city's own file
+        self.city_inputs_file = city_inputs_file or os.environ.get('CITY_INPUTS', "mnt/01-user-input/city_inputs.yml")
+        with open(self.city_inputs_file, 'r') as f:
+            self.city_inputs = yaml.safe_load(f)
+
+        self.city_name_l = self.city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
+
+        # load global inputs, such as data sources that generally remain the same across scans
+        with open("python/global_inputs.yml", 'r') as f:
+            self.global_inputs = yaml.safe_load(f)
+
+        # Define output folder ---------
+        self.output_folder_parent = Path(f'mnt/city-directories/{self.city_name_l}/02-process-output')
+        self.output_folder_s = self.output_folder_parent / 'spatial'
+        self.output_folder_t = self.output_folder_parent / 'tabular'
+        os.makedirs(self.output_folder_s, exist_ok=True)
+        os.makedirs(self.output_folder_t, exist_ok=True)
+
+        self._aoi = None
+        self._analysis_grid = None
+        self.rasters = {}
+
+    # AOI ############################################
+    @property
+    def aoi(self):
+        """AOI shapefile copied into the city directory, transformed to EPSG:4326. Read once per context."""
+        if self._aoi is None:
+            import geopandas as gpd
+
+            self._aoi = gpd.read_file(f'mnt/city-directories/{self.city_name_l}/01-user-input/AOI/{self.city_name_l}.shp').to_crs(epsg = 4326)
+        return self._aoi
+
+    @property
+    def features(self):
+        return self.aoi.geometry
+
+    @property
+    def aoi_bounds(self):
+        return self.aoi.bounds
+
+    @property
+    def utm_crs(self):
+        # calculate UTM zone from avg longitude to define CRS to project to
+        avg_lng = self.features.union_all().centroid.x
+        utm_zone = math.floor((avg_lng + 180) / 6) + 1
+        return f"+proj=utm +zone={utm_zone} +ellps=WGS84 +datum=WGS84 +units=m +no_defs"
+
+    @property
+    def analysis_grid(self):
+        """The city's UTM analysis grid (see analysis_grid.py); analysis_grid_resolution in global_inputs.yml is in metres."""
+        if self._analysis_grid is None:
+            from analysis_grid import load_grid
+
+            self._analysis_grid = load_grid(self.output_folder_parent / 'analysis_grid.json', self.aoi, self.utm_crs,
+                                            self.global_inputs.get('analysis_grid_resolution') or 30)
+        return self._analysis_grid
+
+    # RASTERS ########################################
+    # arrays are cached read-only so that no step modifies another step's copy in place;
+    # copy an array before editing it
+    def read_raster(self, path, band = 1):
+        """Return (array, meta) of one band of a raster, reading it from disk only the first time."""
+        key = (str(path), band, os.stat(path).st_mtime_ns)
+        if key not in self.rasters:
+            import rasterio
+
+            with rasterio.open(path) as src:
+                array = src.read(band)
+                meta = src.meta.copy()
+            self.cache_raster(path, array, meta, band)
+        return self.rasters[key]
+
+    def cache_raster(self, path, array, meta, band = 1):
+        """Keep an array that was just written to path, so later steps do not read it back from disk."""
+        array = array[band - 1] if array.ndim == 3 else array.view()
+        array.flags.writeable = False
+        self.rasters[(str(path), band, os.stat(path).st_mtime_ns)] = (array, meta)
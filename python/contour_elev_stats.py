@@ -1,11 +1,13 @@
-# DETERMINE WHETHER TO RUN THIS SCRIPT ##############
-import yaml
+from context import RunContext, MissingInputError
 
-# load menu
-with open("mnt/01-user-input/menu.yml", 'r') as f:
-    menu = yaml.safe_load(f)
 
-if menu['raster_processing'] and menu['elevation']:
+def run(context):
+    # DETERMINE WHETHER TO RUN THIS SCRIPT ##############
+    menu = context.menu
+
+    if not (menu['raster_processing'] and menu['elevation']):
+        return
+
     print('run contour')
     
     # SET UP ##############################################
@@ -14,41 +16,30 @@ if menu['raster_processing'] and menu['elevation']:
     from pathlib import Path
     import math
     import csv
-    import numpy as np
-    import matplotlib.pyplot as plt
-    from shapely.geometry import LineString
     import geopandas as gpd
-    import rasterio
-
-    # load city inputs files, to be updated for each city scan
-    with open("mnt/01-user-input/city_inputs.yml", 'r') as f:
-        city_inputs = yaml.safe_load(f)
-
-    city_name_l = city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
+    from zonal import histogram
+    from contours import contour_lines
 
-    # load global inputs, such as data sources that generally remain the same across scans
-    with open("python/global_inputs.yml", 'r') as f:
-        global_inputs = yaml.safe_load(f)
+    city_inputs = context.city_inputs
+    city_name_l = context.city_name_l
+    global_inputs = context.global_inputs
 
     # Define output folder ---------
-    output_folder_parent = Path(f'mnt/city-directories/{city_name_l}/02-process-output')
-    output_folder_s = output_folder_parent / 'spatial'
-    output_folder_t = output_folder_parent / 'tabular'
-    os.makedirs(output_folder_t, exist_ok=True)
+    output_folder_s = context.output_folder_s
+    output_folder_t = context.output_folder_t
 
     # Check if elevation raster exists ------------
     if not exists(output_folder_s / f'{city_name_l}_elevation.tif'):
-        print('cannot generate contour lines or elevantion stats because elevation raster does not exist')
-        exit()
+        raise MissingInputError('cannot generate contour lines or elevantion stats because elevation raster does not exist')
     
 
     # CONTOUR ##############################################
     print('generate contour lines')
 
-    with rasterio.open(output_folder_s / f'{city_name_l}_elevation.tif') as src:
-        elevation_data = src.read(1)
-        transform = src.transform
-        demNan = src.nodata if src.nodata else -9999
+    # reuses the clip from raster_processing.py if it ran in the same process
+    elevation_data, elevation_meta = context.read_raster(output_folder_s / f'{city_name_l}_elevation.tif')
+    transform = elevation_meta['transform']
+    demNan = elevation_meta['nodata'] if elevation_meta['nodata'] else -9999
     
     # Get min and max elevation values
     demMax = elevation_data.max()
@@ -72,27 +63,12 @@ if menu['raster_processing'] and menu['elevation']:
     else:
         contour_levels = range(contourMin, contourMax + contourInt, contourInt)
 
-    # Generate contour lines using plt.contour
-    contours = plt.contour(elevation_data, levels=contour_levels)
-
-    # Convert contours to Shapely geometries (LineStrings)
-    contour_lines = []
-    for level, segments in zip(contours.levels, contours.allsegs):
-        if len(segments) == 0:  # Skip levels with no segments
-            continue
-
-        for segment in segments:  # Iterate over line segments at this level
-            if len(segment) > 1:  # Ensure valid line strings with enough points
-                # Convert segment coordinates from pixel space to geographic coordinates
-                geographic_line = [
-                    (transform * (x, y)) for x, y in segment
-                ]
-                line = LineString(geographic_line)
-                if line.is_valid:  # Ensure valid geometry before appending
-                    contour_lines.append({"geometry": line, "elevation": float(level)})
+    # Generate contour lines tile by tile; contour_simplify is a tolerance in pixels
+    geometries, elevations = contour_lines(elevation_data, contour_levels, transform, nodata = demNan,
+                                           simplify = global_inputs.get('contour_simplify') or 0)
 
     # Create a GeoDataFrame from the contour lines
-    gdf = gpd.GeoDataFrame(contour_lines, crs="EPSG:4326")
+    gdf = gpd.GeoDataFrame({'elevation': elevations}, geometry = geometries, crs = "EPSG:4326")[['geometry', 'elevation']]
 
     # Save the GeoDataFrame to a GeoPackage file
     output_path = output_folder_s / f"{city_name_l}_contours.gpkg"
@@ -102,6 +78,7 @@ if menu['raster_processing'] and menu['elevation']:
     # ELEVATION STATS ##############################################
     print('calculate elevation stats')
 
+    failed = []
     try:
         # Calculate equal interval bin edges
         contourLevels = list(contour_levels)
@@ -110,7 +87,7 @@ if menu['raster_processing'] and menu['elevation']:
             bin_edges.append(contourLevels[int(((len(contourLevels) - 6) / 5 + 1) * i)])
         
         # Calculate histogram
-        hist, _ = np.histogram(elevation_data, bins = bin_edges)
+        hist = histogram(elevation_data, bin_edges)
         
         # Write bins and hist to a CSV file
         with open(output_folder_t / f'{city_name_l}_elevation.csv', 'w', newline='') as csvfile:
@@ -119,5 +96,12 @@ if menu['raster_processing'] and menu['elevation']:
             for i, count in enumerate(hist):
                 bin_range = f"{int(bin_edges[i])}-{int(bin_edges[i+1])}"
                 writer.writerow([bin_range, count])
-    except:
-        print('calculate elevation stats failed')
\ No newline at end of file
+    except Exception as e:
+        print('calculate elevation stats failed')
+        failed.append(f'calculate elevation stats failed: {e!r}')
+
+    return failed
+
+
+if __name__ == '__main__':
+    run(RunContext())
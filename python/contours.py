@@ -0,0 +1,65 @@
+# Tiled contour lines of a raster.
+# The raster is contoured tile_size pixels at a time with contourpy (the engine behind plt.contour).
+# Neighbouring tiles share one row or column of pixels, so a line crossing a tile edge ends in both
+# tiles at the same point, and the pieces of each level are stitched back together with
+# shapely.line_merge. Lines come out of contourpy as one coordinate array per tile and level, are
+# turned into LineStrings in one shapely call, and are moved to map coordinates by applying the
+# affine transform to the whole coordinate array. Nodata pixels are masked, so no lines are drawn
+# around them. An optional simplification tolerance, in pixels, keeps the output size bounded.
+
+import numpy as np
+import shapely
+
+
+def tile_lines(z, level, row_off, col_off):
+    """LineStrings, in pixel coordinates of the whole raster, of one level in one tile."""
+    from contourpy import contour_generator, LineType
+
+    generator = contour_generator(x = np.arange(col_off, col_off + z.shape[1]), y = np.arange(row_off, row_off + z.shape[0]), z = z,
+                                  line_type = LineType.ChunkCombinedOffset)
+    points, offsets = generator.lines(level)
+    if points[0] is None:
+        return np.empty(0, dtype = object)
+    # both tiles sharing an edge compute the same crossing points; rounding removes any last-bit difference
+    points, offsets = np.round(points[0], 6), offsets[0]
+    lines = shapely.linestrings(points, indices = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets)))
+    return lines[shapely.get_num_points(lines) > 1]
+
+
+def affine_coords(transform):
+    """Function applying an affine transform to an (N, 2) coordinate array, for shapely.transform."""
+    def apply(coords):
+        x, y = coords[:, 0], coords[:, 1]
+        return np.column_stack([transform.a * x + transform.b * y + transform.c,
+                                transform.d * x + transform.e * y + transform.f])
+    return apply
+
+
+def contour_lines(array, levels, transform, nodata = None, tile_size = 2048, simplify = 0):
+    """Contour lines of a 2D array at levels, with the array's pixel indices mapped to map coordinates
+    by transform, as plt.contour does with the array alone. Returns (geometries, levels) arrays."""
+    z = np.ma.masked_equal(array, nodata) if nodata is not None else array
+    rows, cols = array.shape
+    geometries, elevations = [], []
+
+    for level in levels:
+        pieces = [tile_lines(z[row:row + tile_size + 1, col:col + tile_size + 1], level, row, col)
+                  for row in range(0, max(rows - 1, 1), tile_size)
+                  for col in range(0, max(cols - 1, 1), tile_size)]
+        pieces = np.concatenate(pieces)
+        if len(pieces) == 0:
+            continue
+
+        # stitch the pieces of lines that cross tile edges
+        lines = shapely.get_parts(shapely.line_merge(shapely.multilinestrings(pieces))) if (rows > tile_size + 1 or cols > tile_size + 1) else pieces
+        if simplify:
+            lines = shapely.simplify(lines, simplify)
+        lines = shapely.transform(lines, affine_coords(transform))
+        lines = lines[shapely.is_valid(lines)]
+
+        geometries.append(lines)
+        elevations.append(np.full(len(lines), float(level)))
+
+    if not geometries:
+        return np.empty(0, dtype = object), np.empty(0)
+    return np.concatenate(geometries), np.concatenate(elevations)
@@ -1,35 +1,43 @@
-# DETERMINE WHETHER TO RUN THIS SCRIPT ##############
-import yaml
+from context import RunContext
 
-# load menu
-with open("mnt/01-user-input/menu.yml", 'r') as f:
-    menu = yaml.safe_load(f)
 
-if menu['cyclone']:
+def run(context):
+    # DETERMINE WHETHER TO RUN THIS SCRIPT ##############
+    menu = context.menu
+
+    if not menu['cyclone']:
+        return
+
     print('run cyclone')
     import os
     from pathlib import Path
-    from shutil import copyfile
+    from source_catalog import source_catalog
+    from raster_io import raster_writer
 
     # SET UP #########################################
-    # load city inputs files, to be updated for each city scan
-    with open("mnt/01-user-input/city_inputs.yml", 'r') as f:
-        city_inputs = yaml.safe_load(f)
-
-    city_name_l = city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
+    city_inputs = context.city_inputs
+    city_name_l = context.city_name_l
+    global_inputs = context.global_inputs
 
-    # load global inputs, such as data sources that generally remain the same across scans
-    with open("python/global_inputs.yml", 'r') as f:
-        global_inputs = yaml.safe_load(f)
+    # Read AOI shapefile --------
+    features = context.features
 
     # Define output folder ---------
-    output_folder_parent = Path(f'mnt/city-directories/{city_name_l}/02-process-output')
-    output_folder = output_folder_parent / 'spatial'
-    os.makedirs(output_folder, exist_ok=True)
+    output_folder = context.output_folder_s
 
 
-    # COPY DATA #####################################
+    # CLIP DATA #####################################
+    # only the AOI window of the return period raster is read and written
     cyclone_data = 'mnt/source-data/cyclone/STORM_FIXED_RETURN_PERIODS_NI_50_YR_RP_BGD.tif'
     if os.path.exists(cyclone_data):
-        copyfile(cyclone_data, f'{output_folder}/STORM_FIXED_RETURN_PERIODS_NI_50_YR_RP_BGD.tif')
-    
\ No newline at end of file
+        clipped = source_catalog().clip(cyclone_data, features)
+        if clipped is None:
+            print('cyclone data does not cover the AOI')
+        else:
+            out_image, out_meta = clipped
+            with raster_writer(f'{output_folder}/STORM_FIXED_RETURN_PERIODS_NI_50_YR_RP_BGD.tif', out_meta) as dest:
+                dest.write(out_image)
+
+
+if __name__ == '__main__':
+    run(RunContext())
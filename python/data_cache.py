@@ -0,0 +1,110 @@
+# Size-bounded cache of the shared source data in python/data.
+# index.json in the cache folder maps every cached file to the remote URL it came from and to the
+# dataset it belongs to: a country (worldpop/BGD, demographics/BGD) or a tile (wsf/WSFevolution_v1_88_22,
+# fabdem/N23E091_FABDEM_V1-2.tif). It also keeps the WorldPop API responses, so countries scanned
+# before resolve offline. When the cached files exceed the disk budget, the datasets used least
+# recently are removed first.
+
+import os
+import json
+import time
+from pathlib import Path
+
+
+class SourceCache:
+    def __init__(self, folder, budget_gb = None):
+        self.folder = Path(folder)
+        self.index_file = self.folder / 'index.json'
+        self.budget = budget_gb * 1e9 if budget_gb else None
+        self.removed = set()
+        self.index = self.load()
+
+    def load(self):
+        try:
+            with open(self.index_file, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'files': {}, 'queries': {}}
+
+    def save(self):
+        """Write the index, merged with entries that other processes wrote since it was loaded.
+        Two processes saving at the same moment can still drop each other's newest entries; they are
+        recorded again the next time their files are used."""
+        on_disk = self.load()
+        files = on_disk['files']
+        for path, entry in self.index['files'].items():
+            if path not in files or files[path]['last_used'] < entry['last_used']:
+                files[path] = entry
+        for path in self.removed:
+            files.pop(path, None)
+        self.index = {'files': files, 'queries': {**on_disk['queries'], **self.index['queries']}}
+
+        # each process writes its own temporary file, so a concurrent save never moves a half-written index into place
+        os.makedirs(self.folder, exist_ok = True)
+        tmp_file = f'{self.index_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.index, f, indent = 1)
+        os.replace(tmp_file, self.index_file)
+
+    # LOOKUP #########################################
+    def query(self, url, fetch):
+        """Return the JSON response for url, calling fetch(url) only if it is not in the index yet."""
+        if url not in self.index['queries']:
+            self.index['queries'][url] = fetch(url)
+            self.save()
+        return self.index['queries'][url]
+
+    def entry(self, path):
+        return self.index['files'].get(self.relative(path))
+
+    def dataset_files(self, key):
+        """Cached files of a dataset, or None unless all of them are still on disk."""
+        paths = [self.folder / p for p, e in self.index['files'].items() if e['key'] == key]
+        if paths and all(p.exists() for p in paths):
+            return paths
+        return None
+
+    def relative(self, path):
+        return Path(path).relative_to(self.folder).as_posix()
+
+    # RECORD #########################################
+    def touch(self, path, key, url = None, **metadata):
+        """Record that path, part of dataset key, exists and was just used."""
+        if not os.path.exists(path):
+            return
+        entry = self.index['files'].setdefault(self.relative(path), {'key': key, 'url': url})
+        entry.update(metadata)
+        entry.update({'size': os.path.getsize(path), 'last_used': time.time()})
+        if url is not None:
+            entry['url'] = url
+        self.removed.discard(self.relative(path))
+
+    # EVICT ##########################################
+    def evict(self, keep = ()):
+        """Remove the least recently used datasets until the cache fits the budget.
+        Datasets in keep, e.g. those needed by the current run, are never removed."""
+        if self.budget is None:
+            return
+
+        datasets = {}
+        for path, e in self.index['files'].items():
+            if os.path.exists(self.folder / path):
+                size, last_used, paths = datasets.get(e['key'], (0, 0, []))
+                datasets[e['key']] = (size + e['size'], max(last_used, e['last_used']), paths + [path])
+
+        total = sum(d[0] for d in datasets.values())
+        for key, (size, last_used, paths) in sorted(datasets.items(), key = lambda x: x[1][1]):
+            if total <= self.budget:
+                break
+            if key in keep:
+                continue
+            print(f'evict {key} from the source data cache ({size / 1e9:.1f} GB)')
+            for path in paths:
+                os.remove(self.folder / path)
+                self.index['files'].pop(path)
+                self.removed.add(path)
+            total -= size
+
+        if total > self.budget:
+            print(f'source data needed by this run ({total / 1e9:.1f} GB) exceeds the cache budget ({self.budget / 1e9:.1f} GB)')
+        self.save()
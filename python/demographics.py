@@ -0,0 +1,43 @@
+# Streaming aggregation of the WorldPop age/sex rasters.
+# Every raster is clipped to the AOI window once, in a few threads at a time, and added in place to
+# the running sum of every group it belongs to (total population, each sex, each age group), so
+# memory holds one array per group plus the rasters being read, however many age/sex bands there are.
+
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from mosaic import clip_raster
+
+
+def accumulate(rasters, groups, features, max_workers = 4):
+    """Sum the AOI windows of rasters ({key: path}) into groups ({name: [keys]}), with nodata as 0.
+    Returns ({key: total population of that raster}, {name: 2D float64 sum}, metadata of the windows)."""
+    totals = {}
+    sums = {}
+    meta = {}
+    lock = threading.Lock()
+
+    def add(key):
+        image, image_meta = clip_raster(rasters[key], features)
+        band = image[0].astype(np.float64)
+        if image_meta['nodata'] is not None:
+            band[band == image_meta['nodata']] = 0
+
+        with lock:
+            if not meta:
+                meta.update(image_meta)
+            elif band.shape != (meta['height'], meta['width']):
+                raise ValueError(f'{rasters[key]} is not on the grid of the other demographics rasters')
+            totals[key] = band.sum()
+            for name, keys in groups.items():
+                if key in keys:
+                    if name in sums:
+                        np.add(sums[name], band, out = sums[name])
+                    else:
+                        sums[name] = band.copy()
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        for future in as_completed([executor.submit(add, key) for key in rasters]):
+            future.result()
+
+    return totals, sums, meta
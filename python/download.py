@@ -0,0 +1,143 @@
+# Download manager for the shared source data in python/data.
+# Files are streamed in chunks to <file>.part over a pooled HTTP session and only renamed to their
+# final name once complete and verified, so an interrupted transfer never leaves a truncated file
+# that looks finished. The next attempt resumes the .part file with an HTTP range request.
+
+import os
+import hashlib
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DownloadError(Exception):
+    """Raised when a file cannot be downloaded completely or fails verification."""
+
+
+def is_transient(e):
+    """Whether a request error is worth retrying: dropped connections, timeouts and server errors (5xx, 429),
+    but not client errors such as 404, which would fail again."""
+    if isinstance(e, requests.HTTPError):
+        status = e.response.status_code if e.response is not None else None
+        return status is None or status >= 500 or status == 429
+    return isinstance(e, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+
+def make_session(pool_size = 8):
+    """requests.Session whose connection pool is large enough for pool_size concurrent downloads.
+    The adapter does not retry: Downloader retries failed requests itself, up to its attempts."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size, max_retries = 0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def sha256_file(path, chunk_size = 1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Downloader:
+    """Stream files to disk, at most max_workers at a time.
+
+    session defaults to make_session(max_workers); pass another session, e.g. one pointed at a
+    local test server through a mounted adapter, to change how requests are sent.
+    """
+
+    def __init__(self, session = None, max_workers = 4, chunk_size = 1 << 20, attempts = 3, timeout = (30, 300)):
+        self.session = session or make_session(max_workers)
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.attempts = attempts
+        self.timeout = timeout
+
+    def get_json(self, url):
+        for attempt in range(1, self.attempts + 1):
+            try:
+                response = self.session.get(url, timeout = self.timeout)
+                response.raise_for_status()
+                return response.json()
+            except requests.RequestException as e:
+                if attempt == self.attempts or not is_transient(e):
+                    raise DownloadError(f'{url}: {e}') from e
+                print(f'query of {url} failed, retrying ({e})')
+
+    def download(self, url, path, size = None, sha256 = None):
+        """Download url to path unless path already exists, and return path.
+
+        size (bytes) and sha256 are checked when given; otherwise the size is checked against
+        the Content-Length or Content-Range the server reports.
+        A dropped connection or server error is retried, resuming from where it stopped, up to attempts times;
+        any other HTTP error status fails at once. Failures are raised as DownloadError.
+        """
+        path = str(path)
+        if os.path.exists(path):
+            return path
+
+        part_path = f'{path}.part'
+        for attempt in range(1, self.attempts + 1):
+            try:
+                expected_size = self._fetch(url, part_path, size)
+                break
+            except requests.RequestException as e:
+                if attempt == self.attempts or not is_transient(e):
+                    raise DownloadError(f'{url}: {e}') from e
+                print(f'download of {url} interrupted, resuming ({e})')
+
+        actual_size = os.path.getsize(part_path)
+        if expected_size is not None and actual_size != expected_size:
+            os.remove(part_path)
+            raise DownloadError(f'{url}: expected {expected_size} bytes, got {actual_size}')
+        if sha256 is not None and sha256_file(part_path) != sha256.lower():
+            os.remove(part_path)
+            raise DownloadError(f'{url}: checksum mismatch')
+
+        os.replace(part_path, path)
+        return path
+
+    def _fetch(self, url, part_path, size):
+        """Append the rest of url to part_path and return the expected total size, if known."""
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+        with self.session.get(url, headers = headers, stream = True, timeout = self.timeout) as response:
+            if response.status_code == 416:
+                # the .part file already holds everything the server has
+                total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                return int(total) if total.isdigit() else size
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                mode = 'ab'
+                total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                expected_size = int(total) if total.isdigit() else None
+            else:
+                # a full response, either for a new download or from a server that ignores range requests
+                mode = 'wb'
+                length = response.headers.get('Content-Length')
+                expected_size = int(length) if length is not None and 'Content-Encoding' not in response.headers else None
+
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size = self.chunk_size):
+                    f.write(chunk)
+
+        return size if size is not None else expected_size
+
+    def download_all(self, jobs):
+        """Download every (url, path) in jobs concurrently.
+        Returns a dict of {path: None or the exception that stopped its download}."""
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            futures = {str(path): executor.submit(self.download, url, path) for url, path in jobs}
+
+        results = {}
+        for path, future in futures.items():
+            try:
+                future.result()
+                results[path] = None
+            except Exception as e:
+                results[path] = e
+        return results
@@ -1,38 +1,30 @@
-# DETERMINE WHETHER TO RUN THIS SCRIPT ##############
-import yaml
+from context import RunContext
 
-# load menu
-with open("mnt/01-user-input/menu.yml", 'r') as f:
-    menu = yaml.safe_load(f)
 
-if menu['erosion']:
+def run(context):
+    # DETERMINE WHETHER TO RUN THIS SCRIPT ##############
+    menu = context.menu
+
+    if not menu['erosion']:
+        return
+
     print('run erosion')
 
     import os
-    import geopandas as gpd
     from pathlib import Path
     from os.path import exists
+    from source_catalog import source_catalog
 
     # SET UP #########################################
-    # load city inputs files, to be updated for each city scan
-    with open("mnt/01-user-input/city_inputs.yml", 'r') as f:
-        city_inputs = yaml.safe_load(f)
-
-    city_name_l = city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
-
-    # load global inputs, such as data sources that generally remain the same across scans
-    with open("python/global_inputs.yml", 'r') as f:
-        global_inputs = yaml.safe_load(f)
+    city_inputs = context.city_inputs
+    city_name_l = context.city_name_l
+    global_inputs = context.global_inputs
 
     # Read AOI shapefile --------
-    # transform the input shp to correct prj (epsg 4326)
-    aoi_file = gpd.read_file(f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{city_name_l}.shp').to_crs(epsg = 4326)
+    aoi_file = context.aoi
 
     # Define output folder ---------
-    output_folder_parent = Path(f'mnt/city-directories/{city_name_l}/02-process-output')
-    output_folder = output_folder_parent / 'spatial'
-
-    os.makedirs(output_folder, exist_ok=True)
+    output_folder = context.output_folder_s
 
 
     # PROCESS DATA ##################################
@@ -42,11 +34,13 @@ if menu['erosion']:
         aoi_buff = aoi_file.buffer(max(xmax-xmin, ymax-ymin))
         features = aoi_buff.geometry
 
-        # Read data --------------
-        real_nodes = gpd.read_file(f"mnt/source-data/{global_inputs['erosion_source']}")
-
-        # Filter REAL data ----------------
-        real_aoi = real_nodes[real_nodes.geometry.intersects(features.unary_union)]
+        # Read and filter REAL data --------------
+        # only the nodes within the bbox of the buffered AOI are read
+        real_aoi = source_catalog().read_features(f"mnt/source-data/{global_inputs['erosion_source']}", features)
 
         # Save nodes to shapefile ----------------
         real_aoi.to_file(output_folder / f'{city_name_l}_erosion_accretion.gpkg', driver = 'GPKG')
+
+
+if __name__ == '__main__':
+    run(RunContext())
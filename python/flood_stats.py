@@ -1,140 +1,136 @@
-# DETERMINE WHETHER TO RUN THIS SCRIPT ##############
-import yaml
+from context import RunContext
 
-# load menu
-with open("mnt/01-user-input/menu.yml", 'r') as f:
-    menu = yaml.safe_load(f)
 
-if menu['flood_stats']:
+def run(context):
+    # DETERMINE WHETHER TO RUN THIS SCRIPT ##############
+    menu = context.menu
+
+    if not menu['flood_stats']:
+        return
+
     print('run flood_stats')
-    
+
     import os
     import pandas as pd
-    import geopandas as gpd
     import numpy as np
-    import rasterio.mask
-    import rasterio
-    from pathlib import Path
     from os.path import exists
-    from rasterio.warp import reproject, Resampling
+    from concurrent.futures import ThreadPoolExecutor
+    from zonal import cumulative_counts
+    from raster_io import raster_writer
 
     # SET UP ##############################################
 
-    # load city inputs files, to be updated for each city scan
-    with open("mnt/01-user-input/city_inputs.yml", 'r') as f:
-        city_inputs = yaml.safe_load(f)
-
-    city_name_l = city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
-
-    # load global inputs, such as data sources that generally remain the same across scans
-    with open("python/global_inputs.yml", 'r') as f:
-        global_inputs = yaml.safe_load(f)
+    city_name_l = context.city_name_l
+    global_inputs = context.global_inputs
 
     # Read AOI shapefile --------
     print('read AOI shapefile')
-    # transform the input shp to correct prj (epsg 4326)
-    aoi_file = gpd.read_file(f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{city_name_l}.shp').to_crs(epsg = 4326)
-    features = aoi_file.geometry
-    aoi_bounds = aoi_file.bounds
+    features = context.features
 
     # Define output folder ---------
-    output_folder_parent = Path(f'mnt/city-directories/{city_name_l}/02-process-output')
-    output_folder_s = output_folder_parent / 'spatial'
-    output_folder_t = output_folder_parent / 'tabular'
-    os.makedirs(output_folder_s, exist_ok=True)
-    os.makedirs(output_folder_t, exist_ok=True)
+    output_folder_s = context.output_folder_s
+    output_folder_t = context.output_folder_t
+
 
-    
     # SET PARAMETERS #########################################
     flood_types = ['coastal', 'fluvial', 'pluvial']
-    
+    years = range(1985, 2016)
 
-    # FLOOD WSF STATS ###################################
+    # the hazard rasters raster_processing writes: one mask per flood type, year, SSP (after 2020) and return period bin
+    flood_prob_cutoff = global_inputs['flood']['prob_cutoff']
+    rp_bins = [f'lt{flood_prob_cutoff[0]}', f'{flood_prob_cutoff[0]}-{flood_prob_cutoff[1]}', f'gt{flood_prob_cutoff[1]}']
+    scenarios = []
+    for year in global_inputs['flood']['year']:
+        for ssp in ([None] if year <= 2020 else global_inputs['flood']['ssp']):
+            scenarios += [(year, ssp, rp_bin) for rp_bin in rp_bins]
+
+    def flood_raster(ft, year, ssp, rp_bin):
+        return output_folder_s / (f'{city_name_l}_{ft}_{year}_{rp_bin}.tif' if ssp is None else f'{city_name_l}_{ft}_{year}_ssp{ssp}_{rp_bin}.tif')
+
+
+    # EXPOSURE LAYERS ###################################
+    # wsf_utm is the AOI window of the city's analysis grid: hazard rasters and population are warped onto it once, through a WarpedVRT
+    grid = context.analysis_grid.window_around(features)
+    pixel_sqkm = grid.res[0] * grid.res[1] / 1e6
+
+    wsf_array = None
     if exists(output_folder_s / f'{city_name_l}_wsf_utm.tif'):
-        # Reproject flood raster -------------------
-        with rasterio.open(output_folder_s / f'{city_name_l}_wsf_utm.tif') as wsf:
-            tgt_crs = wsf.crs
-            tgt_transform = wsf.transform
-            tgt_width = wsf.width
-            tgt_height = wsf.height
-            
-        for ft in flood_types:
-            if exists(output_folder_s / f'{city_name_l}_{ft}_2020_lt1.tif'):
-                with rasterio.open(output_folder_s / f'{city_name_l}_{ft}_2020_lt1.tif') as src:
-                    src_crs = src.crs
-                    src_transform = src.transform
-                    src_width = src.width
-                    src_height = src.height
-                    src_dtype = src.dtypes[0]
-                    src_data = src.read(1)
-
-                # Prepare the array to store resampled data
-                resampled_data = np.empty((tgt_height, tgt_width), dtype = src_dtype)
-
-                # Perform the resampling
-                reproject(
-                    source=src_data,
-                    destination=resampled_data,
-                    src_transform=src_transform,
-                    src_crs=src_crs,
-                    dst_transform=tgt_transform,
-                    dst_crs=tgt_crs,
-                    resampling=Resampling.nearest
-                )
-
-                # Write the resampled raster to file
-                with rasterio.open(
-                    output_folder_s / f'{city_name_l}_{ft}_2020_lt1_utm.tif',
-                    'w',
-                    driver='GTiff',
-                    height=tgt_height,
-                    width=tgt_width,
-                    count=1,
-                    dtype=resampled_data.dtype,
-                    crs=tgt_crs,
-                    transform=tgt_transform
-                ) as dst:
-                    dst.write(resampled_data, 1)
-        
-        # Combine flood raster -----------------------------------
-        flood_arrays = []
+        wsf_array, _ = context.read_raster(output_folder_s / f'{city_name_l}_wsf_utm.tif')
+        if wsf_array.shape != (grid.height, grid.width):
+            raise ValueError('WSF UTM raster is not on the current analysis grid; rerun raster_processing for wsf')
+        built_up_sqkm = cumulative_counts(wsf_array, years) * pixel_sqkm
+    else:
+        print('WSF UTM raster does not exist')
 
+    # population counts are summed into the grid cells, keeping the AOI total
+    pop_array = None
+    if exists(output_folder_s / f'{city_name_l}_population.tif'):
+        pop_array = grid.warp_counts(output_folder_s / f'{city_name_l}_population.tif')
+        pop_total = pop_array.sum()
+    else:
+        print('population raster does not exist')
+
+    if wsf_array is None and pop_array is None:
+        return
+
+    cube_columns = ['flood_type', 'year', 'ssp', 'return_period', 'measure', 'wsf_year', 'value']
+    if not scenarios:
+        print('no flood years selected')
+        pd.DataFrame(columns = cube_columns).to_csv(output_folder_t / f'{city_name_l}_flood_cube.csv', index = False)
+        return
+
+
+    # EXPOSURE CUBE #####################################
+    def exposure(year, ssp, rp_bin):
+        """Exposure rows of every flood type (and of their combination) for one scenario and return period bin,
+        and the flood masks on the grid. Each hazard raster is read once and only its flooded pixels are counted."""
+        masks = {}
         for ft in flood_types:
-            if exists(output_folder_s / f'{city_name_l}_{ft}_2020_lt1_utm.tif'):
-                with rasterio.open(output_folder_s / f'{city_name_l}_{ft}_2020_lt1_utm.tif') as src:
-                    flood_arrays.append(src.read(1))
-                    out_meta = src.meta.copy()
-        
-        if len(flood_arrays) >= 2:
-            comb_flood_array = np.maximum(flood_arrays[0], flood_arrays[1])
-            if len(flood_arrays) == 3:
-                comb_flood_array = np.maximum(comb_flood_array, flood_arrays[2])
-            with rasterio.open(output_folder_s / f'{city_name_l}_combined_2020_lt1_utm.tif', 'w', **out_meta) as dst:
-                dst.write(comb_flood_array, 1)
-            flood_types.append('combined')
-
-        # Compute zonal stats --------------------------------
-        flood_stats = {}
-
-        with rasterio.open(output_folder_s / f'{city_name_l}_wsf_utm.tif') as wsf:
-            wsf_array = wsf.read(1)
-            pixelSizeX, pixelSizeY = wsf.res
-
-            for ft in flood_types:
-                if exists(output_folder_s / f'{city_name_l}_{ft}_2020_lt1_utm.tif'):
-                    flood_stats[ft] = {}
-
-                    with rasterio.open(output_folder_s / f'{city_name_l}_{ft}_2020_lt1_utm.tif') as fld:
-                        flood_array = fld.read(1)
-                        for year in range(1985, 2016):
-                            exposed_sqkm = np.nansum(flood_array[wsf_array == year]) * pixelSizeX * pixelSizeY / 1e6
-                            flood_stats[ft][year] = exposed_sqkm + flood_stats[ft].get(year - 1, 0)
-        
+            if exists(flood_raster(ft, year, ssp, rp_bin)):
+                flood_array, _ = grid.warp(flood_raster(ft, year, ssp, rp_bin))
+                masks[ft] = flood_array[0] > 0
+        if len(masks) >= 2:
+            masks['combined'] = np.logical_or.reduce(list(masks.values()))
+
+        rows = []
+        for ft, mask in masks.items():
+            if wsf_array is not None:
+                # flooded built-up area by year, cumulative
+                exposed_sqkm = cumulative_counts(wsf_array[mask], years) * pixel_sqkm
+                with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                    exposed_pct = exposed_sqkm / built_up_sqkm * 100
+                rows += [(ft, year, ssp, rp_bin, 'built_up_sqkm', y, v) for y, v in zip(years, exposed_sqkm)]
+                rows += [(ft, year, ssp, rp_bin, 'built_up_pct', y, v) for y, v in zip(years, exposed_pct)]
+            if pop_array is not None:
+                exposed_pop = pop_array[mask].sum()
+                rows.append((ft, year, ssp, rp_bin, 'population', None, exposed_pop))
+                rows.append((ft, year, ssp, rp_bin, 'population_pct', None, exposed_pop / pop_total * 100 if pop_total else np.nan))
+        return rows, masks
+
+    # scenarios are independent; rasterio and numpy release the GIL, so threads warp and count them concurrently
+    with ThreadPoolExecutor(max_workers = min(len(scenarios), os.cpu_count() or 1)) as executor:
+        results = dict(zip(scenarios, executor.map(lambda s: exposure(*s), scenarios)))
+
+    # one tidy table: a row per flood type, year, SSP, return period bin, measure and (for built-up area) WSF year
+    cube = pd.DataFrame([row for rows, _ in results.values() for row in rows], columns = cube_columns)
+    cube['ssp'] = cube['ssp'].astype('Int64')
+    cube['wsf_year'] = cube['wsf_year'].astype('Int64')
+    cube.to_csv(output_folder_t / f'{city_name_l}_flood_cube.csv', index = False)
+
+
+    # FLOOD WSF STATS ###################################
+    # 2020 masks of the less than 1% annual probability bin on the wsf grid, and their built-up exposure table
+    if wsf_array is not None:
+        flood_arrays = {ft: mask.astype(np.uint8) for ft, mask in results.get((2020, None, 'lt1'), ([], {}))[1].items()}
+        for ft, flood_array in flood_arrays.items():
+            with raster_writer(output_folder_s / f'{city_name_l}_{ft}_2020_lt1_utm.tif', grid.meta(flood_array.dtype, 0), nbits = 1) as dst:
+                dst.write(flood_array, 1)
+
         # Write to csv -------------------------
         flood_df = []
-        for ft in flood_types:
-            if not flood_stats.get(ft, None) is None:
-                flood_df.append(pd.DataFrame(list(flood_stats[ft].items()), columns=['year', ft]))
+        for ft in flood_arrays:
+            exposed = cube[(cube.flood_type == ft) & (cube.year == 2020) & cube.ssp.isna() & (cube.return_period == 'lt1') & (cube.measure == 'built_up_sqkm')]
+            flood_df.append(pd.DataFrame({'year': exposed.wsf_year.astype(int).values, ft: exposed.value.values}))
 
         merged_df = pd.read_csv(output_folder_t / f'{city_name_l}_wsf_stats.csv')
         merged_df.rename(columns={'cumulative sq km': 'total_built_up_area'}, inplace=True)
@@ -144,5 +140,7 @@ if menu['flood_stats']:
             merged_df[f'{flood_df[i].keys()[1]}_exposed_pct'] = merged_df[f'{flood_df[i].keys()[1]}'] / merged_df['total_built_up_area'] * 100
             i += 1
         merged_df.to_csv(output_folder_t / f'{city_name_l}_built_up_flood_exposure.csv', index = False)
-    else:
-        print('WSF UTM raster does not exist')
\ No newline at end of file
+
+
+if __name__ == '__main__':
+    run(RunContext())
@@ -1,93 +1,122 @@
-# DETERMINE WHETHER TO RUN THIS SCRIPT ##############
-import yaml
+from context import RunContext, MissingInputError
 
-# load menu
-with open("mnt/01-user-input/menu.yml", 'r') as f:
-    menu = yaml.safe_load(f)
 
-if menu['fwi']:
+def run(context):
+    # DETERMINE WHETHER TO RUN THIS SCRIPT ##############
+    menu = context.menu
+
+    if not menu['fwi']:
+        return
+
     print('run fwi')
     
     import os
     import pandas as pd
     import geopandas as gpd
-    import rasterio.mask
-    import rasterio
+    import json
     from shapely.geometry import box
     from pathlib import Path
     import glob
     import numpy as np
+    from affine import Affine
     from rasterio.crs import CRS
     from os.path import exists
+    from concurrent.futures import ThreadPoolExecutor
+    from mosaic import clip_raster
+    from raster_io import raster_writer
 
     # SET UP ##############################################
     
-    # load city inputs files, to be updated for each city scan
-    with open("mnt/01-user-input/city_inputs.yml", 'r') as f:
-        city_inputs = yaml.safe_load(f)
-
-    city_name_l = city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
-
-    # load global inputs, such as data sources that generally remain the same across scans
-    with open("python/global_inputs.yml", 'r') as f:
-        global_inputs = yaml.safe_load(f)
+    city_inputs = context.city_inputs
+    city_name_l = context.city_name_l
+    global_inputs = context.global_inputs
 
     # Read AOI shapefile --------
     print('read AOI shapefile')
-    # transform the input shp to correct prj (epsg 4326)
-    aoi_file = gpd.read_file(f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{city_name_l}.shp').to_crs(epsg = 4326)
+    aoi_file = context.aoi
 
     # Define output folder ---------
-    output_folder_parent = Path(f'mnt/city-directories/{city_name_l}/02-process-output')
-    output_folder_s = output_folder_parent / 'spatial'
-    output_folder_t = output_folder_parent / 'tabular'
-    os.makedirs(output_folder_s, exist_ok=True)
-    os.makedirs(output_folder_t, exist_ok=True)
+    output_folder_s = context.output_folder_s
+    output_folder_t = context.output_folder_t
 
 
     # PARAMETERS #######################################
     aoi_buff = aoi_file.buffer(2).total_bounds
     features = gpd.GeoDataFrame({'geometry': box(*aoi_buff)}, index = [0], crs = CRS.from_epsg(4326)).geometry
 
+    # the clipped daily rasters are kept in one (day, y, x) stack per AOI, so reruns do not read the daily files again
+    cache_folder = context.output_folder_parent / 'cache'
+    stack_file = cache_folder / f'{city_name_l}_fwi_stack.npy'
+    stack_info_file = cache_folder / f'{city_name_l}_fwi_stack.json'
+
 
     # PROCESSING ###################################
     if (not exists(output_folder_s / f'{city_name_l}_fwi.tif')) and (not exists(output_folder_t / f'{city_name_l}_fwi.csv')):
-        fwi_raster_dict = {}
-        out_meta = None
-
-        # clip raster and store in dict --------------------
-        for year in range(global_inputs['fwi_first_year'], global_inputs['fwi_last_year'] + 1):
-            for r in glob.glob(f"mnt/source-data/{global_inputs['fwi_source']}/FWI.GEOS-5.Daily.Default.{year}*.tif"):
-                with rasterio.open(r, 'r+') as src:
-                    src.crs = CRS.from_epsg(4326)
-                    
-                    out_image, out_transform = rasterio.mask.mask(
-                        src, features, all_touched = True, crop = True)
-                    if out_meta is None:
-                        out_meta = src.meta.copy()
-                
-                if np.nansum(out_image) != 0:
-                    fwi_raster_dict[r.split('.')[-2][-9:]] = out_image
-                
-                    out_meta.update({"driver": "GTiff",
-                                    "height": out_image.shape[1],
-                                    "width": out_image.shape[2],
-                                    "transform": out_transform})
-        q99_raster = np.nanpercentile(list(fwi_raster_dict.values()), 98.6, axis = 0)
-
-        with rasterio.open(output_folder_s / f'{city_name_l}_fwi.tif', 'w', **out_meta) as dest:
+        fwi_files = sorted(r for year in range(global_inputs['fwi_first_year'], global_inputs['fwi_last_year'] + 1)
+                           for r in glob.glob(f"mnt/source-data/{global_inputs['fwi_source']}/FWI.GEOS-5.Daily.Default.{year}*.tif"))
+        if not fwi_files:
+            raise MissingInputError('no daily fwi rasters in the fwi_source folder')
+        stack_key = {'bounds': [float(b) for b in aoi_buff],
+                     'files': [[os.path.basename(r), os.stat(r).st_size, os.stat(r).st_mtime_ns] for r in fwi_files]}
+
+        stack_info = None
+        if exists(stack_file) and exists(stack_info_file):
+            with open(stack_info_file, 'r') as f:
+                stack_info = json.load(f)
+            if stack_info['key'] != stack_key:
+                stack_info = None
+
+        # clip rasters into the stack --------------------
+        if stack_info is None:
+            print(f'clip {len(fwi_files)} daily fwi rasters')
+            os.makedirs(cache_folder, exist_ok = True)
+
+            # the daily files have no CRS; they are on the EPSG:4326 grid and opened read-only
+            out_image, out_meta = clip_raster(fwi_files[0], features)
+            out_meta.update({'crs': CRS.from_epsg(4326)})
+            stack = np.lib.format.open_memmap(stack_file, mode = 'w+', dtype = out_image.dtype,
+                                              shape = (len(fwi_files), out_image.shape[1], out_image.shape[2]))
+
+            def clip_day(i):
+                day_image, _ = clip_raster(fwi_files[i], features)
+                stack[i] = day_image[0]
+
+            with ThreadPoolExecutor(max_workers = min(8, os.cpu_count() or 1)) as executor:
+                list(executor.map(clip_day, range(len(fwi_files))))
+            stack.flush()
+
+            stack_info = {'key': stack_key,
+                          'dates': [r.split('.')[-2][-9:] for r in fwi_files],
+                          'meta': {**out_meta, 'crs': out_meta['crs'].to_wkt(), 'transform': list(out_meta['transform'])[:6]}}
+            with open(stack_info_file, 'w') as f:
+                json.dump(stack_info, f)
+        else:
+            print('reuse clipped daily fwi rasters')
+
+        stack = np.load(stack_file, mmap_mode = 'r')
+        out_meta = {**stack_info['meta'], 'crs': CRS.from_wkt(stack_info['meta']['crs']), 'transform': Affine(*stack_info['meta']['transform'])}
+
+        # days without any data are left out
+        day_sums = np.concatenate([np.nansum(stack[d:d + 256], axis = (1, 2)) for d in range(0, len(stack), 256)])
+        days = np.flatnonzero(day_sums != 0)
+        dates = pd.to_datetime([stack_info['dates'][d] for d in days], format='%Y%m%d')
+
+        # percentile raster, a block of rows at a time -------------------
+        q99_raster = np.empty((1, stack.shape[1], stack.shape[2]), dtype = np.float64)
+        for row in range(0, stack.shape[1], 256):
+            q99_raster[0, row:row + 256] = np.nanpercentile(stack[days, row:row + 256], global_inputs['fwi_percentile'], axis = 0)
+
+        with raster_writer(output_folder_s / f'{city_name_l}_fwi.tif', out_meta) as dest:
             dest.write(q99_raster)
         
         # calculate 95th percentile FWI by week -------------------
-        fwi_val_dict = {}
+        weeks = dates.isocalendar().week.to_numpy()
+        week_list = np.unique(weeks)
+        week_95th = pd.DataFrame({'pctile_95': [np.nanpercentile(stack[days[weeks == w]], 95) for w in week_list]},
+                                 index = pd.Index(week_list, name = 'week'))
 
-        for i in fwi_raster_dict:
-            fwi_val_dict[i] = fwi_raster_dict[i].flatten().tolist()
+        week_95th.to_csv(output_folder_t / f'{city_name_l}_fwi.csv', index=True)
 
-        df = pd.DataFrame(list(fwi_val_dict.items()), columns=['date_str', 'fwi'])
-        df['date'] = pd.to_datetime(df['date_str'], format='%Y%m%d')
-        df['week'] = df['date'].dt.isocalendar().week
-        df = df.explode('fwi', ignore_index=True)
-        week_95th = df.groupby('week').agg(pctile_95 = ('fwi', lambda x: np.nanpercentile(x, 95)))
 
-        week_95th.to_csv(output_folder_t / f'{city_name_l}_fwi.csv', index=True)
+if __name__ == '__main__':
+    run(RunContext())
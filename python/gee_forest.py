@@ -1,27 +1,23 @@
-# DETERMINE WHETHER TO RUN THIS SCRIPT ##############
-import yaml
+from context import RunContext, MissingInputError
 
-# load menu
-with open("mnt/01-user-input/menu.yml", 'r') as f:
-    menu = yaml.safe_load(f)
 
-if menu['forest']:
+def run(context):
+    # DETERMINE WHETHER TO RUN THIS SCRIPT ##############
+    menu = context.menu
+
+    if not menu['forest']:
+        return
+
     print('run gee_forest')
     
     import ee
     import geopandas as gpd
 
     # SET UP #########################################
-    # load city inputs files, to be updated for each city scan
-    with open("mnt/01-user-input/city_inputs.yml", 'r') as f:
-        city_inputs = yaml.safe_load(f)
-
-    city_name_l = city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
+    city_inputs = context.city_inputs
+    city_name_l = context.city_name_l
     aoi_name = city_inputs['AOI_shp_name']
-
-    # load global inputs
-    with open("python/global_inputs.yml", 'r') as f:
-        global_inputs = yaml.safe_load(f)
+    global_inputs = context.global_inputs
 
     # Initialize Earth Engine
     ee.Initialize()
@@ -29,15 +25,15 @@ if menu['forest']:
     fc = ee.Image("UMD/hansen/global_forest_change_2023_v1_11")
 
     # Read AOI shapefile --------
-    aoi_file = gpd.read_file(f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{aoi_name}.shp').to_crs(epsg = 4326)
+    aoi_file = context.aoi
 
     # Convert shapefile to ee.Geometry ------------
     jsonDict = eval(gpd.GeoSeries([aoi_file['geometry'].force_2d().union_all()]).to_json())
 
     if len(jsonDict['features']) > 1:
-        print('Need to convert polygons into a multipolygon')
-        print('or do something else, like creating individual raster for each polygon and then merge')
-        exit()
+        # Need to convert polygons into a multipolygon,
+        # or do something else, like creating individual raster for each polygon and then merge
+        raise MissingInputError('AOI must be a single (multi)polygon for GEE export')
     
     AOI = ee.Geometry.MultiPolygon(jsonDict['features'][0]['geometry']['coordinates'])
 
@@ -78,3 +74,7 @@ if menu['forest']:
                                                  'noData': no_data_val
                                              }})
     task1.start()
+
+
+if __name__ == '__main__':
+    run(RunContext())
@@ -1,11 +1,13 @@
-# DETERMINE WHETHER TO RUN THIS SCRIPT ##############
-import yaml
+from context import RunContext, MissingInputError
 
-# load menu
-with open("mnt/01-user-input/menu.yml", 'r') as f:
-    menu = yaml.safe_load(f)
 
-if menu['landcover']:
+def run(context):
+    # DETERMINE WHETHER TO RUN THIS SCRIPT ##############
+    menu = context.menu
+
+    if not menu['landcover']:
+        return
+
     print('run gee_landcover')
     
     import os
@@ -15,20 +17,13 @@ if menu['landcover']:
     from pathlib import Path
 
     # SET UP #########################################
-    # load city inputs files, to be updated for each city scan
-    with open("mnt/01-user-input/city_inputs.yml", 'r') as f:
-        city_inputs = yaml.safe_load(f)
-
-    city_name_l = city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
+    city_inputs = context.city_inputs
+    city_name_l = context.city_name_l
     aoi_name = city_inputs['AOI_shp_name']
-
-    # load global inputs
-    with open("python/global_inputs.yml", 'r') as f:
-        global_inputs = yaml.safe_load(f)
+    global_inputs = context.global_inputs
 
     # set output folder
-    output_folder = Path(f'mnt/city-directories/{city_name_l}/02-process-output/tabular')
-    os.makedirs(output_folder, exist_ok=True)
+    output_folder = context.output_folder_t
 
     # Initialize Earth Engine
     ee.Initialize()
@@ -36,15 +31,15 @@ if menu['landcover']:
     lc = ee.ImageCollection('ESA/WorldCover/v200').first()
 
     # Read AOI shapefile --------
-    aoi_file = gpd.read_file(f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{aoi_name}.shp').to_crs(epsg = 4326)
+    aoi_file = context.aoi
 
     # Convert shapefile to ee.Geometry ------------
     jsonDict = eval(gpd.GeoSeries([aoi_file['geometry'].force_2d().union_all()]).to_json())
 
     if len(jsonDict['features']) > 1:
-        print('Need to convert polygons into a multipolygon')
-        print('or do something else, like creating individual raster for each polygon and then merge')
-        exit()
+        # Need to convert polygons into a multipolygon,
+        # or do something else, like creating individual raster for each polygon and then merge
+        raise MissingInputError('AOI must be a single (multi)polygon for GEE export')
     
     AOI = ee.Geometry.MultiPolygon(jsonDict['features'][0]['geometry']['coordinates'])
 
@@ -108,3 +103,7 @@ if menu['landcover']:
                                                  'noData': no_data_val
                                              }})
     task0.start()
+
+
+if __name__ == '__main__':
+    run(RunContext())
@@ -0,0 +1,52 @@
+# GlobFire burned areas in one spatially indexed GeoPackage.
+# The monthly MODIS_BA_GLOBAL_1_<month>_<year>.shp files are ingested once into python/data/globfire/,
+# with year and month columns. GeoPackage layers carry an R-tree index, so a query with the bbox of
+# an AOI reads only the fires near it instead of every global shapefile.
+
+import os
+import geopandas as gpd
+from pathlib import Path
+
+
+store_folder = Path('python/data/globfire')
+
+
+def store_file(years):
+    return store_folder / f'globfire_{years[0]}_{years[-1]}.gpkg'
+
+
+def ingest(gf_folder, years, months):
+    """Build the store for years and months from the shapefiles in gf_folder, unless it is newer than all of them.
+    Returns the path of the store."""
+    store = store_file(years)
+    sources = [(year, month, Path(gf_folder) / f'MODIS_BA_GLOBAL_1_{month}_{year}.shp') for year in years for month in months]
+    if store.exists() and store.stat().st_mtime >= max(os.stat(shp).st_mtime for _, _, shp in sources):
+        return store
+
+    print('ingest GlobFire')
+    os.makedirs(store_folder, exist_ok=True)
+    # cities processed in parallel may ingest at the same time; each writes its own file and the last replace wins
+    tmp_store = store.with_suffix(f'.{os.getpid()}.tmp.gpkg')
+    if tmp_store.exists():
+        os.remove(tmp_store)
+
+    for year, month, shp in sources:
+        print(f'year: {year}, month: {month}')
+        gf_shp = gpd.read_file(shp)
+        gf_shp = gf_shp.assign(year = year, month = month)[['year', 'month', 'Type', 'geometry']]
+        gf_shp.to_file(tmp_store, layer = 'globfire', driver = 'GPKG', mode = 'a' if tmp_store.exists() else 'w')
+
+    os.replace(tmp_store, store)
+    return store
+
+
+def centroids(store, geometry):
+    """Centroids of the final burned areas in store that intersect geometry, with year, month, x and y columns."""
+    # the R-tree returns rows in its own order; the feature ids keep the order of the monthly files
+    gf = gpd.read_file(store, layer = 'globfire', bbox = tuple(geometry.bounds), fid_as_index = True).sort_index()
+    gf = gf[gf.intersects(geometry) & (gf['Type'] == 'FinalArea')]
+
+    points = gf.centroid
+    return gpd.GeoDataFrame({'year': gf['year'].to_numpy(), 'month': gf['month'].to_numpy(),
+                             'x': points.x.to_numpy(), 'y': points.y.to_numpy()},
+                            geometry = gpd.points_from_xy(points.x, points.y), crs = 'epsg:4326')
@@ -0,0 +1,306 @@
+# Content-hash manifest for incremental re-execution of the processing steps.
+# For each step, the manifest records a hash of everything the step's outputs depend on:
+# the AOI shapefile, city_inputs.yml, the menu.yml and global_inputs.yml parameters the step uses,
+# the source files it reads, its own code, and the hashes of the steps it depends on.
+# A rerun skips a step when that hash and its recorded outputs are unchanged;
+# otherwise the step's old outputs are removed first, so the scripts' exists() checks do not skip stale work.
+# Records are kept per step in mnt/city-directories/<city>/02-process-output/manifest/<step>.json.
+
+import os
+import glob
+import json
+import string
+import hashlib
+from pathlib import Path
+
+
+# STEP INPUTS ########################################
+# run_if: menu keys that must all be true for the step to do anything
+# menu / global_inputs: parameters that change the step's outputs
+# sources: glob patterns of source files read by the step, formatted with city_inputs and global_inputs;
+#   a pattern is ignored if a field it uses is empty, and directories are hashed recursively
+# code: files in python/ that the step executes
+# outputs: glob patterns of files the step writes, relative to the repository root;
+#   {spatial} and {tabular} are the city's 02-process-output subfolders and {city} the city name
+STEP_INPUTS = {
+    'burned_area.py': {
+        'run_if': ['burned_area'],
+        'global_inputs': ['burned_area_source'],
+        'sources': ['mnt/source-data/{burned_area_source}/MODIS_BA_GLOBAL_1_*'],
+        'code': ['globfire.py'],
+        'outputs': ['{spatial}/{city}_globfire_centroids.gpkg'],
+    },
+    'cyclone.py': {
+        'run_if': ['cyclone'],
+        'sources': ['mnt/source-data/cyclone/STORM_FIXED_RETURN_PERIODS_NI_50_YR_RP_BGD.tif'],
+        'code': ['source_catalog.py', 'mosaic.py', 'raster_io.py'],
+        'outputs': ['{spatial}/STORM_FIXED_RETURN_PERIODS_NI_50_YR_RP_BGD.tif'],
+    },
+    'erosion.py': {
+        'run_if': ['erosion'],
+        'global_inputs': ['erosion_source'],
+        'sources': ['mnt/source-data/{erosion_source}'],
+        'code': ['source_catalog.py'],
+        'outputs': ['{spatial}/{city}_erosion_accretion.gpkg'],
+    },
+    'fwi.py': {
+        'run_if': ['fwi'],
+        'global_inputs': ['fwi_source', 'fwi_first_year', 'fwi_last_year', 'fwi_percentile'],
+        'code': ['mosaic.py', 'raster_io.py'],
+        'sources': ['mnt/source-data/{fwi_source}/FWI.GEOS-5.Daily.Default.*.tif'],
+        'outputs': ['{spatial}/{city}_fwi.tif', '{tabular}/{city}_fwi.csv'],
+    },
+    'gee_elevation.py': {
+        'run_if': ['elevation'],
+        'global_inputs': ['drive_folder'],
+    },
+    'gee_forest.py': {
+        'run_if': ['forest'],
+        'global_inputs': ['drive_folder'],
+    },
+    'gee_landcover.py': {
+        'run_if': ['landcover'],
+        'global_inputs': ['drive_folder'],
+        'outputs': ['{tabular}/{city}_lc.csv'],
+    },
+    'gee_lst.py': {
+        'run_if': ['summer_lst'],
+        'global_inputs': ['drive_folder', 'first_year', 'last_year', 'temperature_source'],
+        'sources': ['mnt/source-data/{temperature_source}/cru_ts4.06.*.tmp.dat.nc'],
+        'outputs': ['{tabular}/{city}_hottest_months.txt'],
+    },
+    'gee_lst_winter.py': {
+        'run_if': ['winter_lst'],
+        'global_inputs': ['drive_folder', 'first_year', 'last_year', 'temperature_source'],
+        'sources': ['mnt/source-data/{temperature_source}/cru_ts4.06.*.tmp.dat.nc'],
+        'outputs': ['{tabular}/{city}_coldest_months.txt'],
+    },
+    'gee_ndmi.py': {
+        'run_if': ['ndmi'],
+        'global_inputs': ['drive_folder', 'first_year', 'last_year', 'temperature_source'],
+        'sources': ['mnt/source-data/{temperature_source}/cru_ts4.06.*.tmp.dat.nc'],
+    },
+    'gee_ndvi.py': {
+        'run_if': ['green'],
+        'global_inputs': ['drive_folder', 'first_year', 'last_year', 'temperature_source'],
+        'sources': ['mnt/source-data/{temperature_source}/cru_ts4.06.*.tmp.dat.nc'],
+    },
+    'gee_nightlight.py': {
+        'run_if': ['nightlight'],
+        'global_inputs': ['drive_folder'],
+    },
+    'landcover_burnability.py': {
+        'run_if': ['landcover_burn'],
+        'global_inputs': ['lc_burn_source', 'reclassify'],
+        'sources': ['mnt/source-data/{lc_burn_source}'],
+        'code': ['reclassify.py', 'source_catalog.py', 'mosaic.py', 'raster_io.py'],
+        'outputs': ['{spatial}/{city}_lc_burn.tif'],
+    },
+    'osm_poi.py': {
+        'run_if': ['osm_poi'],
+        'global_inputs': ['osm_query'],
+        'outputs': ['{spatial}/{city}_osm_*.gpkg'],
+    },
+    'raster_processing.py': {
+        'run_if': ['raster_processing'],
+        'menu': ['population', 'wsf', 'elevation', 'slope', 'solar', 'air', 'flood_coastal', 'flood_fluvial', 'flood_pluvial',
+                 'landslide', 'liquefaction', 'demographics', 'lightning'],
+        'global_inputs': ['flood', 'reclassify', 'analysis_grid_resolution', 'flood_source', 'elevation_source', 'solar_source', 'air_source', 'landslide_source',
+                          'liquefaction_source', 'lightning_source'],
+        'sources': ['mnt/source-data/{flood_source}/*_*DEFENDED/**/*_{tile}.tif',
+                    'mnt/source-data/{solar_source}', 'mnt/source-data/{air_source}', 'mnt/source-data/{landslide_source}',
+                    'mnt/source-data/{liquefaction_source}', 'mnt/source-data/{lightning_source}'],
+        'code': ['source_data.py', 'download.py', 'data_cache.py', 'mosaic.py', 'zonal.py', 'reclassify.py', 'source_catalog.py', 'demographics.py', 'raster_io.py',
+                 'analysis_grid.py', 'gee_elevation.py'],
+        'outputs': ['{spatial}/{city}_population.tif', '{spatial}/{city}_wsf_*.tif', '{tabular}/{city}_wsf_stats.csv',
+                    '{spatial}/{city}_elevation.tif', '{spatial}/{city}_demo_total.tif', '{spatial}/{city}_sex_ratio.tif',
+                    '{spatial}/{city}_age_groups.tif', '{tabular}/{city}_demographics.csv',
+                    '{spatial}/{city}_coastal_*.tif', '{spatial}/{city}_fluvial_*.tif', '{spatial}/{city}_pluvial_*.tif',
+                    '{spatial}/{city}_solar.tif', '{spatial}/{city}_air.tif', '{spatial}/{city}_landslide.tif',
+                    '{spatial}/{city}_liquefaction.tif', '{spatial}/{city}_lightning.tif',
+                    'python/data/wsf/{city}_wsf_evolution.vrt', 'python/data/elev/{city}_elevation.vrt',
+                    # the flood mosaics are in a folder all cities share: match only the names flood_mosaic builds
+                    'python/data/flood/{city}_coastal_[0-9]*_1in*.vrt', 'python/data/flood/{city}_fluvial_[0-9]*_1in*.vrt',
+                    'python/data/flood/{city}_pluvial_[0-9]*_1in*.vrt'],
+    },
+    'road_network.py': {
+        'run_if': ['road_network'],
+        'outputs': ['{spatial}/{city}', '{spatial}/{city}_nodes_and_edges.gpkg', '{tabular}/{city}_road_*.csv'],
+    },
+    'rwi.py': {
+        'run_if': ['rwi'],
+        'global_inputs': ['rwi_source'],
+        'sources': ['mnt/source-data/{rwi_source}/{country_iso3}_relative_wealth_index.csv'],
+        'code': ['quadkeys.py'],
+        'outputs': ['{spatial}/{city}_rwi.gpkg'],
+    },
+    'soil_salinity.py': {
+        'run_if': ['soil_salinity'],
+        'global_inputs': ['soil_salinity_source'],
+        'sources': ['mnt/source-data/{soil_salinity_source}/salMap*.tif.tif'],
+        'code': ['zonal.py', 'raster_io.py'],
+        'outputs': ['{spatial}/{city}_soil_salinity_*.tif', '{tabular}/{city}_soil_salinity.csv'],
+    },
+    'water_salinity.py': {
+        'run_if': ['water_salinity'],
+        'global_inputs': ['water_salinity_source', 'water_salinity_coords'],
+        'sources': ['mnt/source-data/{water_salinity_source}/*.csv'],
+        'code': ['water_salinity_store.py'],
+        'outputs': ['{tabular}/{city}_water_salinity_*.csv'],
+    },
+    'contour_elev_stats.py': {
+        'run_if': ['raster_processing', 'elevation'],
+        'global_inputs': ['contour_simplify'],
+        'code': ['zonal.py', 'contours.py'],
+        'outputs': ['{spatial}/{city}_contours.gpkg', '{tabular}/{city}_elevation.csv'],
+    },
+    'slope.py': {
+        'run_if': ['raster_processing', 'slope'],
+        'code': ['zonal.py', 'terrain.py', 'raster_io.py'],
+        'outputs': ['{spatial}/{city}_slope.tif', '{tabular}/{city}_slope.csv'],
+    },
+    'flood_stats.py': {
+        'run_if': ['flood_stats'],
+        'global_inputs': ['flood', 'analysis_grid_resolution'],
+        'code': ['zonal.py', 'raster_io.py', 'analysis_grid.py'],
+        'outputs': ['{spatial}/{city}_*_2020_lt1_utm.tif', '{tabular}/{city}_built_up_flood_exposure.csv',
+                    '{tabular}/{city}_flood_cube.csv'],
+    },
+}
+
+
+# HASHING ############################################
+def hash_file(path, cached = None):
+    """sha256 of a file's content. cached is a previous [size, mtime_ns, sha256] record of the same path,
+    reused when the file's size and modification time are unchanged, so source data is only read once."""
+    stat = os.stat(path)
+    if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+
+def expand_pattern(pattern, fields):
+    """Format a glob pattern with fields and return the matching files, walking directories."""
+    field_names = [f[1] for f in string.Formatter().parse(pattern) if f[1]]
+    if any(not fields.get(f) for f in field_names):
+        return []
+
+    # {tile} expands to every 1x1 degree tile touched by the AOI, e.g. n23e091
+    if 'tile' in field_names:
+        patterns = [pattern.format(**{**fields, 'tile': t}) for t in fields['tile']]
+    else:
+        patterns = [pattern.format(**fields)]
+
+    files = []
+    for p in patterns:
+        for match in sorted(glob.glob(p, recursive = True)):
+            if os.path.isdir(match):
+                for root, _, names in os.walk(match):
+                    files += [os.path.join(root, n) for n in sorted(names)]
+            else:
+                files.append(match)
+    return files
+
+
+# MANIFEST ###########################################
+class StepManifest:
+    def __init__(self, script, context, dependencies = ()):
+        self.script = script
+        self.spec = STEP_INPUTS.get(script, {})
+        self.dependencies = dependencies
+        self.context = context
+
+        self.menu = context.menu
+        self.city_inputs = context.city_inputs
+        self.global_inputs = context.global_inputs
+        self.city_name_l = context.city_name_l
+        self.city_folder = Path(f'mnt/city-directories/{self.city_name_l}')
+        self.manifest_folder = context.output_folder_parent / 'manifest'
+
+        self.fields = {**self.global_inputs, **self.city_inputs,
+                       'city': self.city_name_l,
+                       'spatial': str(context.output_folder_s),
+                       'tabular': str(context.output_folder_t)}
+
+        self.previous = self.load(script)
+
+    def load(self, script):
+        try:
+            with open(self.manifest_folder / f'{script}.json', 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    @property
+    def enabled(self):
+        return all(self.menu.get(k) for k in self.spec.get('run_if', []))
+
+    def source_files(self):
+        files = sorted(str(p) for p in self.city_folder.glob(f'01-user-input/AOI/{self.city_name_l}.*'))
+        files += [f'python/{c}' for c in [self.script, 'context.py'] + self.spec.get('code', [])]
+
+        fields = self.fields
+        if any('{tile}' in p for p in self.spec.get('sources', [])):
+            from source_data import tile_finder
+
+            aoi_bounds = self.context.aoi_bounds
+            fields = {**fields, 'tile': [f'{lat.lower()}{lon.lower()}' for lat in tile_finder(aoi_bounds, 'lat') for lon in tile_finder(aoi_bounds, 'lon')]}
+        for pattern in self.spec.get('sources', []):
+            files += expand_pattern(pattern, fields)
+        return files
+
+    def compute_key(self):
+        """Hash the step's parameters, input files and dependency hashes into one key."""
+        params = {'menu': {k: self.menu.get(k) for k in self.spec.get('run_if', []) + self.spec.get('menu', [])},
+                  'global_inputs': {k: self.global_inputs.get(k) for k in self.spec.get('global_inputs', [])},
+                  'city_inputs': self.city_inputs}
+
+        cached_files = (self.previous or {}).get('files', {})
+        self.files = {f: hash_file(f, cached_files.get(f)) for f in self.source_files()}
+
+        dependency_keys = {}
+        for d in self.dependencies:
+            record = self.load(d)
+            dependency_keys[d] = record['key'] if record else None
+
+        sha = hashlib.sha256()
+        sha.update(json.dumps(params, sort_keys = True, default = str).encode())
+        sha.update(json.dumps({f: h[2] for f, h in self.files.items()}, sort_keys = True).encode())
+        sha.update(json.dumps(dependency_keys, sort_keys = True).encode())
+        self.key = sha.hexdigest()
+        return self.key
+
+    def output_files(self):
+        files = []
+        for pattern in self.spec.get('outputs', []):
+            files += [f for f in glob.glob(pattern.format(**self.fields)) if os.path.isfile(f)]
+        return sorted(set(files))
+
+    def is_current(self):
+        if self.previous is None or self.previous.get('key') != self.key:
+            return False
+        return all(os.path.exists(f) for f in self.previous.get('outputs', []))
+
+    def remove_outputs(self):
+        for f in self.output_files():
+            os.remove(f)
+
+    def invalidate(self):
+        """Remove the step's record, so it is rerun until it succeeds."""
+        try:
+            os.remove(self.manifest_folder / f'{self.script}.json')
+        except FileNotFoundError:
+            pass
+        self.previous = None
+
+    def record(self):
+        os.makedirs(self.manifest_folder, exist_ok = True)
+        record = {'key': self.key, 'files': self.files, 'outputs': self.output_files()}
+        tmp_file = self.manifest_folder / f'{self.script}.json.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(record, f, indent = 1)
+        os.replace(tmp_file, self.manifest_folder / f'{self.script}.json')
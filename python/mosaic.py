@@ -0,0 +1,97 @@
+# Virtual mosaics and windowed clipping.
+# Instead of merging every tile into one in-memory array and writing it out,
+# build_vrt writes a small GDAL VRT that references the tiles, and clip_raster reads only
+# the AOI window of it, block by block, so peak memory scales with the city rather than the country.
+
+import os
+import numpy as np
+import rasterio
+from xml.sax.saxutils import escape
+from rasterio.windows import Window
+from rasterio.features import geometry_mask, geometry_window
+
+
+GDAL_DTYPES = {'uint8': 'Byte', 'int8': 'Int8', 'uint16': 'UInt16', 'int16': 'Int16', 'uint32': 'UInt32',
+               'int32': 'Int32', 'float32': 'Float32', 'float64': 'Float64'}
+
+
+def build_vrt(tile_paths, vrt_path):
+    """Write a VRT mosaic of tile_paths to vrt_path without copying any pixels.
+
+    The tiles must share CRS, resolution, data type and band count, as the WorldPop, WSF, FABDEM and
+    Fathom tiles do. Where tiles overlap, the first one in tile_paths wins, as with rasterio.merge.merge.
+    """
+    tiles = []
+    for p in tile_paths:
+        with rasterio.open(p) as src:
+            tiles.append({'path': os.path.abspath(p), 'bounds': src.bounds, 'width': src.width, 'height': src.height,
+                          'crs': src.crs, 'res': src.res, 'dtype': src.dtypes[0], 'count': src.count, 'nodata': src.nodata})
+
+    first = tiles[0]
+    for t in tiles[1:]:
+        if t['crs'] != first['crs'] or not np.allclose(t['res'], first['res']) or t['dtype'] != first['dtype'] or t['count'] != first['count']:
+            raise ValueError(f"{t['path']} does not match the CRS, resolution, data type or band count of {first['path']}")
+
+    xres, yres = first['res']
+    left = min(t['bounds'].left for t in tiles)
+    top = max(t['bounds'].top for t in tiles)
+    width = int(round((max(t['bounds'].right for t in tiles) - left) / xres))
+    height = int(round((top - min(t['bounds'].bottom for t in tiles)) / yres))
+
+    vrt_dir = os.path.dirname(os.path.abspath(vrt_path))
+    lines = [f'<VRTDataset rasterXSize="{width}" rasterYSize="{height}">',
+             f"  <SRS>{escape(first['crs'].to_wkt())}</SRS>",
+             f'  <GeoTransform>{left!r}, {xres!r}, 0.0, {top!r}, 0.0, {-yres!r}</GeoTransform>']
+    for band in range(1, first['count'] + 1):
+        lines.append(f'  <VRTRasterBand dataType="{GDAL_DTYPES[first["dtype"]]}" band="{band}">')
+        if first['nodata'] is not None:
+            lines.append(f"    <NoDataValue>{first['nodata']!r}</NoDataValue>")
+        # later sources are drawn on top, so list the tiles in reverse to let the first one win
+        for t in reversed(tiles):
+            x_off = int(round((t['bounds'].left - left) / xres))
+            y_off = int(round((top - t['bounds'].top) / yres))
+            lines += ['    <ComplexSource>',
+                      f"      <SourceFilename relativeToVRT=\"1\">{escape(os.path.relpath(t['path'], vrt_dir))}</SourceFilename>",
+                      f'      <SourceBand>{band}</SourceBand>',
+                      f"      <SrcRect xOff=\"0\" yOff=\"0\" xSize=\"{t['width']}\" ySize=\"{t['height']}\" />",
+                      f"      <DstRect xOff=\"{x_off}\" yOff=\"{y_off}\" xSize=\"{t['width']}\" ySize=\"{t['height']}\" />"]
+            if t['nodata'] is not None:
+                lines.append(f"      <NODATA>{t['nodata']!r}</NODATA>")
+            lines.append('    </ComplexSource>')
+        lines.append('  </VRTRasterBand>')
+    lines.append('</VRTDataset>')
+
+    with open(vrt_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return vrt_path
+
+
+def clip_raster(input_raster, features, all_touched = True, block_rows = 1024):
+    """Clip a raster (or VRT) to features, like rasterio.mask.mask with crop = True.
+
+    Only the window covering the features is read, block_rows rows at a time.
+    Returns the clipped array (bands, rows, cols) and the matching GTiff metadata.
+    """
+    with rasterio.open(input_raster) as src:
+        window = geometry_window(src, features)
+        height, width = int(window.height), int(window.width)
+        out_transform = src.window_transform(window)
+        fill_value = src.nodata if src.nodata is not None else 0
+
+        # pixels outside the AOI polygons
+        outside = geometry_mask(features, out_shape = (height, width), transform = out_transform, all_touched = all_touched)
+
+        out_image = np.empty((src.count, height, width), dtype = src.dtypes[0])
+        for row in range(0, height, block_rows):
+            rows = min(block_rows, height - row)
+            block = src.read(window = Window(window.col_off, window.row_off + row, width, rows))
+            block[:, outside[row:row + rows]] = fill_value
+            out_image[:, row:row + rows] = block
+
+        out_meta = src.meta.copy()
+
+    out_meta.update({"driver": "GTiff",
+                     "height": height,
+                     "width": width,
+                     "transform": out_transform})
+    return out_image, out_meta
@@ -1,11 +1,13 @@
-# DETERMINE WHETHER TO RUN THIS SCRIPT ##############
-import yaml
+from context import RunContext
 
-# load menu
-with open("mnt/01-user-input/menu.yml", 'r') as f:
-    menu = yaml.safe_load(f)
 
-if menu['osm_poi']:
+def run(context):
+    # DETERMINE WHETHER TO RUN THIS SCRIPT ##############
+    menu = context.menu
+
+    if not menu['osm_poi']:
+        return
+
     print('run osm_poi')
     
     from os.path import exists
@@ -14,22 +16,15 @@ if menu['osm_poi']:
     from pathlib import Path
 
     # SET UP #########################################
-    # load city inputs files, to be updated for each city scan
-    with open("mnt/01-user-input/city_inputs.yml", 'r') as f:
-        city_inputs = yaml.safe_load(f)
-
-    city_name_l = city_inputs['city_name'].replace(' ', '_').lower()
-
-    # load global inputs, such as data sources that generally remain the same across scans
-    with open("python/global_inputs.yml", 'r') as f:
-        global_inputs = yaml.safe_load(f)
+    city_inputs = context.city_inputs
+    city_name_l = context.city_name_l
+    global_inputs = context.global_inputs
 
     # import GOSTnets -----------
     from GOSTnets.fetch_pois import OsmObject
 
     # Read AOI shapefile --------
-    # transform the input shp to correct prj (epsg 4326)
-    aoi_orig = gpd.read_file(f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{city_name_l}.shp').to_crs(epsg = 4326)
+    aoi_orig = context.aoi
     # buffer AOI by 5% of its width to capture roads immedately outside of city boundaries
     # TODO: determine whether to put this 5% buffer distance in one of the yaml files
     buff_dist = (aoi_orig.total_bounds[2] - aoi_orig.total_bounds[0]) * 0.05
@@ -37,8 +32,7 @@ if menu['osm_poi']:
     features = aoi_file.geometry
     
     # Define output folder ---------
-    output_folder = Path(f'mnt/city-directories/{city_name_l}/02-process-output/spatial')
-    os.makedirs(output_folder, exist_ok=True)
+    output_folder = context.output_folder_s
 
 
     # EXTRACT OSM POI ##############################
@@ -56,6 +50,7 @@ if menu['osm_poi']:
                     # create the OsmObject
                     queries[tags[0]] = OsmObject(f'{tags[0]}', features[0], tags[1])
     
+    failed = []
     for query in queries.items():
         try:
             result = query[1].GenerateOSMPOIs()
@@ -74,5 +69,13 @@ if menu['osm_poi']:
                 query_results_gpd = gpd.GeoDataFrame(query_results, crs = "epsg:4326", geometry = 'geometry')
                 query_results_gpd_shp = f'{city_name_l}_osm_{query[0]}'
                 query_results_gpd.to_file(output_folder / f'{query_results_gpd_shp}.gpkg', driver='GPKG')
-        except:
-            pass
+        except Exception as e:
+            failed.append(f'osm query {query[0]} failed: {e!r}')
+
+    print('failed processes:')
+    print(failed)
+    return failed
+
+
+if __name__ == '__main__':
+    run(RunContext())
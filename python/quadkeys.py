@@ -0,0 +1,70 @@
+# Vectorized Bing Maps quadkey decoding.
+# A quadkey of level L has one base-4 digit per zoom level; bit 0 of each digit is a bit of the tile's
+# x index and bit 1 a bit of its y index. The relative wealth index CSVs store level-14 quadkeys as
+# integers, so leading zeros are lost; the digits are taken arithmetically, which handles that.
+# Coordinates follow pyquadkey2's tile system (256 pixel tiles, pixels clipped to the map, rounded
+# to 1e-12 degrees), so tile corners are the same as QuadKey.to_geo.
+
+import numpy as np
+
+
+LATITUDE_RANGE = (-85.05112878, 85.05112878)
+
+
+def map_size(level):
+    return 256 << level
+
+
+def tile_xy(quadkeys, level = 14):
+    """Tile x and y indices of integer quadkeys (e.g. 12302310123012) of a level."""
+    quadkeys = np.asarray(quadkeys, dtype = np.int64)
+    tile_x = np.zeros(quadkeys.shape, dtype = np.int64)
+    tile_y = np.zeros(quadkeys.shape, dtype = np.int64)
+    for i in range(level):
+        digit = (quadkeys // 10 ** (level - 1 - i)) % 10
+        tile_x = (tile_x << 1) | (digit & 1)
+        tile_y = (tile_y << 1) | (digit >> 1)
+    return tile_x, tile_y
+
+
+def pixel_to_geo(pixel_x, pixel_y, level):
+    """(lat, lon) of pixel coordinates, as pyquadkey2's tilesystem.pixel_to_geo."""
+    ms = map_size(level)
+    x = np.clip(pixel_x, 0, ms - 1) / ms - 0.5
+    y = 0.5 - np.clip(pixel_y, 0, ms - 1) / ms
+    lat = 90 - 360 * np.arctan(np.exp(-y * 2 * np.pi)) / np.pi
+    lon = 360 * x
+    return np.round(lat * 1e12) / 1e12, np.round(lon * 1e12) / 1e12
+
+
+def geo_to_tile(lat, lon, level):
+    """Tile x and y indices containing (lat, lon), as pyquadkey2's QuadKey.from_geo."""
+    lat = np.clip(lat, *LATITUDE_RANGE)
+    lon = np.clip(lon, -180, 180)
+    sin_lat = np.sin(lat * np.pi / 180)
+    ms = map_size(level)
+    pixel_x = np.clip((lon + 180) / 360 * ms + 0.5, 0, ms - 1).astype(np.int64)
+    pixel_y = np.clip((0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * ms + 0.5, 0, ms - 1).astype(np.int64)
+    return pixel_x // 256, pixel_y // 256
+
+
+def tile_polygons(tile_x, tile_y, level = 14):
+    """Tile polygons in EPSG:4326, with the corners in NW, SW, SE, NE order, built in one shapely call."""
+    import shapely
+
+    north, west = pixel_to_geo(tile_x * 256, tile_y * 256, level)
+    south, east = pixel_to_geo(tile_x * 256 + 256, tile_y * 256 + 256, level)
+    coords = np.stack([np.stack([west, north], axis = -1),
+                       np.stack([west, south], axis = -1),
+                       np.stack([east, south], axis = -1),
+                       np.stack([east, north], axis = -1),
+                       np.stack([west, north], axis = -1)], axis = 1)
+    return shapely.polygons(coords)
+
+
+def in_bounds(tile_x, tile_y, bounds, level = 14, margin = 1):
+    """Mask of tiles within the tile range covering bounds (minx, miny, maxx, maxy), widened by margin tiles."""
+    minx, miny, maxx, maxy = bounds
+    x0, y1 = geo_to_tile(miny, minx, level)
+    x1, y0 = geo_to_tile(maxy, maxx, level)
+    return (tile_x >= x0 - margin) & (tile_x <= x1 + margin) & (tile_y >= y0 - margin) & (tile_y <= y1 + margin)
@@ -0,0 +1,85 @@
+# Raster outputs as cloud-optimized GeoTIFFs.
+# Every step writes its rasters through raster_writer (or write_raster for a whole array). The data
+# is first written to a tiled scratch GeoTIFF (in memory for small rasters, otherwise a temporary file
+# next to the output, so writers that work a block of rows at a time never hold the whole raster),
+# overviews are built there, and it is then copied to the output with COPY_SRC_OVERVIEWS, so the file
+# is tiled, DEFLATE-compressed, and has its overviews before the full-resolution data, as readers of
+# cloud-optimized GeoTIFFs expect. Integer rasters are compressed with the horizontal differencing
+# predictor and floating point rasters with the floating point one.
+# Masks and small class rasters can be bit-packed with nbits (e.g. nbits = 1 for flooded/not flooded).
+
+import os
+import numpy as np
+import rasterio
+import rasterio.shutil
+from contextlib import contextmanager
+from rasterio.io import MemoryFile
+from rasterio.enums import Resampling
+
+
+BLOCK_SIZE = 512
+# rasters up to this many uncompressed bytes are staged in memory rather than in a temporary file
+MEMORY_LIMIT = 64 * 2**20
+
+
+def cog_options(dtype, nbits = None):
+    """GeoTIFF creation options for a band dtype."""
+    if nbits:
+        predictor = 1
+    elif np.issubdtype(np.dtype(dtype), np.floating):
+        predictor = 3
+    else:
+        predictor = 2
+    options = {'tiled': True, 'blockxsize': BLOCK_SIZE, 'blockysize': BLOCK_SIZE, 'compress': 'DEFLATE', 'predictor': predictor}
+    if nbits:
+        options['nbits'] = nbits
+    return options
+
+
+def overview_factors(width, height):
+    """Overview decimation factors, halving until the overview fits in one block."""
+    factors = []
+    factor = 2
+    while max(width, height) / factor >= BLOCK_SIZE / 2:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+@contextmanager
+def raster_writer(path, meta, nbits = None, descriptions = None):
+    """Open a raster for writing, like rasterio.open(path, 'w', **meta), and save it as a cloud-optimized GeoTIFF on exit.
+    nbits bit-packs integer data with values below 2 ** nbits; descriptions name the bands."""
+    profile = {**meta, 'driver': 'GTiff', **cog_options(meta['dtype'], nbits)}
+    integer = np.issubdtype(np.dtype(meta['dtype']), np.integer)
+
+    def write(dst):
+        yield dst
+        for band, description in enumerate(descriptions or [], start = 1):
+            dst.set_band_description(band, description)
+        factors = overview_factors(dst.width, dst.height)
+        if factors:
+            dst.build_overviews(factors, Resampling.nearest if integer else Resampling.average)
+
+    size = meta['width'] * meta['height'] * meta.get('count', 1) * np.dtype(meta['dtype']).itemsize
+    if size <= MEMORY_LIMIT:
+        with MemoryFile() as memfile:
+            with memfile.open(**profile) as dst:
+                yield from write(dst)
+            rasterio.shutil.copy(memfile.name, path, driver = 'GTiff', copy_src_overviews = True, **cog_options(meta['dtype'], nbits))
+    else:
+        scratch = f'{path}.{os.getpid()}.tmp.tif'
+        try:
+            with rasterio.open(scratch, 'w', **profile, BIGTIFF = 'IF_SAFER') as dst:
+                yield from write(dst)
+            rasterio.shutil.copy(scratch, path, driver = 'GTiff', copy_src_overviews = True, **cog_options(meta['dtype'], nbits))
+        finally:
+            if os.path.exists(scratch):
+                os.remove(scratch)
+
+
+def write_raster(path, array, meta, nbits = None, descriptions = None):
+    """Write a (bands, rows, cols) or (rows, cols) array as a cloud-optimized GeoTIFF."""
+    array = array if array.ndim == 3 else array[np.newaxis]
+    with raster_writer(path, {**meta, 'count': array.shape[0]}, nbits, descriptions) as dst:
+        dst.write(array)
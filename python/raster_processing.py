@@ -1,174 +1,60 @@
-# DETERMINE WHETHER TO RUN THIS SCRIPT ##############
-import yaml
+from context import RunContext
+import gee_elevation
 
-# load menu
-with open("mnt/01-user-input/menu.yml", 'r') as f:
-    menu = yaml.safe_load(f)
 
-if menu['raster_processing']:
+def run(context):
+    # DETERMINE WHETHER TO RUN THIS SCRIPT ##############
+    menu = context.menu
+
+    if not menu['raster_processing']:
+        return
+
     print('run raster_processing')
     
     import os
-    import math
-    import geopandas as gpd
     import numpy as np
-    import rasterio.mask
     import rasterio
-    import requests
     from pathlib import Path
-    from rasterio.merge import merge
     from os.path import exists
-    import zipfile
-    from rasterio.warp import calculate_default_transform, reproject, Resampling
-    from shutil import copyfile
+    from mosaic import build_vrt, clip_raster
+    from zonal import cumulative_counts
+    from reclassify import reclassify_raster
+    from source_catalog import source_catalog
+    from demographics import accumulate
+    from raster_io import raster_writer
 
     # SET UP ##############################################
 
-    # load city inputs files, to be updated for each city scan
-    with open("mnt/01-user-input/city_inputs.yml", 'r') as f:
-        city_inputs = yaml.safe_load(f)
-
-    city_name_l = city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
-
-    # load global inputs, such as data sources that generally remain the same across scans
-    with open("python/global_inputs.yml", 'r') as f:
-        global_inputs = yaml.safe_load(f)
+    city_inputs = context.city_inputs
+    city_name_l = context.city_name_l
+    global_inputs = context.global_inputs
 
     # Read AOI shapefile --------
     print('read AOI shapefile')
-    # transform the input shp to correct prj (epsg 4326)
-    aoi_file = gpd.read_file(f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{city_name_l}.shp').to_crs(epsg = 4326)
-    features = aoi_file.geometry
-    aoi_bounds = aoi_file.bounds
-
-    # Set UTM CRS ---------------------
-    # automatically find utm zone
-    avg_lng = features.union_all().centroid.x
-
-    # calculate UTM zone from avg longitude to define CRS to project to
-    utm_zone = math.floor((avg_lng + 180) / 6) + 1
-    utm_crs = f"+proj=utm +zone={utm_zone} +ellps=WGS84 +datum=WGS84 +units=m +no_defs"
+    aoi_file = context.aoi
+    features = context.features
+    aoi_bounds = context.aoi_bounds
 
     # Define output folder ---------
-    output_folder_parent = Path(f'mnt/city-directories/{city_name_l}/02-process-output')
-    output_folder_s = output_folder_parent / 'spatial'
-    output_folder_t = output_folder_parent / 'tabular'
-    os.makedirs(output_folder_s, exist_ok=True)
-    os.makedirs(output_folder_t, exist_ok=True)
+    output_folder_s = context.output_folder_s
+    output_folder_t = context.output_folder_t
     
     # Start list of failed processes --------------
     failed = []
 
 
     # DOWNLOAD AND PREPARE DATA ##########################################
-    data_folder = Path('python/data')
+    # shared source data (not specific to the city) is handled in source_data.py
+    from source_data import data_folder, tile_finder, wsf_tile_names, fabdem_tile_names, country_pop_file, download_worldpop, download_wsf, download_fabdem, download_demographics
 
     os.makedirs(data_folder, exist_ok=True)
 
-    def tile_finder(direction, tile_size = 1):
-        coord_list = []
-
-        if direction == 'lat':
-            hemi_options = ['N', 'S']
-            coord_min = aoi_bounds.miny
-            coord_max = aoi_bounds.maxy
-            zfill_digits = 2
-        elif direction == 'lon':
-            hemi_options = ['E', 'W']
-            coord_min = aoi_bounds.minx
-            coord_max = aoi_bounds.maxx
-            zfill_digits = 3
-        else:
-            print('tile_finder function error')
-            print('Invalid direction. How did this happen?')
-
-        for i in range(len(aoi_bounds)):
-            if math.floor(coord_min[i]) >= 0:
-                hemi = hemi_options[0]
-                for y in range(math.floor(coord_min[i] / tile_size) * tile_size, 
-                                math.ceil(coord_max[i] / tile_size) * tile_size, 
-                                tile_size):
-                    coord_list.append(f'{hemi}{str(y).zfill(zfill_digits)}')
-            elif math.ceil(coord_max[i]) >= 0:
-                for y in range(0, 
-                                math.ceil(coord_max[i] / tile_size) * tile_size, 
-                                tile_size):
-                    coord_list.append(f'{hemi_options[0]}{str(y).zfill(zfill_digits)}')
-                for y in range(math.floor(coord_min[i] / tile_size) * tile_size, 
-                                0, 
-                                tile_size):
-                    coord_list.append(f'{hemi_options[1]}{str(-y).zfill(zfill_digits)}')
-            else:
-                hemi = hemi_options[1]
-                for y in range(math.floor(coord_min[i] / tile_size) * tile_size, 
-                                math.ceil(coord_max[i] / tile_size) * tile_size, 
-                                tile_size):
-                    coord_list.append(f'{hemi}{str(-y).zfill(zfill_digits)}')
-
-        return coord_list
-
 
     # Download and prepare WorldPop data ------------
     if menu['population']:
         print('download and prepare population')
 
-        pop_folder = data_folder / 'pop'
-
-        os.makedirs(pop_folder, exist_ok=True)
-
-        # default population data source: WorldPop
-
-        # use WorldPop API to query data URL
-        wp_file_json = requests.get(f"https://hub.worldpop.org/rest/data/pop/cic2020_100m?iso3={city_inputs['country_iso3']}").json()
-        wp_file_list = wp_file_json['data'][0]['files']
-
-        # check if the country's population raster has already been downloaded
-        # download if the file does not already exist
-        if not exists(pop_folder / f"{city_inputs['country_name'].replace(' ', '_').lower()}_pop.tif"):
-            if len(wp_file_list) > 1:
-                # if more than one raster file is listed (uncommon), download each file and then mosaic them
-                for f in wp_file_list:
-                    wp_file = requests.get(f)
-                    wp_file_name = f.split('/')[-1]
-                    
-                    open(pop_folder / wp_file_name, 'wb').write(wp_file.content)
-
-                try:
-                    raster_to_mosaic = []
-                    mosaic_file = f"{city_inputs['country_name'].replace(' ', '_').lower()}_pop.tif"
-
-                    mosaic_list = os.listdir(pop_folder.iterdir())
-                    for p in mosaic_list:
-                        if p.endswith('.tif'):
-                            raster = rasterio.open(pop_folder / p)
-                            raster_to_mosaic.append(raster)
-
-                    mosaic, output = merge(raster_to_mosaic)
-                    output_meta = raster.meta.copy()
-                    output_meta.update(
-                        {"driver": "GTiff",
-                         "height": mosaic.shape[1],
-                         "width": mosaic.shape[2],
-                         "transform": output,
-                        }
-                    )
-
-                    with rasterio.open(pop_folder / mosaic_file, 'w', **output_meta) as m:
-                        m.write(mosaic)
-                except MemoryError:
-                    err_msg = 'MemoryError when merging population raster files.'
-                    print(err_msg)
-                    print('Try GIS instead for merging.')
-                    failed.append(err_msg)
-            elif len(wp_file_list) == 1:
-                wp_file = requests.get(wp_file_list[0])
-                wp_file_name = f"{city_inputs['country_name'].replace(' ', '_').lower()}_pop.tif"
-                open(pop_folder / wp_file_name, 'wb').write(wp_file.content)
-            else:
-                err_msg = 'No WorldPop file available'
-                print(err_msg)
-                print('Use a different WorldPop dataset or another population data source')
-                failed.append(err_msg)
+        download_worldpop(city_inputs['country_iso3'], city_inputs['country_name'], failed)
 
     # Download and prepare WSF evolution data ----------------
     if menu['wsf']:
@@ -176,52 +62,11 @@ if menu['raster_processing']:
 
         wsf_folder = data_folder / 'wsf'
 
-        os.makedirs(wsf_folder, exist_ok=True)
+        wsf_downloaded_files = download_wsf(wsf_tile_names(aoi_bounds))
 
-        wsf_downloaded_files = []
-        for i in range(len(aoi_bounds)):
-            for x in range(math.floor(aoi_bounds.minx[i] - aoi_bounds.minx[i] % 2), math.ceil(aoi_bounds.maxx[i]), 2):
-                for y in range(math.floor(aoi_bounds.miny[i] - aoi_bounds.miny[i] % 2), math.ceil(aoi_bounds.maxy[i]), 2):
-                    file_name = f'WSFevolution_v1_{x}_{y}'
-                    if exists(wsf_folder / f'{file_name}.tif'):
-                        wsf_downloaded_files.append(file_name)
-                    else:
-                        try:
-                            file = requests.get(f'https://download.geoservice.dlr.de/WSF_EVO/files/{file_name}/{file_name}.tif')
-                            open(wsf_folder / f'{file_name}.tif', 'wb').write(file.content)
-                            wsf_downloaded_files.append(file_name)
-                        except Exception as e:
-                            print(f'WSF download exception: {e}')
-
-        if len(wsf_downloaded_files) > 1:
-            try:
-                raster_to_mosaic = []
-                mosaic_file = f'{city_name_l}_wsf_evolution.tif'
-
-                if not exists(wsf_folder / mosaic_file):
-                    for p in wsf_downloaded_files:
-                        raster = rasterio.open(wsf_folder / f'{p}.tif')
-                        raster_to_mosaic.append(raster)
-
-                    mosaic, output = merge(raster_to_mosaic)
-                    output_meta = raster.meta.copy()
-                    output_meta.update(
-                        {"driver": "GTiff",
-                         "height": mosaic.shape[1],
-                         "width": mosaic.shape[2],
-                         "transform": output,
-                        }
-                    )
-
-                    with rasterio.open(wsf_folder / mosaic_file, 'w', **output_meta) as m:
-                        m.write(mosaic)
-            except MemoryError:
-                err_msg = 'MemoryError when merging WSF evolution raster files.'
-                print(err_msg) 
-                print('Try GIS instead for merging.')
-                failed.append(err_msg)
-        elif len(wsf_downloaded_files) == 1:
-            os.replace(wsf_folder / f'{wsf_downloaded_files[0]}.tif', wsf_folder / f'{city_name_l}_wsf_evolution.tif')
+        if wsf_downloaded_files:
+            # virtual mosaic: the tiles stay shared with other cities and only the AOI window is read when clipping
+            build_vrt([wsf_folder / f'{p}.tif' for p in wsf_downloaded_files], wsf_folder / f'{city_name_l}_wsf_evolution.vrt')
         else:
             err_msg = 'No WSF evolution file available'
             print(err_msg)
@@ -231,89 +76,21 @@ if menu['raster_processing']:
     if menu['elevation'] or menu['slope']:
         elev_folder = data_folder / 'elev'
         
-        if not exists(elev_folder / f'{city_name_l}_elevation.tif'):
-            print('download and prepare elevation')
-
-            os.makedirs(elev_folder, exist_ok=True)
-
-            aoi_bounds = aoi_file.bounds
-
-            lat_tiles_big = tile_finder('lat', 10)
-            lon_tiles_big = tile_finder('lon', 10)
-            lat_tiles_small = tile_finder('lat', 1)
-            lon_tiles_small = tile_finder('lon', 1)
-
-            def tile_end_matcher(tile_starter):
-                if tile_starter == 'S10':
-                    return 'N00'
-                elif tile_starter == 'W010':
-                    return 'E000'
-                elif tile_starter[0] == 'N' or tile_starter[0] == 'E':
-                    return f'{tile_starter[0]}{str(int(tile_starter[1:]) + 10).zfill(len(tile_starter) - 1)}'
-                elif tile_starter[0] == 'S' or tile_starter[0] == 'W':
-                    return f'{tile_starter[0]}{str(int(tile_starter[1:]) - 10).zfill(len(tile_starter) - 1)}'
-                else:
-                    print('tile_end_matcher function error')
-                    print('Invalid input. How did this happen?')
-
-            elev_downloaded_files = []
-            for lat in lat_tiles_big:
-                for lon in lon_tiles_big:
-                    file_name = f'{lat}{lon}-{tile_end_matcher(lat)}{tile_end_matcher(lon)}_FABDEM_V1-2.zip'
-                    if not exists(elev_folder / file_name):
-                        print(f'download elevation file: {file_name}')
-                        file = requests.get(f'https://data.bris.ac.uk/datasets/s5hqmjcdj8yo2ibzi9b4ew3sn/{file_name}')
-                        open(elev_folder / file_name, 'wb').write(file.content)
-
-                    # unzip downloads
-                    for lat1 in lat_tiles_small:
-                        for lon1 in lon_tiles_small:
-                            file_name1 = f'{lat1}{lon1}_FABDEM_V1-2.tif'
-                            if not exists(elev_folder / file_name1):
-                                try:
-                                    with zipfile.ZipFile(elev_folder / file_name, 'r') as z:
-                                        z.extract(file_name1, elev_folder)
-                                        elev_downloaded_files.append(file_name1)
-                                except:
-                                    pass
-
-            if len(elev_downloaded_files) > 1:
-                try:
-                    raster_to_mosaic = []
-                    mosaic_file = f'{city_name_l}_elevation.tif'
-
-                    if not exists(elev_folder / mosaic_file):
-                        for p in elev_downloaded_files:
-                            raster = rasterio.open(elev_folder / p)
-                            raster_to_mosaic.append(raster)
-
-                        mosaic, output = merge(raster_to_mosaic)
-                        output_meta = raster.meta.copy()
-                        output_meta.update(
-                            {"driver": "GTiff",
-                            "height": mosaic.shape[1],
-                            "width": mosaic.shape[2],
-                            "transform": output,
-                            }
-                        )
-
-                        with rasterio.open(elev_folder / mosaic_file, 'w', **output_meta) as m:
-                            m.write(mosaic)
-                except MemoryError:
-                    err_msg = 'MemoryError when merging elevation raster files.'
-                    print(err_msg)
-                    print('Try GIS instead for merging.')
-                    failed.append(err_msg)
-            elif len(elev_downloaded_files) == 1:
-                os.replace(elev_folder / elev_downloaded_files[0], elev_folder / f'{city_name_l}_elevation.tif')
-            else:
-                err_msg = 'No elevation file available; use SRTM instead for elevation'
-                print(err_msg)
-                failed.append(err_msg)
+        print('download and prepare elevation')
+
+        # tiles already in the source data cache are not downloaded again;
+        # the mosaic is rebuilt each time in case the cache evicted some of them since the last run
+        elev_downloaded_files = download_fabdem(fabdem_tile_names(aoi_bounds))
 
-                # trigger gee_elevation.py
-                with open('python/gee_elevation.py') as f:
-                    exec(f.read())
+        if elev_downloaded_files:
+            build_vrt([elev_folder / p for p in elev_downloaded_files], elev_folder / f'{city_name_l}_elevation.vrt')
+        else:
+            err_msg = 'No elevation file available; use SRTM instead for elevation'
+            print(err_msg)
+            failed.append(err_msg)
+
+            # trigger gee_elevation.py
+            gee_elevation.run(context)
     
     # Download and prepare demographics data ------------------
     if menu['demographics']:
@@ -321,28 +98,13 @@ if menu['raster_processing']:
 
         demo_folder = data_folder / 'demographics'
 
-        os.makedirs(demo_folder, exist_ok=True)
-        
-        demo_file_json = requests.get(f"https://www.worldpop.org/rest/data/age_structures/ascic_2020?iso3={city_inputs['country_iso3']}").json()
-        demo_file_list = demo_file_json['data'][0]['files']
-
-        for f in demo_file_list:
-            demo_file_name = f.split('/')[-1]
-
-            if not exists(demo_folder / demo_file_name):
-                try:
-                    demo_file = requests.get(f)
-                    open(demo_folder / demo_file_name, 'wb').write(demo_file.content)
-                except:
-                    err_msg = 'No demographics files available'
-                    print(err_msg)
-                    failed.append(err_msg)
+        download_demographics(city_inputs['country_iso3'], failed)
     
     # Prepare flood data (coastal, fluvial, pluvial) ---------------------
     if menu['flood_coastal'] or menu['flood_fluvial'] or menu['flood_pluvial']:
         print('prepare flood')
 
-        # merged data folder (before clipping)
+        # virtual mosaics of the flood tiles (before clipping)
         flood_folder = data_folder / 'flood'
 
         os.makedirs(flood_folder, exist_ok=True)
@@ -351,14 +113,15 @@ if menu['raster_processing']:
         rps = [10, 100, 1000, 20, 200, 5, 50, 500]
         
         # find relevant tiles
-        lat_tiles = tile_finder('lat')
-        lon_tiles = tile_finder('lon')
+        lat_tiles = tile_finder(aoi_bounds, 'lat')
+        lon_tiles = tile_finder(aoi_bounds, 'lon')
 
         flood_threshold = global_inputs['flood']['threshold']
         flood_years = global_inputs['flood']['year']
         flood_ssps = global_inputs['flood']['ssp']
         flood_ssp_labels = {1: '1_2.6', 2: '2_4.5', 3: '3_7.0', 5: '5_8.5'}
         flood_prob_cutoff = global_inputs['flood']['prob_cutoff']
+        flood_rp_bins = None
         if not len(flood_prob_cutoff) == 2:
             err_msg = '2 cutoffs required for flood'
             print(err_msg)
@@ -377,139 +140,30 @@ if menu['raster_processing']:
                 elif annual_prob > flood_prob_cutoff[1]:
                     flood_rp_bins[f'gt{flood_prob_cutoff[1]}'].append(rp)
 
-            def flood_processing0(flood_type):
-                print(f'prepare {flood_type} flood')
+        # raw data folder
+        flood_type_folder_dict = {'coastal': 'COASTAL_UNDEFENDED',
+                                  'fluvial': 'FLUVIAL_UNDEFENDED',
+                                  'pluvial': 'PLUVIAL_DEFENDED'}
+
+        def flood_mosaic(flood_type, year, ssp, rp):
+            """Path of the virtual mosaic of the tiles of one flood type, year, SSP (None up to 2020) and return period,
+            or None if there are no tiles for it."""
+            raw_flood_folder = Path(f"mnt/source-data/{global_inputs['flood_source']}") / flood_type_folder_dict[flood_type]
+            tile_type = flood_type_folder_dict[flood_type].replace('_', '-')
+            if ssp is None:
+                mosaic_file = f'{city_name_l}_{flood_type}_{year}_1in{rp}.vrt'
+                raster_file_names = [f"{year}/1in{rp}/1in{rp}-{tile_type}-{year}_{lat.lower()}{lon.lower()}.tif" for lat in lat_tiles for lon in lon_tiles]
+            else:
+                mosaic_file = f'{city_name_l}_{flood_type}_{year}_ssp{ssp}_1in{rp}.vrt'
+                raster_file_names = [f"{year}/SSP{flood_ssp_labels[ssp]}/1in{rp}/1in{rp}-{tile_type}-{year}-SSP{flood_ssp_labels[ssp]}_{lat.lower()}{lon.lower()}.tif" for lat in lat_tiles for lon in lon_tiles]
 
-                # raw data folder
-                flood_type_folder_dict = {'coastal': 'COASTAL_UNDEFENDED',
-                                        'fluvial': 'FLUVIAL_UNDEFENDED',
-                                        'pluvial': 'PLUVIAL_DEFENDED'}
-                raw_flood_folder = Path(f"mnt/source-data/{global_inputs['flood_source']}") / flood_type_folder_dict[flood_type]
-                
-                # prepare flood raster files (everything before clipping)
-                for year in flood_years:
-                    if year <= 2020:
-                        for rp in rps:
-                            # identify tiles and merge as needed
-                            raster_to_mosaic = []
-                            mosaic_file = f'{city_name_l}_{flood_type}_{year}_1in{rp}.tif'
-
-                            if not exists(flood_folder / mosaic_file):
-                                for lat in lat_tiles:
-                                    for lon in lon_tiles:
-                                        raster_file_name = f"{year}/1in{rp}/1in{rp}-{flood_type_folder_dict[flood_type].replace('_', '-')}-{year}_{lat.lower()}{lon.lower()}.tif"
-                                        if exists(raw_flood_folder / raster_file_name):
-                                            raster_to_mosaic.append(raw_flood_folder / raster_file_name)
-                                if len(raster_to_mosaic) == 0:
-                                    print(f'no raster for {flood_type} {year} 1-in-{rp}')
-                                elif len(raster_to_mosaic) == 1:
-                                    copyfile(raster_to_mosaic[0], flood_folder / mosaic_file)
-                                else:
-                                    try:
-                                        raster_to_mosaic1 = []
-                                        for p in raster_to_mosaic:
-                                            raster = rasterio.open(p)
-                                            raster_to_mosaic1.append(raster)
-                                        
-                                        mosaic, output = merge(raster_to_mosaic1)
-                                        output_meta = raster.meta.copy()
-                                        output_meta.update(
-                                            {"driver": "GTiff",
-                                            "height": mosaic.shape[1],
-                                            "width": mosaic.shape[2],
-                                            "transform": output,
-                                            }
-                                        )
-
-                                        with rasterio.open(flood_folder / mosaic_file, 'w', **output_meta) as m:
-                                            m.write(mosaic)
-                                    except MemoryError:
-                                        err_msg = f'MemoryError when merging flood_{flood_type} {year} 1-in-{rp} raster files.'
-                                        print(err_msg) 
-                                        print('Try GIS instead for merging.')
-                                        failed.append(err_msg)
-                            
-                            # apply threshold
-                            if exists(flood_folder / mosaic_file):
-                                def flood_con():
-                                    with rasterio.open(flood_folder / mosaic_file) as src:
-                                        out_image = src.read(1)
-                                        out_image[out_image == src.meta['nodata']] = 0
-                                        out_image[out_image < flood_threshold] = 0
-                                        out_image[out_image >= flood_threshold] = 1
-                                        out_meta = src.meta.copy()
-                                        out_meta.update({'nodata': 0})
-
-                                    with rasterio.open(flood_folder / f'{mosaic_file[:-4]}_con.tif', "w", **out_meta) as dest:
-                                        dest.write(out_image, 1)
-                                
-                                flood_con()
-
-                    elif year > 2020:
-                        for ssp in flood_ssps:
-                            for rp in rps:
-                                # identify tiles and merge as needed
-                                raster_to_mosaic = []
-                                mosaic_file = f'{city_name_l}_{flood_type}_{year}_ssp{ssp}_1in{rp}.tif'
-
-                                if not exists(flood_folder / mosaic_file):
-                                    for lat in lat_tiles:
-                                        for lon in lon_tiles:
-                                            raster_file_name = f"{year}/SSP{flood_ssp_labels[ssp]}/1in{rp}/1in{rp}-{flood_type_folder_dict[flood_type].replace('_', '-')}-{year}-SSP{flood_ssp_labels[ssp]}_{lat.lower()}{lon.lower()}.tif"
-                                            if exists(raw_flood_folder / raster_file_name):
-                                                raster_to_mosaic.append(raw_flood_folder / raster_file_name)
-                                    if len(raster_to_mosaic) == 0:
-                                        print(f'no raster for {flood_type} {year} ssp{ssp} 1-in-{rp}')
-                                    elif len(raster_to_mosaic) == 1:
-                                        copyfile(raster_to_mosaic[0], flood_folder / mosaic_file)
-                                    else:
-                                        try:
-                                            raster_to_mosaic1 = []
-                                            for p in raster_to_mosaic:
-                                                raster = rasterio.open(p)
-                                                raster_to_mosaic1.append(raster)
-                                            
-                                            mosaic, output = merge(raster_to_mosaic1)
-                                            output_meta = raster.meta.copy()
-                                            output_meta.update(
-                                                {"driver": "GTiff",
-                                                "height": mosaic.shape[1],
-                                                "width": mosaic.shape[2],
-                                                "transform": output,
-                                                }
-                                            )
-
-                                            with rasterio.open(flood_folder / mosaic_file, 'w', **output_meta) as m:
-                                                m.write(mosaic)
-                                        except MemoryError:
-                                            err_msg = f'MemoryError when merging flood_{flood_type} {year} ssp{ssp} 1-in-{rp} raster files.'
-                                            print(err_msg) 
-                                            print('Try GIS instead for merging.')
-                                            failed.append(err_msg)
-                                
-                                # apply threshold
-                                if exists(flood_folder / mosaic_file):
-                                    def flood_con():
-                                        with rasterio.open(flood_folder / mosaic_file) as src:
-                                            out_image = src.read(1)
-                                            out_image[out_image == src.meta['nodata']] = 0
-                                            out_image[out_image < flood_threshold] = 0
-                                            out_image[out_image >= flood_threshold] = 1
-                                            if np.nanmax(out_image) > 1:
-                                                print(mosaic_file)
-                                                print('max value: ', np.nanmax(out_image))
-                                                exit()
-                                            out_meta = src.meta.copy()
-                                            out_meta.update({'nodata': 0})
-
-                                        with rasterio.open(flood_folder / f'{mosaic_file[:-4]}_con.tif', "w", **out_meta) as dest:
-                                            dest.write(out_image, 1)
-                                
-                                    flood_con()
-
-            for ft in ['coastal', 'fluvial', 'pluvial']:
-                if menu[f'flood_{ft}']:
-                    flood_processing0(ft)
+            if not exists(flood_folder / mosaic_file):
+                raster_to_mosaic = [raw_flood_folder / r for r in raster_file_names if exists(raw_flood_folder / r)]
+                if len(raster_to_mosaic) == 0:
+                    print(f"no raster for {flood_type} {year}{'' if ssp is None else f' ssp{ssp}'} 1-in-{rp}")
+                    return None
+                build_vrt(raster_to_mosaic, flood_folder / mosaic_file)
+            return flood_folder / mosaic_file
 
 
     # DEFINE FUNCTIONS #################################
@@ -519,119 +173,54 @@ if menu['raster_processing']:
         if not exists(output_folder_s / f'{city_name_l}_{data_type}.tif'):
             print(f'process {data_type}')
 
-            with rasterio.open(input_raster) as src:
-                # shapely presumes all operations on two or more features exist in the same Cartesian plane.
-                out_image, out_transform = rasterio.mask.mask(
-                    src, features, all_touched = True, crop = True)
-                out_meta = src.meta.copy()
+            # only the AOI window of the (possibly virtual) source is read
+            clipped = source_catalog().clip(input_raster, features)
+            if clipped is None:
+                raise ValueError(f'{input_raster} does not cover the AOI')
+            out_image, out_meta = clipped
 
-            out_meta.update({"driver": "GTiff",
-                            "height": out_image.shape[1],
-                            "width": out_image.shape[2],
-                            "transform": out_transform})
-
-            with rasterio.open(output_folder_s / f'{city_name_l}_{data_type}.tif', "w", **out_meta) as dest:
+            with raster_writer(output_folder_s / f'{city_name_l}_{data_type}.tif', out_meta) as dest:
                 dest.write(out_image)
+            context.cache_raster(output_folder_s / f'{city_name_l}_{data_type}.tif', out_image, out_meta)
 
     # Different from clipdata because wsf needs to be bucketed by year
     def clipdata_wsf(input_raster):
         # features = features.tolist()
 
         # clip
-        with rasterio.open(input_raster) as src:
-            # shapely presumes all operations on two or more features exist in the same Cartesian plane.
-            out_image, out_transform = rasterio.mask.mask(
-                src, features, all_touched = True, crop = True)
-            out_meta = src.meta.copy()
-
-            out_meta.update({"driver": "GTiff",
-                             "height": out_image.shape[1],
-                             "width": out_image.shape[2],
-                             "transform": out_transform,
-                             "nodata": 0})
-
-            output_4326_raster_clipped = output_folder_s / f'{city_name_l}_wsf_4326.tif'
-
-            # save for stats
-            with rasterio.open(output_4326_raster_clipped, "w", **out_meta) as dest:
-                dest.write(out_image)
+        out_image, out_meta = clip_raster(input_raster, features)
+        out_meta.update({"nodata": 0})
 
-            # 3. need to transform the clipped ghsl to utm
-            with rasterio.open(output_4326_raster_clipped) as src:
-                transform, width, height = calculate_default_transform(
-                    src.crs, utm_crs, src.width, src.height, *src.bounds)
-                kwargs = src.meta.copy()
-                kwargs.update({
-                    'crs': utm_crs,
-                    'transform': transform,
-                    'width': width,
-                    'height': height
-                })
-
-                output_utm_raster_clipped = output_folder_s / f'{city_name_l}_wsf_utm.tif'
-                with rasterio.open(output_utm_raster_clipped, 'w', **kwargs) as dst:
-                    for i in range(1, src.count + 1):
-                        reproject(
-                            source=rasterio.band(src, i),
-                            destination=rasterio.band(dst, i),
-                            src_transform=src.transform,
-                            src_crs=src.crs,
-                            dst_transform=transform,
-                            dst_crs=utm_crs,
-                            resampling=Resampling.nearest)
-            
-            with rasterio.open(output_utm_raster_clipped) as src:
-                pixelSizeX, pixelSizeY = src.res
-
-                array = src.read()
-
-                # Reclassify
-                year_dict = {}
-                for year in range(1985, 2016):
-                    # resolution of each pixel about 30 sq meters. Multiply by pixelSize and Divide by 1,000,000 to get sq km
-                    if year == 1985:
-                        year_dict[year] = np.count_nonzero(
-                        array == year) * pixelSizeX * pixelSizeY / 1000000
-                    else:
-                        year_dict[year] = np.count_nonzero(
-                            array == year) * pixelSizeX * pixelSizeY / 1000000 + year_dict[year-1]
-
-                # save CSV
-                with open(output_folder_t / f"{city_name_l}_wsf_stats.csv", 'w') as f:
-                    f.write("year,cumulative sq km\n")
-                    for key in year_dict.keys():
-                        f.write("%s,%s\n" % (key, year_dict[key]))
-
-            # Reclassify
-            def wsf_reclassify():
-                with rasterio.open(output_folder_s / f'{city_name_l}_wsf_4326.tif') as src:
-                    out_image = src.read(1)
-                    out_image[out_image < 1985] = 0
-                    out_image[(out_image <= 2015) & (out_image >= 2006)] = 4
-                    out_image[(out_image < 2006) & (out_image >= 1996)] = 3
-                    out_image[(out_image < 1996) & (out_image >= 1986)] = 2
-                    out_image[out_image == 1985] = 1
-                    out_meta = src.meta.copy()
-                    out_meta.update({'nodata': 0})
-
-                with rasterio.open(output_folder_s / f'{city_name_l}_wsf_4326_reclass.tif', "w", **out_meta) as dest:
-                    dest.write(out_image, 1)
-
-            wsf_reclassify()
-
-    def clipdata_demo(input_raster):
-        with rasterio.open(input_raster) as src:
-            # shapely presumes all operations on two or more features exist in the same Cartesian plane.
-            out_image, out_transform = rasterio.mask.mask(
-                src, features, all_touched = True, crop = True)
-            out_meta = src.meta.copy()
-
-        out_meta.update({"driver": "GTiff",
-                         "height": out_image.shape[1],
-                         "width": out_image.shape[2],
-                         "transform": out_transform})
-
-        return out_image, out_meta
+        output_4326_raster_clipped = output_folder_s / f'{city_name_l}_wsf_4326.tif'
+
+        # save for stats
+        with raster_writer(output_4326_raster_clipped, out_meta) as dest:
+            dest.write(out_image)
+
+        # 3. warp the clipped wsf onto the AOI window of the city's analysis grid
+        grid = context.analysis_grid.window_around(features)
+        array, nodata = grid.warp(output_4326_raster_clipped)
+        output_utm_raster_clipped = output_folder_s / f'{city_name_l}_wsf_utm.tif'
+        utm_meta = grid.meta(out_meta['dtype'], nodata, array.shape[0])
+        with raster_writer(output_utm_raster_clipped, utm_meta) as dst:
+            dst.write(array)
+        context.cache_raster(output_utm_raster_clipped, array, utm_meta)
+        pixelSizeX, pixelSizeY = grid.res
+
+        # cumulative built-up area by year, in one pass over the array
+        # resolution of each pixel about 30 sq meters. Multiply by pixelSize and Divide by 1,000,000 to get sq km
+        years = range(1985, 2016)
+        year_dict = dict(zip(years, cumulative_counts(array, years) * pixelSizeX * pixelSizeY / 1000000))
+
+        # save CSV
+        with open(output_folder_t / f"{city_name_l}_wsf_stats.csv", 'w') as f:
+            f.write("year,cumulative sq km\n")
+            for key in year_dict.keys():
+                f.write("%s,%s\n" % (key, year_dict[key]))
+
+        # Reclassify years into periods, with the wsf table in global_inputs.yml
+        reclassify_raster(output_folder_s / f'{city_name_l}_wsf_4326.tif', output_folder_s / f'{city_name_l}_wsf_4326_reclass.tif',
+                          global_inputs['reclassify']['wsf'], nodata = 0)
 
 
     # RASTER PROCESSING ################################
@@ -640,7 +229,7 @@ if menu['raster_processing']:
     # population
     if menu['population']:
         try:
-            clipdata(pop_folder / f"{city_inputs['country_name'].replace(' ', '_').lower()}_pop.tif", 'population')
+            clipdata(country_pop_file(city_inputs['country_name']), 'population')
         except:
             failed.append('process population failed')
 
@@ -648,17 +237,16 @@ if menu['raster_processing']:
     if menu['wsf']:
         # try:
         print('process wsf')
-        clipdata_wsf(wsf_folder / f'{city_name_l}_wsf_evolution.tif')
+        clipdata_wsf(wsf_folder / f'{city_name_l}_wsf_evolution.vrt')
         # except:
         #     failed.append('process wsf failed')
     
     # elevation
     if menu['elevation'] or menu['slope']:
         try:
-            clipdata(elev_folder / f'{city_name_l}_elevation.tif', 'elevation')
+            clipdata(elev_folder / f'{city_name_l}_elevation.vrt', 'elevation')
         except:
-            with open('python/gee_elevation.py') as f:
-                exec(f.read())
+            gee_elevation.run(context)
     
     # demographics
     if menu['demographics']:
@@ -672,186 +260,115 @@ if menu['raster_processing']:
                         'elderly_60_plus': range(60, 85, 5),
                         'reproductive_age': range(15, 50, 5),
                         'all_age_groups': [1] + list(range(0, 85, 5))}
-            
-            # aggregate total population and calculate sex ratio
-            raster_to_add = []
-            sex_dict = {s: [] for s in sexes}
+
+            # each age/sex raster is read once and added to every group it belongs to
+            rasters = {(i, s): demo_folder / f'{city_inputs["country_iso3"].lower()}_{s}_{i}_2020_constrained.tif'
+                       for i in age_dict['all_age_groups'] for s in sexes}
+            groups = {'total': list(rasters), **{s: [(i, s) for i in age_dict['all_age_groups']] for s in sexes}}
+            for group in age_dict:
+                if group == 'reproductive_age':
+                    groups[f'women_{group}'] = [(i, 'f') for i in age_dict[group]]
+                elif group != 'all_age_groups':
+                    groups[group] = [(i, s) for i in age_dict[group] for s in sexes]
+            pop_totals, group_sums, raster_meta = accumulate(rasters, groups, features)
 
             with open(output_folder_t / f'{city_name_l}_demographics.csv', 'w') as f:
                 f.write('age_group,sex,population\n')
 
-                for i in age_dict['all_age_groups']:
-                    for s in sexes:
-                        raster_array, raster_meta = clipdata_demo(demo_folder / f'{city_inputs["country_iso3"].lower()}_{s}_{i}_2020_constrained.tif')
-                        raster_array[raster_array == raster_meta['nodata']] = 0
-
-                        if i == 0:
-                            age_group_label = '0-1'
-                        elif i == 1:
-                            age_group_label = '1-4'
-                        elif i == 80:
-                            age_group_label = '80+'
-                        else:
-                            age_group_label = f'{i}-{i+4}'
-
-                        f.write('%s,%s,%s\n' % (age_group_label, s, sum(sum(sum(raster_array)))))
-                        
-                        raster_to_add.append(raster_array)
-                        sex_dict[s].append(raster_array)
-            demo_total = sum(raster_to_add)
-            raster_meta.update({'nodata': 0})
-            with rasterio.open(output_folder_s / f"{city_name_l}_demo_total.tif", 'w', **raster_meta) as m:
-                m.write(demo_total)
-            with rasterio.open(output_folder_s / f"{city_name_l}_sex_ratio.tif", 'w', **raster_meta) as m:
-                m.write(np.divide(sum(sex_dict['f']), sum(sex_dict['m'])))
-
-            # aggregate age groups
-            for group in age_dict:
-                if group != 'all_age_groups':
-                    raster_to_add = []
-                    
-                    for i in age_dict[group]:
-                        for s in sexes:
-                            if not ((i == 'reproductive_age') and (s == 'm')):
-                                raster_array, raster_meta = clipdata_demo(demo_folder / f'{city_inputs["country_iso3"].lower()}_{s}_{i}_2020_constrained.tif')
-                                raster_array[raster_array == raster_meta['nodata']] = 0
-                                raster_to_add.append(raster_array)
-                    
-                    if i == 'reproductive_age':
-                        output_name = f"{city_name_l}_women_{group}.tif"
+                for i, s in rasters:
+                    if i == 0:
+                        age_group_label = '0-1'
+                    elif i == 1:
+                        age_group_label = '1-4'
+                    elif i == 80:
+                        age_group_label = '80+'
                     else:
-                        output_name = f"{city_name_l}_{group}.tif"
-                    raster_meta.update({'nodata': 0})
-                    with rasterio.open(output_folder_s / output_name, 'w', **raster_meta) as m:
-                        m.write(sum(raster_to_add) / demo_total)
+                        age_group_label = f'{i}-{i+4}'
+
+                    f.write('%s,%s,%s\n' % (age_group_label, s, pop_totals[(i, s)]))
+
+            # aggregate total population and calculate sex ratio
+            demo_total = group_sums['total']
+            raster_meta.update({'nodata': 0, 'count': 1})
+            with raster_writer(output_folder_s / f"{city_name_l}_demo_total.tif", raster_meta) as m:
+                m.write(demo_total.astype(raster_meta['dtype']), 1)
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                with raster_writer(output_folder_s / f"{city_name_l}_sex_ratio.tif", raster_meta) as m:
+                    m.write((group_sums['f'] / group_sums['m']).astype(raster_meta['dtype']), 1)
+
+                # age groups as shares of the total population, one band per group
+                age_groups = [g for g in groups if g not in ['total'] + sexes]
+                raster_meta.update({'count': len(age_groups)})
+                with raster_writer(output_folder_s / f"{city_name_l}_age_groups.tif", raster_meta) as m:
+                    for band, group in enumerate(age_groups, start = 1):
+                        m.write((group_sums[group] / demo_total).astype(raster_meta['dtype']), band)
+                        m.set_band_description(band, group)
         except:
             failed.append('process demographics failed')
     
-    if menu['flood_coastal'] or menu['flood_fluvial'] or menu['flood_pluvial']:
+    if (menu['flood_coastal'] or menu['flood_fluvial'] or menu['flood_pluvial']) and flood_rp_bins is not None:
+        from concurrent.futures import ThreadPoolExecutor
+
         # buffer AOI
         buffer_aoi = aoi_file.buffer(np.nanmax([aoi_bounds.maxx - aoi_bounds.minx, aoi_bounds.maxy - aoi_bounds.miny])).geometry
-
-        def flood_processing1(flood_type):
-            print(f'process {flood_type} flood')
-            for year in flood_years:
-                if year <= 2020:
-                    composite_raster_arrays = []
-                    for i in range(len(flood_rp_bins)):
-                        raster_to_merge = [f'{city_name_l}_{flood_type}_{year}_1in{rp}_con.tif' for rp in flood_rp_bins[list(flood_rp_bins.keys())[i]] if exists(flood_folder / (f'{city_name_l}_{flood_type}_{year}_1in{rp}_con.tif'))]
-                        raster_arrays = []
-
-                        for r in raster_to_merge:
-                            with rasterio.open(flood_folder / r) as src:
-                                # shapely presumes all operations on two or more features exist in the same Cartesian plane.
-                                out_image, out_transform = rasterio.mask.mask(
-                                    src, buffer_aoi, all_touched = True, crop = True)
-                                out_meta = src.meta.copy()
-
-                            out_meta.update({"driver": "GTiff",
-                                            "height": out_image.shape[1],
-                                            "width": out_image.shape[2],
-                                            "transform": out_transform})
-                            
-                            raster_arrays.append(out_image)
-                        
-                        if raster_arrays:
-                            out_image = np.logical_or.reduce(raster_arrays).astype(np.uint8)
-                            composite_raster_arrays.append(out_image * (i+1))
-                            out_meta.update(dtype = rasterio.uint8)
-                            
-                            with rasterio.open(output_folder_s / f'{city_name_l}_{flood_type}_{year}_{list(flood_rp_bins.keys())[i]}.tif', 'w', **out_meta) as dst:
-                                dst.write(out_image)
-                    
-                    if composite_raster_arrays:
-                        out_image = np.maximum.reduce(composite_raster_arrays).astype(np.uint8)
-                        out_meta.update(dtype = rasterio.uint8)
-                        
-                        # TODO: only write and do following steps if raster is not empty
-                        with rasterio.open(output_folder_s / f'{city_name_l}_{flood_type}_{year}.tif', 'w', **out_meta) as dst:
-                            dst.write(out_image)
-
-                        with rasterio.open(output_folder_s / f'{city_name_l}_{flood_type}_{year}.tif') as src:
-                            transform, width, height = calculate_default_transform(
-                                src.crs, utm_crs, src.width, src.height, *src.bounds)
-                            kwargs = src.meta.copy()
-                            kwargs.update({
-                                'crs': utm_crs,
-                                'transform': transform,
-                                'width': width,
-                                'height': height
-                            })
-
-                            with rasterio.open(output_folder_s / f'{city_name_l}_{flood_type}_{year}_utm.tif', 'w', **kwargs) as dst:
-                                for i in range(1, src.count + 1):
-                                    reproject(
-                                        source=rasterio.band(src, i),
-                                        destination=rasterio.band(dst, i),
-                                        src_transform=src.transform,
-                                        src_crs=src.crs,
-                                        dst_transform=transform,
-                                        dst_crs=utm_crs,
-                                        resampling=Resampling.nearest)
-                elif year > 2020:
-                    for ssp in flood_ssps:
-                        composite_raster_arrays = []
-                        for i in range(len(flood_rp_bins)):
-                            raster_to_merge = [f'{city_name_l}_{flood_type}_{year}_ssp{ssp}_1in{rp}_con.tif' for rp in flood_rp_bins[list(flood_rp_bins.keys())[i]] if exists(flood_folder / (f'{city_name_l}_{flood_type}_{year}_ssp{ssp}_1in{rp}_con.tif'))]
-                            raster_arrays = []
-
-                            for r in raster_to_merge:
-                                with rasterio.open(flood_folder / r) as src:
-                                    # shapely presumes all operations on two or more features exist in the same Cartesian plane.
-                                    out_image, out_transform = rasterio.mask.mask(
-                                        src, buffer_aoi, all_touched = True, crop = True)
-                                    out_meta = src.meta.copy()
-
-                                out_meta.update({"driver": "GTiff",
-                                                "height": out_image.shape[1],
-                                                "width": out_image.shape[2],
-                                                "transform": out_transform})
-                                
-                                raster_arrays.append(out_image)
-                            
-                            if raster_arrays:
-                                out_image = np.logical_or.reduce(raster_arrays).astype(np.uint8)
-                                composite_raster_arrays.append(out_image * (i+1))
-                                out_meta.update(dtype = rasterio.uint8)
-                                
-                                with rasterio.open(output_folder_s / f'{city_name_l}_{flood_type}_{year}_ssp{ssp}_{list(flood_rp_bins.keys())[i]}.tif', 'w', **out_meta) as dst:
-                                    dst.write(out_image)
-                        
-                        if composite_raster_arrays:
-                            out_image = np.maximum.reduce(composite_raster_arrays).astype(np.uint8)
-                            out_meta.update(dtype = rasterio.uint8)
-                                
-                            with rasterio.open(output_folder_s / f'{city_name_l}_{flood_type}_{year}_ssp{ssp}.tif', 'w', **out_meta) as dst:
-                                dst.write(out_image)
-
-                            with rasterio.open(output_folder_s / f'{city_name_l}_{flood_type}_{year}_ssp{ssp}.tif') as src:
-                                transform, width, height = calculate_default_transform(
-                                    src.crs, utm_crs, src.width, src.height, *src.bounds)
-                                kwargs = src.meta.copy()
-                                kwargs.update({
-                                    'crs': utm_crs,
-                                    'transform': transform,
-                                    'width': width,
-                                    'height': height
-                                })
-
-                                with rasterio.open(output_folder_s / f'{city_name_l}_{flood_type}_{year}_ssp{ssp}_utm.tif', 'w', **kwargs) as dst:
-                                    for i in range(1, src.count + 1):
-                                        reproject(
-                                            source=rasterio.band(src, i),
-                                            destination=rasterio.band(dst, i),
-                                            src_transform=src.transform,
-                                            src_crs=src.crs,
-                                            dst_transform=transform,
-                                            dst_crs=utm_crs,
-                                            resampling=Resampling.nearest)
-        
+        grid = context.analysis_grid
+
+        def flood_processing(flood_type, year, ssp):
+            """Threshold, clip and bin every return period of one flood type, year and SSP (None up to 2020) in one pass:
+            only the buffered AOI window of each mosaic is read, and nothing but the outputs is written."""
+            label = f'{city_name_l}_{flood_type}_{year}' if ssp is None else f'{city_name_l}_{flood_type}_{year}_ssp{ssp}'
+            print(f'process {label}')
+
+            composite = None
+            for i, (rp_bin, bin_rps) in enumerate(flood_rp_bins.items()):
+                flooded = None
+                for rp in bin_rps:
+                    mosaic_file = flood_mosaic(flood_type, year, ssp, rp)
+                    if mosaic_file is None:
+                        continue
+
+                    out_image, out_meta = clip_raster(mosaic_file, buffer_aoi)
+                    rp_flooded = (out_image != out_meta['nodata']) & (out_image >= flood_threshold)
+                    flooded = rp_flooded if flooded is None else flooded | rp_flooded
+
+                if flooded is not None:
+                    out_image = flooded.astype(np.uint8)
+                    composite = out_image * (i+1) if composite is None else np.maximum(composite, out_image * (i+1))
+                    out_meta.update({'driver': 'GTiff', 'dtype': rasterio.uint8, 'nodata': 0})
+
+                    with raster_writer(output_folder_s / f'{label}_{rp_bin}.tif', out_meta, nbits = 1) as dst:
+                        dst.write(out_image)
+
+            if composite is not None:
+                # TODO: only write and do following steps if raster is not empty
+                # bin masks take one bit per pixel and composites the bits of the highest bin number
+                with raster_writer(output_folder_s / f'{label}.tif', out_meta, nbits = len(flood_rp_bins).bit_length()) as dst:
+                    dst.write(composite)
+
+                # warp onto the city's analysis grid, which covers the buffered AOI
+                utm_image, nodata = grid.warp(output_folder_s / f'{label}.tif')
+                with raster_writer(output_folder_s / f'{label}_utm.tif', grid.meta(rasterio.uint8, nodata), nbits = len(flood_rp_bins).bit_length()) as dst:
+                    dst.write(utm_image)
+
+        # every flood type, year and SSP is independent; rasterio and numpy release the GIL, so threads run them concurrently
+        combinations = []
         for ft in ['coastal', 'fluvial', 'pluvial']:
             if menu[f'flood_{ft}']:
-                flood_processing1(ft)
+                for year in flood_years:
+                    if year <= 2020:
+                        combinations.append((ft, year, None))
+                    else:
+                        combinations += [(ft, year, ssp) for ssp in flood_ssps]
+
+        # at least one worker, as ThreadPoolExecutor requires, even when no flood year or type is selected
+        with ThreadPoolExecutor(max_workers = max(1, min(len(combinations), os.cpu_count() or 1))) as executor:
+            for c, future in zip(combinations, [executor.submit(flood_processing, *c) for c in combinations]):
+                try:
+                    future.result()
+                except Exception as e:
+                    err_msg = f'process {c[0]} flood {c[1]}{"" if c[2] is None else f" ssp{c[2]}"} failed: {e!r}'
+                    print(err_msg)
+                    failed.append(err_msg)
 
     # other raster files
     # these are simple raster clipping from a global raster
@@ -866,8 +383,8 @@ if menu['raster_processing']:
             if (f'{r}_source' in global_inputs) and bool(global_inputs[f'{r}_source']):
                 try:
                     clipdata(f"mnt/source-data/{global_inputs[f'{r}_source']}", r)
-                except:
-                    failed.append(f'process {r} failed')
+                except Exception as e:
+                    failed.append(f'process {r} failed: {e!r}')
             else:
                 print(f'data source for {r} does not exist in city or global inputs yaml')
 
@@ -875,4 +392,8 @@ if menu['raster_processing']:
     # PRINT FAILED PROCESSES ############################
     print('failed processes:')
     print(failed)
-    
\ No newline at end of file
+    return failed
+
+
+if __name__ == '__main__':
+    run(RunContext())
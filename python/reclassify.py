@@ -0,0 +1,56 @@
+# Lookup-table reclassification of integer rasters.
+# Tables come from the reclassify section of global_inputs.yml and map each output class to the input
+# values that belong to it; a value is either a single number or a [first, last] range, both ends included.
+# Input values not listed in any class get the table's default. A table is turned into one lookup array
+# indexed by input value, so every pixel is remapped with a single fancy-indexing operation, a block of
+# rows at a time.
+
+import numpy as np
+
+
+def build_lut(table, dtype = np.float32):
+    """Return (lut, first value, default) for a reclassify table. Where classes overlap, the first listed wins."""
+    default = table.get('default', 0)
+    values = {}
+    for out_val, in_vals in table['classes'].items():
+        for v in in_vals:
+            for x in (range(v[0], v[1] + 1) if isinstance(v, list) else [v]):
+                values.setdefault(x, out_val)
+
+    first = min(values)
+    lut = np.full(max(values) - first + 1, default, dtype = dtype)
+    for x, out_val in values.items():
+        lut[x - first] = out_val
+    return lut, first, default
+
+
+def reclassify(array, table, dtype = np.float32, block_rows = 1024):
+    """Reclassify an integer array with a reclassify table and return a new array of dtype."""
+    if not np.issubdtype(array.dtype, np.integer):
+        raise TypeError(f'only integer rasters can be reclassified, not {array.dtype}')
+
+    lut, first, default = build_lut(table, dtype)
+    out = np.empty(array.shape, dtype = dtype)
+    rows = array.shape[-2]
+    for row in range(0, rows, block_rows):
+        block = array[..., row:row + block_rows, :].astype(np.int64) - first
+        inside = (block >= 0) & (block < len(lut))
+        out[..., row:row + block_rows, :] = np.where(inside, lut[np.clip(block, 0, len(lut) - 1)], default)
+    return out
+
+
+def reclassify_raster(input_raster, output_raster, table, dtype = None, block_rows = 1024, **meta_updates):
+    """Reclassify a raster file into output_raster, one block of rows at a time.
+    dtype defaults to the input's; meta_updates (e.g. nodata = 0) are applied to the output metadata."""
+    import rasterio
+    from rasterio.windows import Window
+    from raster_io import raster_writer
+
+    with rasterio.open(input_raster) as src:
+        out_meta = src.meta.copy()
+        out_meta.update({'driver': 'GTiff', 'dtype': dtype or src.dtypes[0], **meta_updates})
+
+        with raster_writer(output_raster, out_meta) as dst:
+            for row in range(0, src.height, block_rows):
+                window = Window(0, row, src.width, min(block_rows, src.height - row))
+                dst.write(reclassify(src.read(window = window), table, out_meta['dtype']), window = window)
@@ -1,11 +1,13 @@
-# DETERMINE WHETHER TO RUN THIS SCRIPT ##############
-import yaml
+from context import RunContext
 
-# load menu
-with open("mnt/01-user-input/menu.yml", 'r') as f:
-    menu = yaml.safe_load(f)
 
-if menu['road_network']:
+def run(context):
+    # DETERMINE WHETHER TO RUN THIS SCRIPT ##############
+    menu = context.menu
+
+    if not menu['road_network']:
+        return
+
     print('run road_network')
     
     import osmnx as ox
@@ -21,29 +23,20 @@ if menu['road_network']:
 
 
     # SET UP #########################################
-    # load city inputs files, to be updated for each city scan
-    with open("mnt/01-user-input/city_inputs.yml", 'r') as f:
-        city_inputs = yaml.safe_load(f)
+    city_inputs = context.city_inputs
 
     AOI_name = city_inputs['city_name']
-    city_name_l = city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
-
-    # load global inputs, such as data sources that generally remain the same across scans
-    with open("python/global_inputs.yml", 'r') as f:
-        global_inputs = yaml.safe_load(f)
+    city_name_l = context.city_name_l
+    global_inputs = context.global_inputs
 
     # Read AOI shapefile --------
-    # transform the input gpkg to correct prj (epsg 4326)
-    aoi_file = gpd.read_file(f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{city_name_l}.shp').to_crs(epsg = 4326)
+    aoi_file = context.aoi
     features = aoi_file.geometry
 
     # Define output folder ---------
-    output_folder_parent = Path(f'mnt/city-directories/{city_name_l}/02-process-output')
-    output_folder_s = output_folder_parent / 'spatial'
-    output_folder_t = output_folder_parent / 'tabular'
-    output_folder_i = output_folder_parent / 'images'
-    os.makedirs(output_folder_s, exist_ok=True)
-    os.makedirs(output_folder_t, exist_ok=True)
+    output_folder_s = context.output_folder_s
+    output_folder_t = context.output_folder_t
+    output_folder_i = context.output_folder_parent / 'images'
     os.makedirs(output_folder_i, exist_ok=True)
     
 
@@ -233,3 +226,7 @@ if menu['road_network']:
 
     # RUN ############################################
     main(centrality_type = "edge")
+
+
+if __name__ == '__main__':
+    run(RunContext())
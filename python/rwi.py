@@ -1,42 +1,33 @@
-# DETERMINE WHETHER TO RUN THIS SCRIPT ##############
-import yaml
+from context import RunContext
 
-# load menu
-with open("mnt/01-user-input/menu.yml", 'r') as f:
-    menu = yaml.safe_load(f)
 
-if menu['rwi']:
+def run(context):
+    # DETERMINE WHETHER TO RUN THIS SCRIPT ##############
+    menu = context.menu
+
+    if not menu['rwi']:
+        return
+
     print('run rwi')
     
     import os
     import pandas as pd
     import geopandas as gpd
-    from pyquadkey2.quadkey import QuadKey
-    from pyquadkey2.quadkey import TileAnchor, QuadKey
-    from shapely.geometry import Polygon
+    from quadkeys import tile_xy, in_bounds, tile_polygons
     from pathlib import Path
     from os.path import exists
 
     # SET UP #########################################
-    # load city inputs files, to be updated for each city scan
-    with open("mnt/01-user-input/city_inputs.yml", 'r') as f:
-        city_inputs = yaml.safe_load(f)
-
-    city_name_l = city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
-
-    # load global inputs, such as data sources that generally remain the same across scans
-    with open("python/global_inputs.yml", 'r') as f:
-        global_inputs = yaml.safe_load(f)
+    city_inputs = context.city_inputs
+    city_name_l = context.city_name_l
+    global_inputs = context.global_inputs
 
     # Read AOI shapefile --------
-    # transform the input shp to correct prj (epsg 4326)
-    aoi_file = gpd.read_file(f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{city_name_l}.shp').to_crs(epsg = 4326)
+    aoi_file = context.aoi
     features = aoi_file.geometry
 
     # Define output folder ---------
-    output_folder_parent = Path(f'mnt/city-directories/{city_name_l}/02-process-output')
-    output_folder = output_folder_parent / 'spatial'
-    os.makedirs(output_folder, exist_ok=True)
+    output_folder = context.output_folder_s
 
     # PROCESS RWI DATA ################################
     rwi_data = f"mnt/source-data/{global_inputs['rwi_source']}/{city_inputs['country_iso3']}_relative_wealth_index.csv"
@@ -44,58 +35,31 @@ if menu['rwi']:
     if exists(rwi_data):
         if not exists(output_folder / f"{city_name_l}_rwi.gpkg"):
             FB_QKdata = pd.read_csv(rwi_data)
-            # change quadkey format to str
-            FB_QKdata["quadkey1"] = FB_QKdata["quadkey"].astype('str')
-            # fill 13 digit quadkeys with 0 before the QK
-            FB_QKdata['quadkey1'] = FB_QKdata['quadkey1'].apply(lambda x: x.zfill(14))
-            # take column with quadkeys and transform it to list and then to QuadKey object
-            fb_qk = FB_QKdata["quadkey1"].tolist()
-            FB_QK = [QuadKey(i) for i in fb_qk]
-
-            # locate the four corners of QuadKey tiles
-            SW = []
-            NE = []
-            SE = []
-            NW = []
-
-            for i in FB_QK:
-                #south west point
-                sw = i.to_geo(anchor=TileAnchor.ANCHOR_SW)
-                SW.append(sw) 
-                #north west point
-                ne = i.to_geo(anchor=TileAnchor.ANCHOR_NE)
-                NE.append(ne) 
-                #south east point 
-                se = i.to_geo(anchor=TileAnchor.ANCHOR_SE)
-                SE.append(se)
-                #north west point 
-                nw = i.to_geo(anchor=TileAnchor.ANCHOR_NW)
-                NW.append(nw)
-            
-            # flip lat and lon for tile corner coordinates
-            swFinal = [(i[1], i[0]) for i in SW]
-            neFinal = [(i[1], i[0]) for i in NE]
-            seFinal = [(i[1], i[0]) for i in SE]
-            nwFinal = [(i[1], i[0]) for i in NW]
-
-            # generate Polygon object based on four corner coordinates
-            tiledata = [Polygon([nw, sw, se, ne]) for sw, ne, se, nw in zip(swFinal, neFinal, seFinal, nwFinal)]
-
-            # create GeoDataFrame with Polygons
-            gdf = gpd.GeoDataFrame(geometry = tiledata, crs = "epsg:4326")
+            # change quadkey format to str, filling 13 digit quadkeys with 0 before the QK
+            FB_QKdata["quadkey1"] = FB_QKdata["quadkey"].astype('str').str.zfill(14)
 
-            # add QuadKeys to gdf
-            gdf['quadkey'] = FB_QK
+            # decode the level-14 quadkeys to tile indices and keep the tiles around the AOI,
+            # before any geometry is built
+            tile_x, tile_y = tile_xy(FB_QKdata["quadkey"].astype('int64').to_numpy())
+            near_aoi = in_bounds(tile_x, tile_y, aoi_file.total_bounds)
+            FB_QKdata = FB_QKdata[near_aoi]
 
-            # change type of quadkey column to str
-            gdf["quadkey"] = gdf["quadkey"].astype('str')
+            # generate Polygon objects from the four tile corners
+            gdf = gpd.GeoDataFrame(geometry = tile_polygons(tile_x[near_aoi], tile_y[near_aoi]), crs = "epsg:4326")
+
+            # add QuadKeys to gdf
+            gdf['quadkey'] = FB_QKdata["quadkey1"].to_numpy()
 
             # merge gdf and fb data
             gdf = gdf.merge(FB_QKdata, left_on = 'quadkey', right_on = 'quadkey1', how = 'inner')
 
-            # export to shapefile
-            gdf_aoi = gpd.clip(gdf, aoi_file)
+            # export to shapefile, in the order of the CSV
+            gdf_aoi = gpd.clip(gdf, aoi_file).sort_index()
 
             gdf_aoi.set_crs(crs = 'epsg:4326').to_file(output_folder / f"{city_name_l}_rwi.gpkg")
     else:
         print(f'No RWI data for {city_inputs["country_iso3"]}')
+
+
+if __name__ == '__main__':
+    run(RunContext())
@@ -0,0 +1,170 @@
+# Dependency-aware scheduler for the data processing steps.
+# Steps that do not read each other's outputs run at the same time in a process pool;
+# a step only starts once every step it depends on has finished successfully.
+
+import time
+import importlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from context import RunContext
+from manifest import StepManifest
+
+
+# STEP DEPENDENCIES ##################################
+# keys are the scripts in python/, values are the scripts whose outputs they read
+# steps missing from this dict are assumed to be independent
+STEP_DEPENDENCIES = {
+    'burned_area.py': [],
+    'cyclone.py': [],
+    'fwi.py': [],
+    'gee_forest.py': [],
+    'gee_landcover.py': [],
+    'gee_lst_winter.py': [],
+    'gee_lst.py': [],
+    'gee_ndmi.py': [],
+    'gee_ndvi.py': [],
+    'gee_nightlight.py': [],
+    'landcover_burnability.py': [],
+    'osm_poi.py': [],
+    'raster_processing.py': [],
+    'road_network.py': [],
+    'rwi.py': [],
+    'soil_salinity.py': [],
+    'erosion.py': [],
+    'water_salinity.py': [],
+    # elevation clip
+    'contour_elev_stats.py': ['raster_processing.py'],
+    'slope.py': ['raster_processing.py'],
+    # wsf and flood clips
+    'flood_stats.py': ['raster_processing.py'],
+}
+
+
+# RUN STEPS ##########################################
+# one context per city and worker process, so steps that land in the same process share it
+contexts = {}
+
+def get_context(city_inputs = None):
+    if city_inputs not in contexts:
+        contexts[city_inputs] = RunContext(city_inputs)
+    return contexts[city_inputs]
+
+
+def release_contexts(active_cities):
+    """Drop the contexts (and their cached rasters) of cities that have no tasks left."""
+    for c in [c for c in contexts if c not in active_cities]:
+        del contexts[c]
+
+
+def run_step(script, city_inputs = None, dependencies = (), force = False, active_cities = None, last = False):
+    """Run one step from python/ and return its wall time in seconds.
+
+    The step module is imported and its run(context) called with the context for city_inputs
+    (the city_inputs.yml to use; defaults to mnt/01-user-input/city_inputs.yml).
+    The step is skipped if its manifest shows that its inputs have not changed since its last successful run
+    (see manifest.py), unless force is true.
+    Steps that catch their own errors return the list of processes that failed; a step is only recorded as
+    up to date when that list is empty, so a failed download or process is retried on the next run.
+    In a batch, active_cities are the cities that still have tasks: the worker drops the contexts of the
+    others before the step, and the city's own context after its last step (last is true).
+    """
+    start = time.time()
+    if active_cities is not None:
+        release_contexts(active_cities)
+    context = get_context(city_inputs)
+
+    try:
+        manifest = StepManifest(script, context, dependencies)
+        if manifest.enabled:
+            manifest.compute_key()
+            if manifest.is_current() and not force:
+                print(f'{script} is up to date')
+                return time.time() - start
+            manifest.remove_outputs()
+            # until the step has succeeded, it is not up to date, whatever its previous record says
+            manifest.invalidate()
+
+        failed = importlib.import_module(script[:-3]).run(context)
+
+        if manifest.enabled:
+            if failed:
+                print(f'{script} is not recorded as up to date because {len(failed)} of its processes failed')
+            else:
+                manifest.record()
+        return time.time() - start
+    finally:
+        if last:
+            contexts.pop(city_inputs, None)
+
+
+def run_steps(script_list, max_workers = None, city_inputs_list = (None, ), max_cities = None, force = False):
+    """Run the scripts in script_list for every city in city_inputs_list, respecting STEP_DEPENDENCIES.
+
+    Each (city, script) pair is a task. Tasks are submitted to a process pool as soon as the steps they
+    depend on are done for the same city, in the order of city_inputs_list and script_list.
+    A task whose dependency failed is skipped.
+    At most max_cities cities have tasks in flight at once, so that memory use stays bounded
+    when many cities are scanned in one run.
+    Steps whose inputs are unchanged since their last run are skipped unless force is true.
+    Returns a dict of {(city_inputs, script): wall time in seconds} and the list of failed or skipped tasks.
+    """
+    waiting_on = {}
+    for c in city_inputs_list:
+        for s in script_list:
+            waiting_on[(c, s)] = [(c, d) for d in STEP_DEPENDENCIES.get(s, []) if d in script_list]
+    timings = {}
+    failed = []
+    active_cities = []
+
+    # with a single worker, steps run one after another in this process and share one context per city
+    executor_class = ThreadPoolExecutor if max_workers == 1 else ProcessPoolExecutor
+
+    with executor_class(max_workers = max_workers) as executor:
+        running = {}
+
+        while waiting_on or running:
+            # skip tasks that depend on a failed task
+            for t in [t for t in waiting_on if any(d in failed for d in waiting_on[t])]:
+                print(f'skip {t[1]} because a step it depends on failed')
+                failed.append(t)
+                del waiting_on[t]
+
+            # a city is done when none of its tasks are waiting or running
+            remaining = [t[0] for t in waiting_on] + [t[0] for t in running.values()]
+            active_cities = [c for c in active_cities if c in remaining]
+
+            # submit every task whose dependencies are done
+            for t in [t for t in waiting_on if not waiting_on[t]]:
+                if t[0] not in active_cities:
+                    if max_cities is not None and len(active_cities) >= max_cities:
+                        continue
+                    active_cities.append(t[0])
+                dependencies = [d for d in STEP_DEPENDENCIES.get(t[1], []) if d in script_list]
+                del waiting_on[t]
+                last = not any(w[0] == t[0] for w in waiting_on)
+                running[executor.submit(run_step, t[1], t[0], dependencies, force, list(active_cities), last)] = t
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in done:
+                t = running.pop(future)
+                try:
+                    timings[t] = future.result()
+                    for deps in waiting_on.values():
+                        if t in deps:
+                            deps.remove(t)
+                except Exception as e:
+                    # steps raise MissingInputError when an input they need does not exist
+                    print(f'{t[1]} failed: {e!r}')
+                    failed.append(t)
+
+    return timings, failed
+
+
+def print_timings(timings, failed):
+    print('step wall times (s):')
+    for (c, s), t in sorted(timings.items(), key = lambda x: x[1], reverse = True):
+        print(f'  {s:<28}{t:>10.1f}  {c or ""}')
+    print('failed steps:')
+    print([s if c is None else f'{c}: {s}' for c, s in failed])
@@ -1,11 +1,13 @@
-# DETERMINE WHETHER TO RUN THIS SCRIPT ##############
-import yaml
+from context import RunContext
 
-# load menu
-with open("mnt/01-user-input/menu.yml", 'r') as f:
-    menu = yaml.safe_load(f)
 
-if menu['soil_salinity']:
+def run(context):
+    # DETERMINE WHETHER TO RUN THIS SCRIPT ##############
+    menu = context.menu
+
+    if not menu['soil_salinity']:
+        return
+
     print('run soil salinity')
 
     import os
@@ -15,31 +17,22 @@ if menu['soil_salinity']:
     from os.path import exists
     import rasterio
     import rasterio.mask
-    import numpy as np
     from rasterio.merge import merge
+    from zonal import zonal_mean
+    from raster_io import raster_writer
 
     # SET UP #########################################
-    # load city inputs files, to be updated for each city scan
-    with open("mnt/01-user-input/city_inputs.yml", 'r') as f:
-        city_inputs = yaml.safe_load(f)
-
-    city_name_l = city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
-
-    # load global inputs, such as data sources that generally remain the same across scans
-    with open("python/global_inputs.yml", 'r') as f:
-        global_inputs = yaml.safe_load(f)
+    city_inputs = context.city_inputs
+    city_name_l = context.city_name_l
+    global_inputs = context.global_inputs
 
     # Read AOI shapefile --------
-    # transform the input shp to correct prj (epsg 4326)
-    aoi_file = gpd.read_file(f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{city_name_l}.shp').to_crs(epsg = 4326)
+    aoi_file = context.aoi
     features = aoi_file.geometry
 
     # Define output folder ---------
-    output_folder_parent = Path(f'mnt/city-directories/{city_name_l}/02-process-output')
-    output_folder_s = output_folder_parent / 'spatial'
-    output_folder_t = output_folder_parent / 'tabular'
-    os.makedirs(output_folder_s, exist_ok=True)
-    os.makedirs(output_folder_t, exist_ok=True)
+    output_folder_s = context.output_folder_s
+    output_folder_t = context.output_folder_t
 
 
     # PROCESS DATA ##################################
@@ -64,7 +57,7 @@ if menu['soil_salinity']:
                                     "width": out_image.shape[2],
                                     "transform": out_transform})
 
-                    with rasterio.open(output_folder_s / f'{city_name_l}_soil_salinity_{year}_{i}.tif', "w", **out_meta) as dest:
+                    with raster_writer(output_folder_s / f'{city_name_l}_soil_salinity_{year}_{i}.tif', out_meta) as dest:
                         dest.write(out_image)
                     
                     i += 1
@@ -95,7 +88,7 @@ if menu['soil_salinity']:
                 'count': mosaic.shape[0]  # This is typically 1 for single-band rasters
             })
 
-            with rasterio.open(output_folder_s / f'{city_name_l}_soil_salinity_{year}.tif', 'w', **out_meta) as dest:
+            with raster_writer(output_folder_s / f'{city_name_l}_soil_salinity_{year}.tif', out_meta) as dest:
                 dest.write(mosaic)
 
             # Close all open raster files
@@ -105,9 +98,13 @@ if menu['soil_salinity']:
         with rasterio.open(output_folder_s / f'{city_name_l}_soil_salinity_{year}.tif') as src:
             temp_array = src.read(1)
             # temp_array = temp_array[temp_array != 0]
-            avg_dict[year] = np.nanmean(temp_array)
+            avg_dict[year] = zonal_mean(temp_array)
     
     with open(f'{output_folder_t}/{city_name_l}_soil_salinity.csv', 'w') as f:
         f.write('year,avg\n')
         for year in avg_dict:
-            f.write("%s,%s\n"%(year, avg_dict[year]))
\ No newline at end of file
+            f.write("%s,%s\n"%(year, avg_dict[year]))
+
+
+if __name__ == '__main__':
+    run(RunContext())
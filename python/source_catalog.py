@@ -0,0 +1,144 @@
+# Catalog of the global datasets in mnt/source-data.
+# python/data/catalog/catalog.json records, for every dataset a step reads, its extent, CRS and layout:
+# the block size of a raster, which says whether a window read touches only the AOI or whole rows of
+# the globe, and for vector data whether it has a spatial index. Vector files without one (shapefiles
+# without .qix, CSV, GeoJSON, ...) are converted once into an indexed GeoPackage in the catalog folder.
+# Steps fetch AOI features with read_features and AOI windows with clip, so what a city reads depends
+# on the size of the city, not of the global file. Entries are refreshed when a dataset's size or
+# modification time changes.
+
+import os
+import json
+from pathlib import Path
+
+
+catalog_folder = Path('python/data/catalog')
+
+
+class SourceCatalog:
+    def __init__(self, folder = catalog_folder):
+        self.folder = Path(folder)
+        self.catalog_file = self.folder / 'catalog.json'
+        self.datasets = self.load()
+
+    def load(self):
+        try:
+            with open(self.catalog_file, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save(self):
+        """Write the catalog, merged with entries that other processes wrote since it was loaded."""
+        self.datasets = {**self.load(), **self.datasets}
+        os.makedirs(self.folder, exist_ok = True)
+        tmp_file = f'{self.catalog_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.datasets, f, indent = 1)
+        os.replace(tmp_file, self.catalog_file)
+
+    # DESCRIBE #######################################
+    def entry(self, path):
+        """Catalog entry of a dataset, described (and indexed, for vector data) the first time it is used."""
+        path = Path(path).as_posix()
+        stat = os.stat(path)
+        entry = self.datasets.get(path)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+            entry = self.describe_raster(path) if is_raster(path) else self.describe_vector(path)
+            entry.update({'size': stat.st_size, 'mtime': stat.st_mtime_ns})
+            self.datasets[path] = entry
+            self.save()
+        return entry
+
+    def describe_raster(self, path):
+        import rasterio
+
+        with rasterio.open(path) as src:
+            block_rows, block_cols = src.block_shapes[0]
+            return {'kind': 'raster',
+                    'crs': src.crs.to_wkt() if src.crs else None,
+                    'bounds': list(src.bounds),
+                    'shape': [src.height, src.width],
+                    'block_shape': [block_rows, block_cols],
+                    'tiled': block_cols < src.width,
+                    'overviews': len(src.overviews(1))}
+
+    def describe_vector(self, path):
+        import pyogrio
+
+        info = pyogrio.read_info(path)
+        entry = {'kind': 'vector',
+                 'crs': info['crs'],
+                 'bounds': list(info['total_bounds']),
+                 'features': int(info['features']),
+                 'driver': info['driver'],
+                 'index': path}
+        if not info['capabilities']['fast_spatial_filter']:
+            entry['index'] = self.build_index(path).as_posix()
+        return entry
+
+    def build_index(self, path, chunk_size = 100000):
+        """Copy a vector dataset into a GeoPackage, which carries an R-tree index, chunk_size features at a time."""
+        import pyogrio
+
+        index_file = self.folder / f"{Path(path).as_posix().replace('/', '__')}.gpkg"
+        print(f'index {path}')
+        os.makedirs(self.folder, exist_ok = True)
+        tmp_file = index_file.with_suffix(f'.{os.getpid()}.tmp.gpkg')
+        if tmp_file.exists():
+            os.remove(tmp_file)
+
+        n_features = pyogrio.read_info(path)['features']
+        for skip in range(0, max(n_features, 1), chunk_size):
+            chunk = pyogrio.read_dataframe(path, skip_features = skip, max_features = chunk_size)
+            pyogrio.write_dataframe(chunk, tmp_file, layer = 'features', driver = 'GPKG', append = tmp_file.exists())
+
+        os.replace(tmp_file, index_file)
+        return index_file
+
+    # AOI ############################################
+    def aoi_bounds(self, entry, features):
+        """Bounds of features (a GeoSeries) in the CRS of a catalog entry."""
+        if entry['crs'] and features.crs and not features.crs.equals(entry['crs']):
+            features = features.to_crs(entry['crs'])
+        return features, features.total_bounds
+
+    def overlaps(self, path, features):
+        entry = self.entry(path)
+        _, (xmin, ymin, xmax, ymax) = self.aoi_bounds(entry, features)
+        bxmin, bymin, bxmax, bymax = entry['bounds']
+        return xmin <= bxmax and xmax >= bxmin and ymin <= bymax and ymax >= bymin
+
+    def read_features(self, path, features):
+        """Features of a vector dataset that intersect features (a GeoSeries), in file order.
+        Only the rows within the bbox of features are read from the indexed file."""
+        import geopandas as gpd
+
+        entry = self.entry(path)
+        features, bounds = self.aoi_bounds(entry, features)
+        gdf = gpd.read_file(entry['index'], bbox = tuple(bounds), fid_as_index = True).sort_index().rename_axis(None)
+        return gdf[gdf.intersects(features.union_all())]
+
+    def clip(self, path, features, all_touched = True):
+        """Clip a raster to features (a GeoSeries), reading only the window that covers them.
+        Returns (image, meta) like mosaic.clip_raster, or None if the raster does not overlap the features."""
+        from mosaic import clip_raster
+
+        if not self.overlaps(path, features):
+            return None
+        features, _ = self.aoi_bounds(self.entry(path), features)
+        return clip_raster(path, features, all_touched = all_touched)
+
+
+def is_raster(path):
+    return Path(path).suffix.lower() in ['.tif', '.tiff', '.vrt', '.img', '.nc', '.asc']
+
+
+# one catalog per process
+catalog = None
+
+def source_catalog():
+    global catalog
+    if catalog is None:
+        catalog = SourceCatalog()
+    return catalog
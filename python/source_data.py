@@ -0,0 +1,327 @@
+# Shared source data in python/data: WorldPop country rasters, WSF evolution tiles,
+# FABDEM elevation tiles and WorldPop demographics.
+# These files do not depend on the city, so they are downloaded once and reused by every scan.
+# raster_processing.py calls these functions for a single city; the batch mode in 01-main.py
+# plans the union of what all cities need and prepares it once before the cities run.
+
+import os
+import math
+import yaml
+import geopandas as gpd
+from pathlib import Path
+from os.path import exists
+from mosaic import build_vrt
+from download import Downloader, DownloadError
+from data_cache import SourceCache
+
+
+data_folder = Path('python/data')
+
+
+# TILES ##############################################
+def tile_finder(aoi_bounds, direction, tile_size = 1):
+    coord_list = []
+
+    if direction == 'lat':
+        hemi_options = ['N', 'S']
+        coord_min = aoi_bounds.miny
+        coord_max = aoi_bounds.maxy
+        zfill_digits = 2
+    elif direction == 'lon':
+        hemi_options = ['E', 'W']
+        coord_min = aoi_bounds.minx
+        coord_max = aoi_bounds.maxx
+        zfill_digits = 3
+    else:
+        print('tile_finder function error')
+        print('Invalid direction. How did this happen?')
+
+    for i in range(len(aoi_bounds)):
+        if math.floor(coord_min[i]) >= 0:
+            hemi = hemi_options[0]
+            for y in range(math.floor(coord_min[i] / tile_size) * tile_size,
+                            math.ceil(coord_max[i] / tile_size) * tile_size,
+                            tile_size):
+                coord_list.append(f'{hemi}{str(y).zfill(zfill_digits)}')
+        elif math.ceil(coord_max[i]) >= 0:
+            for y in range(0,
+                            math.ceil(coord_max[i] / tile_size) * tile_size,
+                            tile_size):
+                coord_list.append(f'{hemi_options[0]}{str(y).zfill(zfill_digits)}')
+            for y in range(math.floor(coord_min[i] / tile_size) * tile_size,
+                            0,
+                            tile_size):
+                coord_list.append(f'{hemi_options[1]}{str(-y).zfill(zfill_digits)}')
+        else:
+            hemi = hemi_options[1]
+            for y in range(math.floor(coord_min[i] / tile_size) * tile_size,
+                            math.ceil(coord_max[i] / tile_size) * tile_size,
+                            tile_size):
+                coord_list.append(f'{hemi}{str(-y).zfill(zfill_digits)}')
+
+    return coord_list
+
+def wsf_tile_names(aoi_bounds):
+    tiles = []
+    for i in range(len(aoi_bounds)):
+        for x in range(math.floor(aoi_bounds.minx[i] - aoi_bounds.minx[i] % 2), math.ceil(aoi_bounds.maxx[i]), 2):
+            for y in range(math.floor(aoi_bounds.miny[i] - aoi_bounds.miny[i] % 2), math.ceil(aoi_bounds.maxy[i]), 2):
+                file_name = f'WSFevolution_v1_{x}_{y}'
+                if file_name not in tiles:
+                    tiles.append(file_name)
+    return tiles
+
+def fabdem_tile_names(aoi_bounds):
+    """Return a dict of {10x10 degree zip file: [1x1 degree tif files that may be inside it]}."""
+    def tile_end_matcher(tile_starter):
+        if tile_starter == 'S10':
+            return 'N00'
+        elif tile_starter == 'W010':
+            return 'E000'
+        elif tile_starter[0] == 'N' or tile_starter[0] == 'E':
+            return f'{tile_starter[0]}{str(int(tile_starter[1:]) + 10).zfill(len(tile_starter) - 1)}'
+        elif tile_starter[0] == 'S' or tile_starter[0] == 'W':
+            return f'{tile_starter[0]}{str(int(tile_starter[1:]) - 10).zfill(len(tile_starter) - 1)}'
+        else:
+            print('tile_end_matcher function error')
+            print('Invalid input. How did this happen?')
+
+    small_tiles = [f'{lat1}{lon1}_FABDEM_V1-2.tif' for lat1 in tile_finder(aoi_bounds, 'lat', 1) for lon1 in tile_finder(aoi_bounds, 'lon', 1)]
+
+    tiles = {}
+    for lat in tile_finder(aoi_bounds, 'lat', 10):
+        for lon in tile_finder(aoi_bounds, 'lon', 10):
+            tiles[f'{lat}{lon}-{tile_end_matcher(lat)}{tile_end_matcher(lon)}_FABDEM_V1-2.zip'] = small_tiles
+    return tiles
+
+
+# CACHE ##############################################
+# python/data is a size-bounded cache; see data_cache.py and data_cache_gb in global_inputs.yml
+cache = None
+
+def source_cache():
+    global cache
+    if cache is None:
+        with open("python/global_inputs.yml", 'r') as f:
+            cache = SourceCache(data_folder, yaml.safe_load(f).get('data_cache_gb'))
+    return cache
+
+
+# DOWNLOADS ##########################################
+# base URLs of the download sources; point them at a local server to test without network access
+WORLDPOP_API = 'https://hub.worldpop.org/rest/data'
+WSF_URL = 'https://download.geoservice.dlr.de/WSF_EVO/files'
+FABDEM_URL = 'https://data.bris.ac.uk/datasets/s5hqmjcdj8yo2ibzi9b4ew3sn'
+
+# one pooled session for every download in the process
+downloader = Downloader()
+
+def country_pop_file(country_name):
+    """Population raster of a country; a VRT for the few countries that WorldPop splits into several files."""
+    pop_file = data_folder / 'pop' / f"{country_name.replace(' ', '_').lower()}_pop.tif"
+    if exists(pop_file.with_suffix('.vrt')):
+        return pop_file.with_suffix('.vrt')
+    return pop_file
+
+def download_worldpop(country_iso3, country_name, failed):
+    pop_folder = data_folder / 'pop'
+    os.makedirs(pop_folder, exist_ok=True)
+    cache = source_cache()
+    key = f'worldpop/{country_iso3}'
+
+    # check if the country's population raster has already been downloaded
+    # download if the file does not already exist
+    mosaic_file = country_pop_file(country_name)
+    if exists(mosaic_file):
+        for p in cache.dataset_files(key) or [mosaic_file]:
+            cache.touch(p, key)
+        cache.save()
+        return
+
+    # default population data source: WorldPop
+    # use WorldPop API to query data URL; the response is kept in the cache index
+    try:
+        wp_file_json = cache.query(f"{WORLDPOP_API}/pop/cic2020_100m?iso3={country_iso3}", downloader.get_json)
+    except DownloadError as e:
+        err_msg = f'WorldPop query failed: {e}'
+        print(err_msg)
+        failed.append(err_msg)
+        return
+    wp_file_list = wp_file_json['data'][0]['files']
+
+    if len(wp_file_list) > 1:
+        # if more than one raster file is listed (uncommon), download each file and then mosaic them virtually
+        wp_file_names = [f.split('/')[-1] for f in wp_file_list]
+        results = downloader.download_all([(f, pop_folder / n) for f, n in zip(wp_file_list, wp_file_names)])
+        for f, n in zip(wp_file_list, wp_file_names):
+            cache.touch(pop_folder / n, key, f)
+        errors = [e for e in results.values() if e is not None]
+        if errors:
+            err_msg = f'WorldPop download failed: {errors[0]}'
+            print(err_msg)
+            failed.append(err_msg)
+        else:
+            build_vrt([pop_folder / p for p in wp_file_names if p.endswith('.tif')], mosaic_file.with_suffix('.vrt'))
+            cache.touch(mosaic_file.with_suffix('.vrt'), key)
+    elif len(wp_file_list) == 1:
+        try:
+            downloader.download(wp_file_list[0], mosaic_file)
+            cache.touch(mosaic_file, key, wp_file_list[0])
+        except DownloadError as e:
+            err_msg = f'WorldPop download failed: {e}'
+            print(err_msg)
+            failed.append(err_msg)
+    else:
+        err_msg = 'No WorldPop file available'
+        print(err_msg)
+        print('Use a different WorldPop dataset or another population data source')
+        failed.append(err_msg)
+    cache.save()
+
+def download_wsf(tile_names):
+    """Download the WSF evolution tiles that are not in python/data/wsf yet and return the ones available."""
+    wsf_folder = data_folder / 'wsf'
+    os.makedirs(wsf_folder, exist_ok=True)
+    cache = source_cache()
+
+    results = downloader.download_all([(f'{WSF_URL}/{file_name}/{file_name}.tif', wsf_folder / f'{file_name}.tif') for file_name in tile_names])
+
+    wsf_downloaded_files = []
+    for file_name in tile_names:
+        e = results[str(wsf_folder / f'{file_name}.tif')]
+        if e is None:
+            wsf_downloaded_files.append(file_name)
+            cache.touch(wsf_folder / f'{file_name}.tif', f'wsf/{file_name}', f'{WSF_URL}/{file_name}/{file_name}.tif')
+        else:
+            print(f'WSF download exception: {e}')
+    cache.save()
+
+    return wsf_downloaded_files
+
+def download_fabdem(tiles):
+    """Download the FABDEM zips in tiles (see fabdem_tile_names) and extract the 1x1 degree tiles.
+    Returns the tif files available in python/data/elev."""
+    import shutil
+    import zipfile
+
+    elev_folder = data_folder / 'elev'
+    os.makedirs(elev_folder, exist_ok=True)
+    cache = source_cache()
+
+    # a zip is only needed while some of its tiles have not been extracted;
+    # the cache index remembers which tiles each zip holds, so an evicted zip is not downloaded again for nothing
+    jobs = []
+    for file_name in tiles:
+        members = (cache.entry(elev_folder / file_name) or {}).get('members', tiles[file_name])
+        if not all(exists(elev_folder / t) for t in tiles[file_name] if t in members):
+            if not exists(elev_folder / file_name):
+                print(f'download elevation file: {file_name}')
+            jobs.append((f'{FABDEM_URL}/{file_name}', elev_folder / file_name))
+    results = downloader.download_all(jobs)
+
+    elev_downloaded_files = []
+    for file_name in tiles:
+        if results.get(str(elev_folder / file_name)) is not None:
+            print(f'elevation download exception: {results[str(elev_folder / file_name)]}')
+
+        # unzip downloads
+        members = (cache.entry(elev_folder / file_name) or {}).get('members', [])
+        if exists(elev_folder / file_name):
+            try:
+                with zipfile.ZipFile(elev_folder / file_name, 'r') as z:
+                    members = z.namelist()
+                    for file_name1 in tiles[file_name]:
+                        if file_name1 in members and not exists(elev_folder / file_name1):
+                            # extract next to the final name and rename, so an interrupted extraction is not mistaken for a tile
+                            with z.open(file_name1) as src, open(elev_folder / f'{file_name1}.part', 'wb') as dst:
+                                shutil.copyfileobj(src, dst)
+                            os.replace(elev_folder / f'{file_name1}.part', elev_folder / file_name1)
+                cache.touch(elev_folder / file_name, f'fabdem/{file_name}', f'{FABDEM_URL}/{file_name}', members = members)
+            except zipfile.BadZipFile as e:
+                print(f'elevation file {file_name} could not be unzipped: {e}')
+
+        # tiles extracted by an earlier scan are reused as well
+        for file_name1 in tiles[file_name]:
+            if exists(elev_folder / file_name1):
+                cache.touch(elev_folder / file_name1, f'fabdem/{file_name1}', f'{FABDEM_URL}/{file_name}' if file_name1 in members else None)
+                if file_name1 not in elev_downloaded_files:
+                    elev_downloaded_files.append(file_name1)
+    cache.save()
+
+    return elev_downloaded_files
+
+def download_demographics(country_iso3, failed):
+    demo_folder = data_folder / 'demographics'
+    os.makedirs(demo_folder, exist_ok=True)
+    cache = source_cache()
+
+    try:
+        demo_file_json = cache.query(f"{WORLDPOP_API}/age_structures/ascic_2020?iso3={country_iso3}", downloader.get_json)
+    except DownloadError as e:
+        err_msg = f'WorldPop demographics query failed: {e}'
+        print(err_msg)
+        failed.append(err_msg)
+        return
+    demo_file_list = demo_file_json['data'][0]['files']
+
+    results = downloader.download_all([(f, demo_folder / f.split('/')[-1]) for f in demo_file_list])
+    for f in demo_file_list:
+        cache.touch(demo_folder / f.split('/')[-1], f'demographics/{country_iso3}', f)
+    cache.save()
+    if any(e is not None for e in results.values()):
+        err_msg = 'No demographics files available'
+        print(err_msg)
+        failed.append(err_msg)
+
+
+# BATCH PLANNING #####################################
+def plan_sources(city_inputs_list, menu):
+    """Collect the union of shared source files needed by all cities in city_inputs_list."""
+    plan = {'worldpop': {}, 'wsf': [], 'fabdem': {}, 'demographics': []}
+
+    for city_inputs_file in city_inputs_list:
+        with open(city_inputs_file, 'r') as f:
+            city_inputs = yaml.safe_load(f)
+
+        aoi_bounds = gpd.read_file(f'mnt/01-user-input/AOI/{city_inputs["AOI_shp_name"]}.shp').to_crs(epsg = 4326).bounds
+
+        if menu['population']:
+            plan['worldpop'][city_inputs['country_iso3']] = city_inputs['country_name']
+        if menu['wsf']:
+            plan['wsf'] += [t for t in wsf_tile_names(aoi_bounds) if t not in plan['wsf']]
+        if menu['elevation'] or menu['slope']:
+            for zip_name, small_tiles in fabdem_tile_names(aoi_bounds).items():
+                plan['fabdem'].setdefault(zip_name, [])
+                plan['fabdem'][zip_name] += [t for t in small_tiles if t not in plan['fabdem'][zip_name]]
+        if menu['demographics'] and city_inputs['country_iso3'] not in plan['demographics']:
+            plan['demographics'].append(city_inputs['country_iso3'])
+
+    return plan
+
+def prepare_sources(plan):
+    """Download and mosaic everything in plan once, so that the per-city steps only clip."""
+    failed = []
+
+    for country_iso3, country_name in plan['worldpop'].items():
+        print(f'prepare population for {country_name}')
+        download_worldpop(country_iso3, country_name, failed)
+    if plan['wsf']:
+        print(f"prepare {len(plan['wsf'])} wsf tiles")
+        download_wsf(plan['wsf'])
+    if plan['fabdem']:
+        print(f"prepare {len(plan['fabdem'])} elevation files")
+        download_fabdem(plan['fabdem'])
+    for country_iso3 in plan['demographics']:
+        print(f'prepare demographics for {country_iso3}')
+        download_demographics(country_iso3, failed)
+
+    evict_sources(plan)
+    return failed
+
+def evict_sources(plan):
+    """Trim the source data cache to its budget, keeping every dataset in plan."""
+    keep = [f'worldpop/{c}' for c in plan['worldpop']] + [f'wsf/{t}' for t in plan['wsf']] + \
+           [f'demographics/{c}' for c in plan['demographics']]
+    for zip_name, small_tiles in plan['fabdem'].items():
+        keep += [f'fabdem/{zip_name}'] + [f'fabdem/{t}' for t in small_tiles]
+    source_cache().evict(keep)
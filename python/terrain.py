@@ -0,0 +1,78 @@
+# Slope of a DEM in its own grid.
+# Slope is computed with Horn's 3x3 finite differences (as richdem's slope_degrees) directly on the
+# geographic DEM: the east-west and north-south sizes of each row's cells are taken from the WGS84
+# ellipsoid at the row's latitude, so no reprojection is needed and slopes are not distorted.
+# The DEM is read and the slope written a block of rows at a time, each block read with a one-row
+# halo above and below, so large DEMs are never held in memory whole.
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from zonal import histogram
+from raster_io import raster_writer
+
+
+WGS84_A = 6378137.0
+WGS84_E2 = 6.69437999014e-3
+
+
+def cell_sizes(transform, rows, geographic = True):
+    """East-west and north-south cell sizes in metres for rows of a grid (arrays, one value per row)."""
+    if not geographic:
+        return np.full(len(rows), abs(transform.a)), np.full(len(rows), abs(transform.e))
+
+    lat = np.radians(transform.f + (np.asarray(rows) + 0.5) * transform.e)
+    w = 1 - WGS84_E2 * np.sin(lat) ** 2
+    prime_vertical = WGS84_A / np.sqrt(w)
+    meridional = WGS84_A * (1 - WGS84_E2) / w ** 1.5
+    return np.radians(abs(transform.a)) * prime_vertical * np.cos(lat), np.radians(abs(transform.e)) * meridional
+
+
+def horn_slope(z, valid, dx, dy):
+    """Slope in degrees of the inner rows and columns of a block z with a one-pixel halo.
+    valid marks usable elevations; dx, dy are the cell sizes of the inner rows. Cells whose
+    3x3 neighbourhood is not all valid are NaN."""
+    a, b, c = z[:-2, :-2], z[:-2, 1:-1], z[:-2, 2:]
+    d, f = z[1:-1, :-2], z[1:-1, 2:]
+    g, h, i = z[2:, :-2], z[2:, 1:-1], z[2:, 2:]
+    dzdx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * dx[:, None])
+    dzdy = ((g + 2 * h + i) - (a + 2 * b + c)) / (8 * dy[:, None])
+    slope = np.degrees(np.arctan(np.hypot(dzdx, dzdy)))
+
+    ok = np.ones(slope.shape, dtype = bool)
+    for r in range(3):
+        for col in range(3):
+            ok &= valid[r:r + slope.shape[0], col:col + slope.shape[1]]
+    slope[~ok] = np.nan
+    return slope
+
+
+def slope_raster(dem_path, slope_path, bins, block_rows = 1024, nodata = -9999):
+    """Write the slope of a DEM to slope_path (float32, same grid) and return its histogram over bins.
+    Edge cells and cells next to nodata get nodata, as in richdem."""
+    counts = np.zeros(len(bins) - 1, dtype = np.int64)
+
+    with rasterio.open(dem_path) as src:
+        geographic = src.crs is None or src.crs.is_geographic
+        dem_nodata = src.nodata
+        out_meta = src.meta.copy()
+        out_meta.update({'driver': 'GTiff', 'dtype': 'float32', 'nodata': nodata, 'count': 1})
+
+        with raster_writer(slope_path, out_meta) as dst:
+            for row in range(0, src.height, block_rows):
+                rows = min(block_rows, src.height - row)
+                # one halo row above and below the block, padded with NaN at the DEM edges
+                top, bottom = max(row - 1, 0), min(row + rows + 1, src.height)
+                z = src.read(1, window = Window(0, top, src.width, bottom - top)).astype(np.float64)
+                valid = ~np.isnan(z) if dem_nodata is None or np.isnan(dem_nodata) else (z != dem_nodata) & ~np.isnan(z)
+                z = np.pad(z, ((top - (row - 1), (row + rows + 1) - bottom), (1, 1)), constant_values = np.nan)
+                valid = np.pad(valid, ((top - (row - 1), (row + rows + 1) - bottom), (1, 1)), constant_values = False)
+
+                dx, dy = cell_sizes(src.transform, np.arange(row, row + rows), geographic)
+                with np.errstate(invalid = 'ignore'):
+                    slope = horn_slope(z, valid, dx, dy)
+
+                counts += histogram(slope, bins)
+                dst.write(np.where(np.isnan(slope), nodata, slope).astype(np.float32), 1, window = Window(0, row, src.width, rows))
+
+    return counts
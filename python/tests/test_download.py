@@ -0,0 +1,157 @@
+# Tests of the download manager against a local HTTP server running in a thread.
+# Run from python/ with: python -m unittest discover tests
+
+import os
+import sys
+import socket
+import hashlib
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from download import Downloader, DownloadError, make_session
+
+
+PAYLOAD = os.urandom(256 * 1024)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves PAYLOAD with range support at /file, and misbehaves on purpose at the other paths:
+    /drop closes the connection halfway through the first response, /flaky answers 503 once,
+    /missing answers 404."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get('Range')))
+        count = sum(1 for p, _ in server.requests if p == self.path)
+
+        if self.path == '/missing':
+            self.send_error(404)
+            return
+        if self.path == '/flaky' and count == 1:
+            self.send_error(503)
+            return
+
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'].split('=')[1].split('-')[0])
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(PAYLOAD) - start))
+        self.end_headers()
+
+        if self.path == '/drop' and count == 1:
+            # promise the whole file, send half of it and hang up
+            self.wfile.write(PAYLOAD[:len(PAYLOAD) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(PAYLOAD[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloaderTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.thread = threading.Thread(target = cls.server.serve_forever, daemon = True)
+        cls.thread.start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.requests = []
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'file.bin')
+        # a transfer resumes after its last complete chunk, so chunks are smaller than the payload
+        self.downloader = Downloader(session = make_session(), chunk_size = 16 * 1024, attempts = 3)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_download(self):
+        self.downloader.download(f'{self.url}/file', self.path, size = len(PAYLOAD), sha256 = hashlib.sha256(PAYLOAD).hexdigest())
+        self.assertEqual(self.read(), PAYLOAD)
+        self.assertFalse(os.path.exists(f'{self.path}.part'))
+
+    def test_resume_after_dropped_connection(self):
+        self.downloader.download(f'{self.url}/drop', self.path)
+        self.assertEqual(self.read(), PAYLOAD)
+        # the second request asks only for the bytes that did not arrive
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIsNone(self.server.requests[0][1])
+        resumed_from = int(self.server.requests[1][1].split('=')[1].split('-')[0])
+        self.assertGreater(resumed_from, 0)
+        self.assertLess(resumed_from, len(PAYLOAD))
+
+    def test_size_mismatch(self):
+        with self.assertRaises(DownloadError):
+            self.downloader.download(f'{self.url}/file', self.path, size = len(PAYLOAD) + 1)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(f'{self.path}.part'))
+
+    def test_checksum_mismatch(self):
+        with self.assertRaises(DownloadError):
+            self.downloader.download(f'{self.url}/file', self.path, sha256 = hashlib.sha256(b'other').hexdigest())
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(f'{self.path}.part'))
+
+    def test_client_error_fails_at_once(self):
+        with self.assertRaises(DownloadError):
+            self.downloader.download(f'{self.url}/missing', self.path)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_server_error_is_retried(self):
+        self.downloader.download(f'{self.url}/flaky', self.path)
+        self.assertEqual(self.read(), PAYLOAD)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_dropped_connections_are_tried_attempts_times(self):
+        # a host that hangs up on every connection: one connection per downloader attempt, no hidden retries
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        accepted = []
+
+        def hang_up():
+            while True:
+                try:
+                    connection, _ = listener.accept()
+                except OSError:
+                    return
+                accepted.append(1)
+                connection.close()
+
+        threading.Thread(target = hang_up, daemon = True).start()
+        try:
+            with self.assertRaises(DownloadError):
+                self.downloader.download(f'http://127.0.0.1:{listener.getsockname()[1]}/file', self.path)
+        finally:
+            listener.close()
+        self.assertEqual(len(accepted), 3)
+
+    def test_download_all_reports_errors(self):
+        other = os.path.join(self.folder.name, 'other.bin')
+        results = self.downloader.download_all([(f'{self.url}/file', self.path), (f'{self.url}/missing', other)])
+        self.assertIsNone(results[self.path])
+        self.assertIsInstance(results[other], DownloadError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,34 +1,28 @@
-# DETERMINE WHETHER TO RUN THIS SCRIPT ##############
-import yaml
+from context import RunContext
 
-# load menu
-with open("mnt/01-user-input/menu.yml", 'r') as f:
-    menu = yaml.safe_load(f)
 
-if menu['water_salinity']:
+def run(context):
+    # DETERMINE WHETHER TO RUN THIS SCRIPT ##############
+    menu = context.menu
+
+    if not menu['water_salinity']:
+        return
+
     print('run water salinity')
 
     import os
-    import pandas as pd
-    import geopandas as gpd
     from pathlib import Path
     from os.path import exists
+    from water_salinity_store import read_country, stations_in_aoi
 
     # SET UP #########################################
-    # load city inputs files, to be updated for each city scan
-    with open("mnt/01-user-input/city_inputs.yml", 'r') as f:
-        city_inputs = yaml.safe_load(f)
-
-    city_name_l = city_inputs['city_name'].replace(' ', '_').replace("'", '').lower()
+    city_inputs = context.city_inputs
+    city_name_l = context.city_name_l
     country_name_l = city_inputs['country_name'].replace(' ', '_').replace("'", '').lower()
-
-    # load global inputs, such as data sources that generally remain the same across scans
-    with open("python/global_inputs.yml", 'r') as f:
-        global_inputs = yaml.safe_load(f)
+    global_inputs = context.global_inputs
 
     # Read AOI shapefile --------
-    # transform the input shp to correct prj (epsg 4326)
-    aoi_file = gpd.read_file(f'mnt/city-directories/{city_name_l}/01-user-input/AOI/{city_name_l}.shp').to_crs(epsg = 4326)
+    aoi_file = context.aoi
 
     # Define output folder ---------
     output_folder = Path('mnt/02-process-output')
@@ -39,10 +33,13 @@ if menu['water_salinity']:
     # SET PARAMETERS ################################
     water_bodies = ['Groundwaters', 'Lakes_Reservoirs', 'Rivers']
     data_types = ['database', 'summary']
+    source_folder = Path(f"mnt/source-data/{global_inputs['water_salinity_source']}")
+    # [longitude column, latitude column] of the stations; when set, stations within the AOI are also saved for the city
+    coord_cols = global_inputs.get('water_salinity_coords')
 
 
     # PROCESS DATA ##################################
-    # filter country data
+    # filter country data, read from the country-partitioned store in water_salinity_store.py
     data_folder = Path('data')
     ws_folder = data_folder / 'water_salinity'
 
@@ -51,6 +48,17 @@ if menu['water_salinity']:
     for water_body in water_bodies:
         for data_type in data_types:
             if not exists(ws_folder / f'{country_name_l}_{water_body}_{data_type}.csv'):
-                df = pd.read_csv(Path(f"mnt/source-data/{global_inputs['water_salinity_source']}") / f'{water_body}_{data_type}.csv', low_memory = False)
-                df[df['Country'] == city_inputs['country_name']].to_csv(ws_folder / f'{country_name_l}_{water_body}_{data_type}.csv')
-    
\ No newline at end of file
+                df = read_country(source_folder, water_body, data_type, city_inputs['country_name'])
+                df.to_csv(ws_folder / f'{country_name_l}_{water_body}_{data_type}.csv')
+
+            # filter AOI stations
+            if coord_cols and not exists(context.output_folder_t / f'{city_name_l}_water_salinity_{water_body}_{data_type}.csv'):
+                df = read_country(source_folder, water_body, data_type, city_inputs['country_name'])
+                if all(c in df.columns for c in coord_cols):
+                    stations_in_aoi(df, aoi_file, *coord_cols).to_csv(context.output_folder_t / f'{city_name_l}_water_salinity_{water_body}_{data_type}.csv')
+                else:
+                    print(f'{water_body}_{data_type} has no {coord_cols} columns; stations are not filtered to the AOI')
+
+
+if __name__ == '__main__':
+    run(RunContext())
@@ -0,0 +1,91 @@
+# Country-partitioned Parquet store of the global water salinity database.
+# Each of the six source CSVs (three water bodies times database/summary) is read once and written to
+# python/data/water_salinity/<water_body>_<data_type>/ as one Parquet file per country, with typed
+# columns. A city then reads the file of its own country, and only the columns it asks for, instead
+# of parsing the global CSVs. Run `python python/water_salinity_store.py` from the repository root to
+# ingest ahead of time; otherwise the first step that needs a table ingests it.
+
+import os
+import json
+import shutil
+import pandas as pd
+from pathlib import Path
+
+
+store_folder = Path('python/data/water_salinity')
+
+water_bodies = ['Groundwaters', 'Lakes_Reservoirs', 'Rivers']
+data_types = ['database', 'summary']
+
+
+def partition_name(country):
+    return country.replace(' ', '_').replace("'", '').replace('/', '_').lower()
+
+
+def ingest(source_folder, water_body, data_type):
+    """Partition one source CSV by country, unless the store was built from the same file.
+    Returns the folder of the table."""
+    source = Path(source_folder) / f'{water_body}_{data_type}.csv'
+    table_folder = store_folder / f'{water_body}_{data_type}'
+    stat = os.stat(source)
+    source_key = {'file': source.name, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    try:
+        with open(table_folder / '_source.json', 'r') as f:
+            if json.load(f) == source_key:
+                return table_folder
+    except (FileNotFoundError, ValueError):
+        pass
+
+    print(f'ingest water salinity {water_body} {data_type}')
+    df = pd.read_csv(source, low_memory = False)
+
+    # columns mixing numbers and text are kept as text, so every partition has the same types
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+
+    # cities processed in parallel may ingest at the same time; each writes its own folder and then swaps it in
+    tmp_folder = table_folder.with_name(f'{table_folder.name}.{os.getpid()}.tmp')
+    shutil.rmtree(tmp_folder, ignore_errors = True)
+    os.makedirs(tmp_folder)
+    df.iloc[:0].to_parquet(tmp_folder / '_schema.parquet')
+    for country, country_df in df.groupby('Country', sort = False):
+        country_df.to_parquet(tmp_folder / f'{partition_name(country)}.parquet')
+    with open(tmp_folder / '_source.json', 'w') as f:
+        json.dump(source_key, f)
+
+    shutil.rmtree(table_folder, ignore_errors = True)
+    os.replace(tmp_folder, table_folder)
+    return table_folder
+
+
+def read_country(source_folder, water_body, data_type, country, columns = None):
+    """Rows of one table for a country, with the original row index, ingesting the table first if needed.
+    columns limits the columns that are read."""
+    table_folder = ingest(source_folder, water_body, data_type)
+    partition = table_folder / f'{partition_name(country)}.parquet'
+    if not partition.exists():
+        partition = table_folder / '_schema.parquet'
+    df = pd.read_parquet(partition, columns = columns)
+    # partitions are matched by file name, so countries whose names only differ in case or spacing are told apart here
+    if columns is None or 'Country' in columns:
+        df = df[df['Country'] == country]
+    return df
+
+
+def stations_in_aoi(df, aoi, lon_col, lat_col):
+    """Rows of df whose lon_col/lat_col point (EPSG:4326) falls within the AOI polygons, using a spatial index."""
+    import geopandas as gpd
+
+    stations = gpd.GeoDataFrame(df, geometry = gpd.points_from_xy(df[lon_col], df[lat_col]), crs = 'epsg:4326')
+    hits = stations.sindex.query(aoi.to_crs(epsg = 4326).union_all(), predicate = 'intersects')
+    return df.iloc[sorted(hits)]
+
+
+if __name__ == '__main__':
+    import yaml
+
+    with open('python/global_inputs.yml', 'r') as f:
+        global_inputs = yaml.safe_load(f)
+    for water_body in water_bodies:
+        for data_type in data_types:
+            ingest(Path(f"mnt/source-data/{global_inputs['water_salinity_source']}"), water_body, data_type)
@@ -0,0 +1,96 @@
+# Zonal statistics in a single pass.
+# Every pixel is given the index of its value bin (a category such as a year, or a histogram bin)
+# and, optionally, of its zone in a label raster such as sub-districts; np.bincount over the combined
+# index then returns the counts or sums of all bins in all zones at once, instead of one full-array
+# scan per year or per bin.
+# Without zones, the functions return one value per bin; with zones, a (zone, bin) array whose rows
+# follow the sorted zone labels returned by zone_labels.
+
+import numpy as np
+
+
+def zone_labels(zones, nodata = 0):
+    """Sorted zone labels in a label raster, without nodata."""
+    labels = np.unique(zones)
+    return labels[labels != nodata]
+
+
+def _bincount(bin_index, n_bins, zones = None, weights = None, zone_nodata = 0):
+    """Sum weights (or count pixels) per bin, and per zone if zones is given. bin_index is -1 outside every bin."""
+    bin_index = np.asarray(bin_index).ravel()
+    valid = bin_index >= 0
+    if weights is not None:
+        weights = np.asarray(weights, dtype = np.float64).ravel()
+        valid &= ~np.isnan(weights)
+
+    if zones is None:
+        return np.bincount(bin_index[valid], weights = None if weights is None else weights[valid], minlength = n_bins)
+
+    labels = zone_labels(zones, zone_nodata)
+    zones = np.asarray(zones).ravel()
+    zone_index = np.searchsorted(labels, zones)
+    valid &= (zone_index < len(labels)) & (zones != zone_nodata)
+    index = zone_index[valid] * n_bins + bin_index[valid]
+    return np.bincount(index, weights = None if weights is None else weights[valid], minlength = len(labels) * n_bins).reshape(len(labels), n_bins)
+
+
+def category_index(values, categories):
+    """Index of each value in categories (sorted), or -1 where it is not one of them."""
+    categories = np.asarray(categories)
+    values = np.asarray(values)
+    index = np.searchsorted(categories, values)
+    found = index < len(categories)
+    found[found] = categories[index[found]] == values[found]
+    return np.where(found, index, -1)
+
+
+def bin_index(values, bins):
+    """Index of the histogram bin of each value, with np.histogram's edges: the last bin includes its right edge.
+    -1 outside the bins and for NaN."""
+    values = np.asarray(values)
+    index = np.searchsorted(bins, values, side = 'right') - 1
+    index[values == bins[-1]] = len(bins) - 2
+    index[(index >= len(bins) - 1) | np.isnan(values.astype(np.float64, copy = False))] = -1
+    return index
+
+
+# STATISTICS #########################################
+def category_counts(values, categories, zones = None, weights = None):
+    """Number of pixels (or sum of weights, ignoring NaN) equal to each of categories, e.g. WSF years."""
+    return _bincount(category_index(values, categories), len(categories), zones, weights)
+
+
+def cumulative_counts(values, categories, zones = None, weights = None):
+    """category_counts accumulated over categories, e.g. built-up area up to each year."""
+    return np.cumsum(category_counts(values, categories, zones, weights), axis = -1)
+
+
+def histogram(values, bins, zones = None, weights = None):
+    """Same counts as np.histogram(values, bins), per zone if zones is given."""
+    return _bincount(bin_index(values, bins), len(bins) - 1, zones, weights)
+
+
+def zonal_mean(values, zones = None, nodata = None):
+    """Mean of the values that are not NaN or nodata, like np.nanmean; per zone if zones is given."""
+    values = np.asarray(values, dtype = np.float64)
+    index = np.zeros(values.shape, dtype = np.intp)
+    index[np.isnan(values)] = -1
+    if nodata is not None:
+        index[values == nodata] = -1
+    sums = _bincount(index, 1, zones, values)
+    counts = _bincount(index, 1, zones)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        means = sums / counts
+    return means[..., 0]
+
+
+# LABEL RASTERS ######################################
+def rasterize_zones(zones_gdf, meta, column = None):
+    """Label raster of the polygons in zones_gdf (e.g. sub-districts) on the grid of meta, for the zones argument above.
+    Labels are the values of column, or 1..n in row order; 0 is outside every polygon."""
+    from rasterio.features import rasterize
+
+    zones_gdf = zones_gdf.to_crs(meta['crs'])
+    labels = zones_gdf[column] if column is not None else range(1, len(zones_gdf) + 1)
+    return rasterize(zip(zones_gdf.geometry, labels), out_shape = (meta['height'], meta['width']),
+                     transform = meta['transform'], fill = 0, dtype = 'int32')